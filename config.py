@@ -19,6 +19,9 @@ HISTORY_JSON_DIR = os.path.join(DATA_DIR, "server_history")
 
 # 3. 阿里云百炼 API Key
 DASHSCOPE_API_KEY = os.getenv("DASHSCOPE_API_KEY", "sk-e2df5bf136ff4e88bbd03642aa38373b") # 填入你的Key
+# 文本生成接口地址；压测/离线测试时指向本地替身 scripts/mock_dashscope.py，
+# 例如 http://127.0.0.1:8089/api/v1/services/aigc/text-generation/generation
+DASHSCOPE_API_URL = os.getenv("DASHSCOPE_API_URL", "https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation")
 
 # 4. PaddleOCR 服务配置
 OCR_HOST = "0.0.0.0"
@@ -29,4 +32,163 @@ OCR_URL = f"http://localhost:{OCR_PORT}/ocr"
 AUTO_REPLY_ENABLED = True  # 自动回复标志位，设置为True时启用自动回复
 BOT_NAME = "耄仙人"
 TOP_K = 30 # 从向量数据库中检索的Top K个文档
-NEXT_N = 10 # 接下来的N条对话消息
\ No newline at end of file
+NEXT_N = 10 # 接下来的N条对话消息
+
+# 6. 聊天记录存储
+# "jsonl": 按联系人分段的 JSONL 文件；"sqlite": SQLite 数据库 (WAL 模式，带索引)
+# 切换到 sqlite 前先执行一次迁移: python -m modules.msg.history_sqlite --migrate
+HISTORY_BACKEND = "jsonl"
+HISTORY_DB_PATH = os.path.join(DATA_DIR, "history.db")
+# 每个联系人按段追加写入 JSONL，单段超过该大小后轮转
+HISTORY_SEGMENT_MAX_BYTES = 512 * 1024
+# 每个联系人最多保留的段数，更早的段会被删除
+HISTORY_MAX_SEGMENTS = 8
+
+# 进程内最近消息缓存：每个联系人保留的记录数，以及所有联系人合计的内存上限 (估算)
+RECENT_CACHE_PER_CONTACT = 200
+RECENT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# 联系人清单：/api/msg/list 的数据来源，丢失时可用 python -m modules.msg.contact_manifest --rebuild 重建
+CONTACT_MANIFEST_FILE = os.path.join(DATA_DIR, "contact_manifest.json")
+CONTACT_MANIFEST_FLUSH_INTERVAL = 2.0  # 最短写盘间隔 (秒)
+
+# 图片/文件索引：存在性检查结果的缓存时间 (秒)，以及索引中保存的预览长度
+MEDIA_INDEX_DIR = os.path.join(DATA_DIR, "media_index")
+MEDIA_STAT_TTL = 60
+MEDIA_PREVIEW_CHARS = 200
+
+# 后台入库任务 (OCR / 文件内容提取)：工作线程数、失败重试次数、未完成任务日志
+INGEST_WORKERS = 2
+INGEST_MAX_RETRIES = 3
+INGEST_JOURNAL_FILE = os.path.join(DATA_DIR, "ingest_pending.jsonl")
+INGEST_MAX_QUEUE = 1000               # 内存队列上限，超出的任务只写入任务日志，稍后再载入
+INGEST_JOURNAL_COMPACT_EVERY = 500    # 每完成多少个任务压缩一次任务日志
+
+# 7. 并发控制：各子系统阻塞操作所用线程池的大小 (见 modules/executors.py)
+EXECUTOR_LIMITS = {
+    "llm": 8,    # 调用 DashScope 大模型
+    "ocr": 2,    # 请求 PaddleOCR 服务
+    "disk": 4,   # 聊天记录、设置等文件读写
+    "cpu": 2,    # 文档解析、图片回填、向量检索
+    "reply_high": 2,  # 被 @ 时的自动回复 (高优先级，专用线程)
+    "speculative": 4,  # 自动回复的推测执行 (与 whether_reply 并行的向量检索和草稿生成)
+}
+
+# 8. OCR 结果缓存：按图片内容 (SHA-256) 缓存 PaddleOCR 结果，超过容量按最近使用淘汰
+OCR_CACHE_DIR = os.path.join(DATA_DIR, "ocr_cache")
+OCR_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# 感知哈希 (dHash) 匹配：重新压缩过的同一张图也能命中；需要 Pillow
+OCR_CACHE_PHASH = False
+OCR_CACHE_PHASH_DISTANCE = 4  # 允许的最大汉明距离 (0-64)
+
+# 文档全文缓存：按文件内容哈希缓存提取出的完整文本，/api/doc/summarize、/api/doc/translate 各自截取所需长度
+DOC_TEXT_CACHE_DIR = os.path.join(DATA_DIR, "doc_text_cache")
+DOC_TEXT_CACHE_MAX_BYTES = 128 * 1024 * 1024
+
+# @ 回复的时间预算 (秒)：需小于 NCatBot 请求 /api/message/save 的 10 秒超时
+MENTION_REPLY_BUDGET = 8.0
+# 高优先级任务进行中时，后台 OCR / 文件提取最多暂缓的时间 (秒)
+LOW_PRIORITY_MAX_DEFER = 5.0
+
+# 自动回复决策合并：非 @ 消息先等待该窗口 (秒)，期间同一聊天的新消息会取代旧消息，只评估最新状态
+# 窗口 + 大模型耗时需小于 NCatBot 的 10 秒超时
+REPLY_COALESCE_WINDOW = 1.5
+REPLY_MAX_CONCURRENT_PER_CHAT = 1  # 每个聊天同时进行的回复决策数上限
+
+# whether_reply 本地预筛：规则 + m3e-small 分类器，只有拿不准的消息才调用大模型
+# 训练分类器: python -m modules.msg.reply_gate --train
+REPLY_GATE_ENABLED = True
+REPLY_GATE_DECISIONS_LOG = os.path.join(DATA_DIR, "reply_decisions.jsonl")
+REPLY_GATE_MODEL_PATH = os.path.join(DATA_DIR, "reply_gate_model.npz")
+REPLY_GATE_EMBEDDING_MODEL = "models/embedding/m3e-small"
+REPLY_GATE_NO_THRESHOLD = 0.1    # 分类器给出的回复概率低于该值时直接判 NO
+REPLY_GATE_YES_THRESHOLD = 0.95  # 高于该值时直接判 YES
+REPLY_GATE_SHADOW_RATE = 0.05    # 本地已判定的消息中仍调用大模型抽查的比例，用于统计一致率
+
+# 9. 大模型客户端 (modules/llm_client.py)：所有调用方共用一个带连接池的会话
+LLM_POOL_SIZE = 16      # keep-alive 连接池大小，应不小于 EXECUTOR_LIMITS 中 llm + reply_high 的线程数
+LLM_MAX_RETRIES = 3     # 连接错误、超时、429、5xx 的重试次数 (指数退避 + 抖动)
+# 按调用类型覆盖模型参数 (model / max_tokens / temperature / timeout)，未写的沿用内置默认值
+LLM_PROFILES = {
+    "default": {"model": "qwen-plus", "max_tokens": 2000, "temperature": 0.3, "timeout": 300},
+    "whether_reply": {"max_tokens": 10, "temperature": 0.1, "timeout": 30},
+    "auto_reply": {"timeout": 60},
+}
+
+# 大模型响应缓存 (modules/llm_cache.py)：按 (模型, 参数, 提示词) 缓存输出，各接口可传 fresh=true 跳过
+LLM_CACHE_ENABLED = True
+LLM_CACHE_DB_PATH = os.path.join(DATA_DIR, "llm_cache.db")
+LLM_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# 各调用类型的缓存有效期 (秒)，0 表示不缓存
+LLM_CACHE_TTL = {
+    "default": 24 * 3600,          # 文档总结、重要消息提醒等自定义提示词
+    "summarize": 7 * 24 * 3600,
+    "translate": 30 * 24 * 3600,
+    "whether_reply": 0,            # 自动回复相关的判断和生成需要实时结果
+    "auto_reply": 0,
+}
+
+# 10. 上下文构建 (modules/msg/context_builder.py)：按 token 预算裁剪发给大模型的聊天记录
+# 从最新消息往回取，预算用完即停止；丢弃纯表情、重复刷屏，截断过长的正文和 OCR/文件内容
+CONTEXT_TOKEN_BUDGETS = {
+    "default": 4000,
+    "summarize": 6000,   # /api/msg/summarize
+    "notify": 4000,      # 重要消息提醒 (JSON 格式，每条额外约 15 tokens)
+    "auto_reply": 1500,  # 自动回复的聊天历史，只需要最近的上下文
+}
+CONTEXT_EXTRA_CHARS = 300    # 每条图片/文件消息附带的 OCR/文件内容最多保留的字符数
+CONTEXT_MESSAGE_CHARS = 500  # 单条消息 (含附带内容) 最多保留的字符数
+TOKENIZER_PATH = None        # 本地 tokenizer 目录 (如 Qwen 的 tokenizer)，为空时按字符数估算
+
+# 11. 大模型全局限流 (modules/llm_limiter.py)：按百炼账号的配额设置
+LLM_RATE_LIMIT_RPM = 300       # 每分钟请求数
+LLM_RATE_LIMIT_TPM = 500000    # 每分钟 token 数 (输入 + 输出)
+LLM_MAX_INFLIGHT = 16          # 同时在途的请求数
+LLM_LIMITER_MAX_QUEUE = 64     # 排队等待的请求上限，超出后直接拒绝
+# 调用类型 -> 优先级 (interactive > normal > batch)
+LLM_PRIORITY = {
+    "whether_reply": "interactive",
+    "auto_reply": "interactive",
+    "summarize": "normal",
+    "default": "normal",
+    "translate": "batch",
+}
+# 各优先级最长排队时间 (秒)，超时后放弃
+LLM_LIMITER_MAX_WAIT = {"interactive": 10.0, "normal": 60.0, "batch": 300.0}
+
+# 12. 聊天记录分段总结 (modules/msg/summarizer.py)：超出单次总结预算时按时间分段并发总结再合并
+CONTEXT_TOKEN_BUDGETS["summarize_map"] = 60000  # 分段总结时读取的聊天记录总预算
+SUMMARY_CHUNK_TOKENS = 3000   # 每段的 token 上限
+SUMMARY_SESSION_GAP = 1800    # 相邻消息间隔超过该秒数视为新的会话，优先在这里分段
+SUMMARY_REDUCE_TOKENS = 6000  # 合并阶段单次输入的 token 上限，超出时先分组合并
+
+# 13. 滚动总结 (modules/msg/rolling_summary.py)：保存每个联系人的总结和水位，再次总结时只合并新消息
+ROLLING_SUMMARY_ENABLED = True  # /api/msg/summarize 的 mode=auto 使用滚动总结
+ROLLING_SUMMARY_DIR = os.path.join(DATA_DIR, "rolling_summaries")
+ROLLING_SUMMARY_MAX_FOLDS = 20          # 连续增量合并达到该次数后完整重新总结，避免总结逐渐失真
+ROLLING_SUMMARY_MAX_AGE = 24 * 3600     # 距上次完整总结超过该秒数后完整重新总结
+
+# 14. whether_reply 批处理 (modules/msg/reply_batcher.py)：多个聊天的待判断消息攒成一批，一次调用大模型
+REPLY_BATCH_ENABLED = True
+REPLY_BATCH_MAX_SIZE = 8      # 每批最多的消息数
+REPLY_BATCH_MAX_WAIT = 0.3    # 第一条消息最多为攒批额外等待的秒数 (加上合并窗口与生成耗时需小于 NCatBot 的 10 秒超时)
+
+# 15. 自动回复推测执行 (modules/msg/auto_reply.py)：向量检索与 whether_reply 同时进行，判断为 NO 时丢弃
+REPLY_SPECULATIVE_ENABLED = True
+REPLY_SPECULATIVE_DRAFT = False  # 同时提前生成回复草稿：YES 时省去生成耗时，但 NO 时浪费一次大模型调用
+
+# 16. 重要消息提醒 (modules/msg/notifier.py)：记录每个联系人已分析到的位置，只分析新消息
+NOTIFY_STORE_DIR = os.path.join(DATA_DIR, "important_messages")
+NOTIFY_MAX_IMPORTANT = 200  # 每个联系人最多保留的重要消息条数
+NOTIFY_PENDING_MAX_AGE = 600  # 新消息的 OCR/文件提取未完成时水位停在它之前；超过该秒数仍未完成则不再等待
+
+# 17. 重要消息预筛选 (modules/msg/importance.py)：入库时本地评分，提醒时只把高分消息及其上下文交给大模型
+NOTIFY_PREFILTER_ENABLED = True
+NOTIFY_IMPORTANCE_THRESHOLD = 2.0  # 分数达到该值的消息才交给大模型判断 (权重见 importance.SIGNAL_WEIGHTS)
+NOTIFY_CONTEXT_BEFORE = 2          # 每条高分消息之前附带的相邻消息条数
+NOTIFY_CONTEXT_AFTER = 1           # 每条高分消息之后附带的相邻消息条数
+
+# 18. 向量检索 (scripts/vector_db_manager.py)：嵌入模型和向量库在进程内共享，只加载一次
+VECTOR_DB_EMBEDDING_MODEL = "models/embedding/m3e-small"
+AUTO_REPLY_VECTOR_DB_PATH = VECTOR_DB_PATH  # 自动回复检索风格参考所用的向量库
+VECTOR_DB_WARMUP = True                      # 服务启动时预先加载并跑一次检索
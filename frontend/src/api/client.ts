@@ -2,6 +2,8 @@ import axios from 'axios';
 
 const baseURL = import.meta.env.VITE_API_BASE || 'http://localhost:8000';
 
+export const API_BASE = baseURL;
+
 export const api = axios.create({
   baseURL,
   timeout: 120000, // 增加到 120 秒，以处理长时间的 AI 调用
@@ -15,3 +17,44 @@ export const downloadBlob = (blob: Blob, filename: string) => {
   a.click();
   window.URL.revokeObjectURL(url);
 };
+
+// 读取后端 SSE 流式接口 (data: {"delta"} / event: done / event: error)，每收到一段文本回调一次
+export const postStream = async (
+  path: string,
+  form: FormData,
+  onDelta: (text: string) => void,
+): Promise<Record<string, unknown>> => {
+  const res = await fetch(`${API_BASE}${path}`, { method: 'POST', body: form });
+  const contentType = res.headers.get('content-type') || '';
+  if (!res.ok || !res.body || !contentType.includes('text/event-stream')) {
+    // 没有内容可总结等情况下后端直接返回普通 JSON
+    return res.json();
+  }
+
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let sep = buffer.indexOf('\n\n');
+    while (sep !== -1) {
+      const block = buffer.slice(0, sep);
+      buffer = buffer.slice(sep + 2);
+      sep = buffer.indexOf('\n\n');
+
+      let event = 'message';
+      let data = '';
+      for (const line of block.split('\n')) {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) data += line.slice(5).trim();
+      }
+      const payload = data ? JSON.parse(data) : {};
+      if (event === 'done') return payload;
+      if (event === 'error') throw new Error(payload.error || 'stream error');
+      if (payload.delta) onDelta(payload.delta);
+    }
+  }
+  return {};
+};
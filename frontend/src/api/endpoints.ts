@@ -1,4 +1,4 @@
-import { api } from './client';
+import { api, postStream } from './client';
 import type { Contact, DocItem, ImageItem, VectorDBList, ReplySettingResponse } from './types';
 
 export const fetchContacts = async (typeFilter?: string) => {
@@ -25,10 +25,25 @@ export const summarizeChat = async (contact_id: string, limit = 100, target_lang
   return res.data;
 };
 
-export const notifyChat = async (contact_id: string, limit = 100) => {
+// 流式总结：onDelta 每收到一段文本调用一次，返回结束事件中的附加信息
+export const summarizeChatStream = async (
+  contact_id: string,
+  onDelta: (text: string) => void,
+  limit = 100,
+  target_lang = 'Chinese',
+) => {
   const form = new FormData();
   form.append('contact_id', contact_id);
   form.append('limit', String(limit));
+  form.append('target_lang', target_lang);
+  return postStream('/api/msg/summarize/stream', form, onDelta);
+};
+
+export const notifyChat = async (contact_id: string, limit = 100, rescan = false) => {
+  const form = new FormData();
+  form.append('contact_id', contact_id);
+  form.append('limit', String(limit));
+  if (rescan) form.append('rescan', 'true');
   const res = await api.post('/api/msg/notification', form);
   return res.data;
 };
@@ -47,6 +62,19 @@ export const summarizeDocs = async (contact_id: string, limit = 5, target_lang =
   return res.data;
 };
 
+export const summarizeDocsStream = async (
+  contact_id: string,
+  onDelta: (text: string) => void,
+  limit = 5,
+  target_lang = 'Chinese',
+) => {
+  const form = new FormData();
+  form.append('contact_id', contact_id);
+  form.append('limit', String(limit));
+  form.append('target_lang', target_lang);
+  return postStream('/api/doc/summarize/stream', form, onDelta);
+};
+
 export const translateDoc = async (file_path: string, target_lang = 'Chinese') => {
   const form = new FormData();
   form.append('file_path', file_path);
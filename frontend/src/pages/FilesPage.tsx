@@ -1,6 +1,6 @@
 import { useEffect, useMemo, useState } from 'react';
 import { useMutation, useQuery } from '@tanstack/react-query';
-import { fetchContacts, fetchDocs, summarizeDocs, translateDoc } from '../api/endpoints';
+import { fetchContacts, fetchDocs, summarizeDocsStream, translateDoc } from '../api/endpoints';
 import type { Contact } from '../api/types';
 import { downloadBlob } from '../api/client';
 import Modal from '../components/Modal';
@@ -35,11 +35,17 @@ const FilesPage = () => {
     enabled: !!contactId,
   });
 
+  // 流式摘要：先打开弹窗，模型每生成一段就追加显示
   const summarizeMutation = useMutation({
-    mutationFn: () => summarizeDocs(contactId, limit, targetLang),
-    onSuccess: (res) => {
-      setSummaryText(res?.summary || '无内容');
+    mutationFn: () => {
+      setSummaryText('');
       setSummaryOpen(true);
+      return summarizeDocsStream(contactId, (delta) => setSummaryText((prev) => prev + delta), limit, targetLang);
+    },
+    onSuccess: (res) => {
+      // 最近没有文件等情况下后端直接返回普通 JSON
+      const summary = typeof res?.summary === 'string' ? res.summary : '';
+      setSummaryText((prev) => prev || summary || '无内容');
     },
     onError: () => toast.show('生成摘要失败', 'error'),
   });
@@ -126,7 +132,11 @@ const FilesPage = () => {
             style={{ width: 80 }}
           />
         </div>
-        {summaryText ? <MarkdownRenderer content={summaryText} /> : <p>暂无内容</p>}
+        {summaryText ? (
+          <MarkdownRenderer content={summaryText} />
+        ) : (
+          <p>{summarizeMutation.isPending ? '生成中...' : '暂无内容'}</p>
+        )}
       </Modal>
     </div>
   );
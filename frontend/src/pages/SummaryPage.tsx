@@ -1,6 +1,6 @@
 import { useState, useEffect } from 'react';
 import { useMutation, useQuery } from '@tanstack/react-query';
-import { notifyChat, summarizeChat, fetchContacts } from '../api/endpoints';
+import { notifyChat, summarizeChatStream, fetchContacts } from '../api/endpoints';
 import Modal from '../components/Modal';
 import { useToast } from '../components/ToastProvider';
 import MarkdownRenderer from '../components/MarkdownRenderer';
@@ -22,11 +22,17 @@ const SummaryPage = () => {
     queryFn: () => fetchContacts(),
   });
 
+  // 流式摘要：先打开弹窗，模型每生成一段就追加显示
   const summaryMutation = useMutation({
-    mutationFn: () => summarizeChat(contactId, limit, targetLang),
-    onSuccess: (res) => {
-      setSummaryText(res?.summary || '无内容');
+    mutationFn: () => {
+      setSummaryText('');
       setSummaryOpen(true);
+      return summarizeChatStream(contactId, (delta) => setSummaryText((prev) => prev + delta), limit, targetLang);
+    },
+    onSuccess: (res) => {
+      // 后端没有可总结内容时直接返回普通 JSON，不经过流式片段
+      const summary = typeof res?.summary === 'string' ? res.summary : '';
+      setSummaryText((prev) => prev || summary || '无内容');
     },
     onError: () => toast.show('获取摘要失败', 'error'),
   });
@@ -88,13 +94,17 @@ const SummaryPage = () => {
       <div className="card">
         <h3>说明</h3>
         <p className="muted">
-          直接调用后端 /api/msg/summarize 与 /api/msg/notification。
+          直接调用后端 /api/msg/summarize/stream (流式) 与 /api/msg/notification。
           确保 contact_id 在后端历史记录中已存在，否则会返回“未找到”。
         </p>
       </div>
 
       <Modal open={summaryOpen} onClose={() => setSummaryOpen(false)} title="聊天摘要">
-        {summaryText ? <MarkdownRenderer content={summaryText} /> : <p>暂无内容</p>}
+        {summaryText ? (
+          <MarkdownRenderer content={summaryText} />
+        ) : (
+          <p>{summaryMutation.isPending ? '生成中...' : '暂无内容'}</p>
+        )}
       </Modal>
 
       <Modal open={notifyOpen} onClose={() => setNotifyOpen(false)} title="重要消息">
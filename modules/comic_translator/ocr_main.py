@@ -11,14 +11,15 @@ import threading
 import json
 
 
-from utils.paddle_ocr import image_to_base64, ocr_image, extract_text
-from utils.translator3 import BailianTranslator, save_translated_data
-from utils.cv_inpaint import process_image_with_ocr_data
-
+# translator3 依赖项目根目录下的 modules.llm_client，需先把根目录加入路径
 project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 sys.path.insert(0, project_root)
 import config
 
+from utils.paddle_ocr import image_to_base64, ocr_image, extract_text
+from utils.translator3 import BailianTranslator, save_translated_data
+from utils.cv_inpaint import process_image_with_ocr_data
+
 app = FastAPI()
 
 SAVE_DIR = "./received_images"
@@ -0,0 +1,251 @@
+# modules/comic_translator/utils/ocr_cache.py
+"""
+OCR 结果缓存（按图片内容寻址）
+
+群聊里同一张表情包、截图、通知会被反复转发，每次都调用 PaddleOCR 很浪费。
+这里以图片字节的 SHA-256 为键，把 OCR 服务返回的原始结果 (result 字段) 落盘：
+
+    OCR_CACHE_DIR/<sha256 前两位>/<sha256>.json
+
+- 磁盘占用超过 OCR_CACHE_MAX_BYTES 时按最近使用时间 (LRU) 淘汰
+- 可选的感知哈希 (dHash) 匹配：同一张图被重新压缩后字节不同，但 dHash 相近，
+  汉明距离不超过 OCR_CACHE_PHASH_DISTANCE 即视为命中。需要 Pillow，默认关闭
+- stats() 给出命中/未命中次数，以及命中所节省的 OCR 耗时（按首次识别耗时累计）
+
+消息入库的后台 OCR 和 /api/image/translate 共用同一个缓存。
+"""
+import os
+import json
+import time
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+
+import config
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow 不可用时只做精确匹配
+    Image = None
+
+OCR_CACHE_DIR = getattr(config, "OCR_CACHE_DIR", os.path.join(config.DATA_DIR, "ocr_cache"))
+
+
+def _dhash(image_path, size=8):
+    """计算 64 位差值哈希，失败时返回 None"""
+    if Image is None:
+        return None
+    try:
+        with Image.open(image_path) as img:
+            img = img.convert("L").resize((size + 1, size), Image.LANCZOS)
+            pixels = list(img.getdata())
+    except Exception:
+        return None
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+
+class OcrCache:
+    """
+    磁盘 OCR 缓存，内存里只保留索引：sha256 -> {size, dhash, ocr_seconds}
+    """
+
+    def __init__(self, cache_dir=OCR_CACHE_DIR, max_bytes=None, use_phash=None, phash_distance=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes if max_bytes is not None else getattr(config, "OCR_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+        self.use_phash = (use_phash if use_phash is not None else getattr(config, "OCR_CACHE_PHASH", False)) and Image is not None
+        self.phash_distance = phash_distance if phash_distance is not None else getattr(config, "OCR_CACHE_PHASH_DISTANCE", 4)
+        self._index = None  # OrderedDict，旧 -> 新
+        self._total_bytes = 0
+        self._lock = threading.RLock()
+
+        self._hits = 0
+        self._phash_hits = 0
+        self._misses = 0
+        self._saved_seconds = 0.0
+        self._ocr_seconds = 0.0
+
+    def _entry_path(self, sha):
+        return os.path.join(self.cache_dir, sha[:2], f"{sha}.json")
+
+    def _ensure_loaded(self):
+        """扫描缓存目录建立索引，按文件 mtime (即最近使用时间) 排序"""
+        if self._index is not None:
+            return
+        with self._lock:
+            if self._index is not None:
+                return
+            found = []
+            if os.path.isdir(self.cache_dir):
+                for sub in os.listdir(self.cache_dir):
+                    sub_dir = os.path.join(self.cache_dir, sub)
+                    if not os.path.isdir(sub_dir):
+                        continue
+                    for name in os.listdir(sub_dir):
+                        if not name.endswith(".json"):
+                            continue
+                        path = os.path.join(sub_dir, name)
+                        try:
+                            st = os.stat(path)
+                            with open(path, "r", encoding="utf-8") as f:
+                                data = json.load(f)
+                        except (OSError, ValueError):
+                            continue
+                        found.append((st.st_mtime, name[:-5], {
+                            "size": st.st_size,
+                            "dhash": data.get("dhash"),
+                            "ocr_seconds": data.get("ocr_seconds", 0.0),
+                        }))
+            found.sort(key=lambda x: x[0])
+            self._index = OrderedDict((sha, meta) for _, sha, meta in found)
+            self._total_bytes = sum(meta["size"] for meta in self._index.values())
+            if found:
+                print(f"[OcrCache] 已加载 {len(found)} 条 OCR 缓存，占用 {self._total_bytes // 1024} KB")
+
+    # ---------- 查询 ----------
+
+    def _find_similar(self, dhash):
+        if dhash is None:
+            return None
+        best, best_distance = None, self.phash_distance + 1
+        for sha, meta in self._index.items():
+            other = meta.get("dhash")
+            if other is None:
+                continue
+            distance = bin(dhash ^ other).count("1")
+            if distance < best_distance:
+                best, best_distance = sha, distance
+        return best
+
+    def _read(self, sha):
+        try:
+            with open(self._entry_path(sha), "r", encoding="utf-8") as f:
+                data = json.load(f)
+            os.utime(self._entry_path(sha), None)  # 记录最近使用时间，重启后仍按 LRU 淘汰
+            return data
+        except (OSError, ValueError):
+            with self._lock:
+                meta = self._index.pop(sha, None)
+                if meta:
+                    self._total_bytes -= meta["size"]
+            return None
+
+    def get(self, sha, dhash=None):
+        """按 sha256（以及可选的 dHash）查找，返回 OCR 原始结果，未命中返回 None"""
+        self._ensure_loaded()
+        with self._lock:
+            key = sha if sha in self._index else None
+            similar = False
+            if key is None and self.use_phash:
+                key = self._find_similar(dhash)
+                similar = key is not None
+            if key is None:
+                return None
+            self._index.move_to_end(key)
+
+        data = self._read(key)
+        if data is None:
+            return None
+        with self._lock:
+            self._hits += 1
+            if similar:
+                self._phash_hits += 1
+            self._saved_seconds += data.get("ocr_seconds", 0.0)
+        return data.get("result")
+
+    # ---------- 写入 ----------
+
+    def put(self, sha, result, ocr_seconds=0.0, dhash=None):
+        self._ensure_loaded()
+        entry = {
+            "sha256": sha,
+            "dhash": dhash,
+            "ocr_seconds": round(ocr_seconds, 3),
+            "created": int(time.time()),
+            "result": result,
+        }
+        path = self._entry_path(sha)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except OSError as e:
+            print(f"[OcrCache] 写入缓存失败: {e}")
+            return
+
+        with self._lock:
+            old = self._index.pop(sha, None)
+            if old:
+                self._total_bytes -= old["size"]
+            self._index[sha] = {"size": size, "dhash": dhash, "ocr_seconds": entry["ocr_seconds"]}
+            self._total_bytes += size
+            self._evict()
+
+    def _evict(self):
+        """超出容量时从最久未使用的条目开始删除"""
+        while self._total_bytes > self.max_bytes and len(self._index) > 1:
+            sha, meta = self._index.popitem(last=False)
+            self._total_bytes -= meta["size"]
+            try:
+                os.remove(self._entry_path(sha))
+            except OSError:
+                pass
+
+    # ---------- 对外接口 ----------
+
+    def ocr_file(self, image_path, run_ocr):
+        """
+        返回图片的 OCR 原始结果：先查缓存，未命中时调用 run_ocr(base64_str) 并写入缓存
+        run_ocr 抛出的异常原样向上传递，失败结果不会被缓存
+        """
+        with open(image_path, "rb") as f:
+            data = f.read()
+        sha = hashlib.sha256(data).hexdigest()
+        dhash = _dhash(image_path) if self.use_phash else None
+
+        cached = self.get(sha, dhash)
+        if cached is not None:
+            print(f"[OcrCache] 命中缓存: {os.path.basename(image_path)}")
+            return cached
+
+        start = time.time()
+        result = run_ocr(base64.b64encode(data).decode("utf-8"))
+        elapsed = time.time() - start
+        with self._lock:
+            self._misses += 1
+            self._ocr_seconds += elapsed
+        self.put(sha, result, elapsed, dhash)
+        return result
+
+    def stats(self):
+        self._ensure_loaded()
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._index),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "phash_hits": self._phash_hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 3) if lookups else 0.0,
+                "ocr_seconds": round(self._ocr_seconds, 2),
+                "saved_seconds": round(self._saved_seconds, 2),
+            }
+
+
+_ocr_cache = OcrCache()
+
+
+def get_ocr_cache():
+    """进程内共享的 OCR 缓存"""
+    return _ocr_cache
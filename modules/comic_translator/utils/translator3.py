@@ -1,11 +1,9 @@
 # translator.py
 import json
-import requests
-import time
 from typing import List, Dict, Any, Union
 from pathlib import Path
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+
+from modules.llm_client import get_llm_client
 
 class BailianTranslator:
     """
@@ -20,18 +18,10 @@ class BailianTranslator:
             api_key: 百炼API密钥
         """
         self.api_key = api_key
-        self.api_url = "https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation"
-        self.headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        # 创建会话并配置重试机制
-        self.session = requests.Session()
-        retry = Retry(total=3, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504])
-        adapter = HTTPAdapter(max_retries=retry)
-        self.session.mount('https://', adapter)
+        # 共用进程内的大模型客户端 (连接池、统一重试)
+        self.client = get_llm_client(api_key)
     
-    def _call_api(self, text: str, context: str = "", target_lang: str = "Chinese") -> str:
+    def _call_api(self, text: str, context: str = "", target_lang: str = "Chinese", fresh: bool = False) -> str:
         """
         调用百炼API进行翻译
         
@@ -39,6 +29,7 @@ class BailianTranslator:
             text: 待翻译文本
             context: 上下文文本，用于提供整体理解
             target_lang: 目标语言代码
+            fresh: 为 True 时跳过响应缓存，强制重新翻译
             
         Returns:
             翻译后的文本
@@ -50,64 +41,17 @@ class BailianTranslator:
 
         prompt = f"Translate the following text to {target_lang_name}. Only output the translated text without any additional explanation:\n\n{text}.Return in the same format as the original text."
         
-        payload = {
-            "model": "qwen-plus",
-            "input": {
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ]
-            },
-            "parameters": {
-                "max_tokens": 2000,
-                "temperature": 0.3  # 较低温度保证翻译准确性
-            }
-        }
-        
-        max_retries = 3
-        retry_count = 0
-        
-        while retry_count < max_retries:
-            try:
-                response = self.session.post(
-                    self.api_url,
-                    headers=self.headers,
-                    json=payload,
-                    timeout=300
-                )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    # 修正：检查API返回的实际结构
-                    if 'output' in result:
-                        # 尝试获取text字段（实际返回格式）
-                        if 'text' in result['output']:
-                            return result['output']['text'].strip()
-                        # 保留原有逻辑以兼容可能的其他格式
-                        elif 'choices' in result['output'] and result['output']['choices']:
-                            return result['output']['choices'][0]['message']['content'].strip()
-                    
-                # 错误处理
-                raise Exception(f"API call failed: {response.status_code} - {response.text}")
-                
-            except (requests.exceptions.SSLError, requests.exceptions.ConnectionError) as e:
-                # 处理SSL和连接错误，进行重试
-                retry_count += 1
-                if retry_count >= max_retries:
-                    print(f"Translation error for text '{text[:50]}...' after {max_retries} retries: {e}")
-                    return text  # 翻译失败时返回原文
-                print(f"SSL/Connection error, retrying ({retry_count}/{max_retries})...")
-                time.sleep(1)  # 等待1秒后重试
-            except Exception as e:
-                print(f"Translation error for text '{text[:50]}...': {e}")
-                return text  # 翻译失败时返回原文
+        try:
+            # 连接错误、超时和 5xx 的重试由共享客户端统一处理
+            return self.client.generate(prompt, profile="translate", fresh=fresh)
+        except Exception as e:
+            print(f"Translation error for text '{str(text)[:50]}...': {e}")
+            return text  # 翻译失败时返回原文
     
 
     
     
-    def translate_item(self, item: Dict[str, Any], target_lang: str = "en") -> Dict[str, Any]:
+    def translate_item(self, item: Dict[str, Any], target_lang: str = "en", fresh: bool = False) -> Dict[str, Any]:
         """
         翻译单个项目
         
@@ -129,11 +73,11 @@ class BailianTranslator:
                         rec_texts = pruned_result["rec_texts"]
                         # 现在可以处理 rec_texts 了
                         # print("翻译前:",rec_texts)
-                        translated_item['ocrResults'][0]['prunedResult']['rec_texts'] = self._call_api(rec_texts, "", target_lang)
+                        translated_item['ocrResults'][0]['prunedResult']['rec_texts'] = self._call_api(rec_texts, "", target_lang, fresh=fresh)
         return translated_item
     
 
-    def translate_json_file(self, file_path: Union[str, Path], target_lang: str = "Chinese") -> Union[List[Dict], Dict]:
+    def translate_json_file(self, file_path: Union[str, Path], target_lang: str = "Chinese", fresh: bool = False) -> Union[List[Dict], Dict]:
         """
         翻译JSON文件
         
@@ -155,7 +99,7 @@ class BailianTranslator:
             print("list翻译")
         else:
             # 如果是单个对象，翻译该对象
-            translated_data = self.translate_item(original_data, target_lang)
+            translated_data = self.translate_item(original_data, target_lang, fresh=fresh)
             print("单个翻译")
         return translated_data
     
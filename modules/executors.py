@@ -0,0 +1,191 @@
+# modules/executors.py
+"""
+按子系统划分的阻塞任务线程池
+
+FastAPI 的 async 路由里不能直接调用 requests / 文件读写 / cv2 这类阻塞代码，
+否则一个总结请求就会卡住整个事件循环（包括 NCatBot 的 /api/message/save）。
+这里为每个子系统准备一个大小可配置的线程池 (config.EXECUTOR_LIMITS)：
+
+    llm   调用 DashScope 大模型
+    ocr   请求 PaddleOCR 服务
+    disk  聊天记录、设置等文件读写
+    cpu   文档解析、图片回填、向量检索等 CPU 密集操作 (cv2 / numpy 计算时会释放 GIL)
+    reply_high  被 @ 时的自动回复 (高优先级，独占线程)
+
+高优先级通道 (HIGH_PRIORITY_LANES) 有任务排队或执行时，后台低优先级工作
+(入库 OCR、文件提取等) 会通过 wait_for_high_priority_idle() 暂缓开始新任务，
+最多等待 LOW_PRIORITY_MAX_DEFER 秒，避免它们和 @ 回复争抢 OCR 服务与 CPU，
+同时也不会被无限期饿死。
+向量库的构建/更新不在服务进程内进行 (离线脚本 scripts/json_to_db_text.py 单独运行)，
+服务内只有启动时的加载与预热 (在接收请求之前完成)，因此不经过这里的暂缓机制。
+
+每个通道都记录排队等待和总耗时的 p50/p95/p99，见 executor_stats()。
+
+用法:
+    result = await run_blocking("llm", translator._call_api, text, mode="summarize")
+"""
+import time
+import asyncio
+import functools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+
+DEFAULT_LIMITS = {"llm": 8, "ocr": 2, "disk": 4, "cpu": 2, "reply_high": 2}
+HIGH_PRIORITY_LANES = ("reply_high",)
+
+# 高优先级任务的排队 + 执行数；为 0 时 _high_idle 处于置位状态
+_high_busy = 0
+_high_lock = threading.Lock()
+_high_idle = threading.Event()
+_high_idle.set()
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def latency_summary(values):
+    """把一组耗时 (秒) 汇总为毫秒级的 count / avg / p50 / p95 / p99 / max"""
+    values = list(values)
+    return {
+        "count": len(values),
+        "avg_ms": round(1000 * sum(values) / len(values), 1) if values else 0.0,
+        "p50_ms": round(1000 * _percentile(values, 50), 1),
+        "p95_ms": round(1000 * _percentile(values, 95), 1),
+        "p99_ms": round(1000 * _percentile(values, 99), 1),
+        "max_ms": round(1000 * max(values), 1) if values else 0.0,
+    }
+
+
+def _mark_high_priority(delta):
+    global _high_busy
+    with _high_lock:
+        _high_busy += delta
+        if _high_busy > 0:
+            _high_idle.clear()
+        else:
+            _high_idle.set()
+
+
+def wait_for_high_priority_idle(timeout=None):
+    """
+    后台低优先级任务开始前调用：高优先级通道忙时最多等待 timeout 秒
+    返回 True 表示通道已空闲，False 表示等待超时（此时照常执行，避免饿死）
+    """
+    if timeout is None:
+        timeout = getattr(config, "LOW_PRIORITY_MAX_DEFER", 5.0)
+    return _high_idle.wait(timeout)
+
+
+class SubsystemPool:
+    """
+    一个子系统的线程池，附带排队/执行中计数
+    """
+
+    def __init__(self, name, max_workers, high_priority=False):
+        self.name = name
+        self.max_workers = max_workers
+        self.high_priority = high_priority
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-pool")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._active = 0
+        self._completed = 0
+        self._wait_times = deque(maxlen=500)
+        self._latencies = deque(maxlen=500)
+
+    def _wrap(self, func, submitted_at):
+        def runner():
+            started_at = time.time()
+            with self._lock:
+                self._pending -= 1
+                self._active += 1
+                self._wait_times.append(started_at - submitted_at)
+            try:
+                return func()
+            finally:
+                with self._lock:
+                    self._active -= 1
+                    self._completed += 1
+                    self._latencies.append(time.time() - submitted_at)
+                if self.high_priority:
+                    _mark_high_priority(-1)
+        return runner
+
+    def submit(self, func, *args, **kwargs):
+        """提交到线程池，返回 concurrent.futures.Future"""
+        with self._lock:
+            self._pending += 1
+        if self.high_priority:
+            _mark_high_priority(1)
+        future = self._executor.submit(self._wrap(functools.partial(func, *args, **kwargs), time.time()))
+        future.add_done_callback(self._on_done)
+        return future
+
+    def _on_done(self, future):
+        # 排队中被取消 (如 asyncio.wait_for 超时) 的任务不会执行 runner，在这里撤销排队计数，
+        # 否则高优先级通道会一直被视为繁忙
+        if future.cancelled():
+            with self._lock:
+                self._pending -= 1
+            if self.high_priority:
+                _mark_high_priority(-1)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "high_priority": self.high_priority,
+                "queued": self._pending,
+                "active": self._active,
+                "completed": self._completed,
+                "queue_wait": latency_summary(self._wait_times),
+                "latency": latency_summary(self._latencies),
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(subsystem):
+    """获取（必要时创建）某个子系统/通道的线程池，未配置的默认 2 个线程"""
+    pool = _pools.get(subsystem)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(subsystem)
+            if pool is None:
+                limits = getattr(config, "EXECUTOR_LIMITS", DEFAULT_LIMITS)
+                max_workers = limits.get(subsystem, DEFAULT_LIMITS.get(subsystem, 2))
+                pool = SubsystemPool(subsystem, max_workers, high_priority=subsystem in HIGH_PRIORITY_LANES)
+                _pools[subsystem] = pool
+    return pool
+
+
+async def run_blocking(subsystem, func, *args, **kwargs):
+    """在指定子系统的线程池中执行阻塞函数，并在事件循环中等待结果"""
+    future = get_pool(subsystem).submit(func, *args, **kwargs)
+    return await asyncio.wrap_future(future)
+
+
+def executor_stats():
+    """所有子系统线程池的排队与执行情况"""
+    with _pools_lock:
+        return {name: pool.stats() for name, pool in _pools.items()}
+
+
+def shutdown_executors():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.shutdown()
+        _pools.clear()
@@ -0,0 +1,212 @@
+# modules/llm_cache.py
+"""
+大模型响应缓存 (SQLite)
+
+用户反复点"总结"、"重要消息提醒"，同一份文档/图片被反复翻译，每次都是一次完整的 qwen-plus 调用。
+这里按 (模型, 参数, 归一化后的提示词) 的哈希缓存模型输出：
+
+- 每种调用类型 (profile) 单独设置有效期，见 config.LLM_CACHE_TTL；为 0 表示不缓存
+  (auto_reply / whether_reply 需要实时判断，默认不缓存)
+- 总大小超过 LLM_CACHE_MAX_BYTES 时按最近使用时间淘汰
+- 调用方传 fresh=True 可跳过缓存读取 (结果仍会写入，刷新旧值)
+- stats() 给出命中率以及命中所节省的 token 数 (按首次调用时百炼返回的 usage 统计)
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+import config
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key           TEXT PRIMARY KEY,
+    profile       TEXT NOT NULL,
+    response      TEXT NOT NULL,
+    input_tokens  INTEGER NOT NULL DEFAULT 0,
+    output_tokens INTEGER NOT NULL DEFAULT 0,
+    created       REAL NOT NULL,
+    expires       REAL NOT NULL,
+    last_used     REAL NOT NULL,
+    size          INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses(last_used);
+CREATE INDEX IF NOT EXISTS idx_responses_expires   ON responses(expires);
+"""
+
+DEFAULT_TTL = {
+    "default": 24 * 3600,
+    "summarize": 7 * 24 * 3600,
+    "translate": 30 * 24 * 3600,
+    "whether_reply": 0,
+    "auto_reply": 0,
+}
+
+
+def normalize_prompt(prompt):
+    """合并多余空白，只差空格/换行的提示词视为相同"""
+    return " ".join(prompt.split())
+
+
+def cache_key(prompt, params):
+    material = {
+        "model": params.get("model"),
+        "max_tokens": params.get("max_tokens"),
+        "temperature": params.get("temperature"),
+        "extra_parameters": params.get("extra_parameters", {}),
+        "prompt": normalize_prompt(prompt),
+    }
+    return hashlib.sha256(json.dumps(material, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    SQLite 缓存，每个线程持有独立连接
+    """
+
+    def __init__(self, db_path=None, max_bytes=None):
+        self.db_path = db_path or getattr(config, "LLM_CACHE_DB_PATH", os.path.join(config.DATA_DIR, "llm_cache.db"))
+        self.max_bytes = max_bytes if max_bytes is not None else getattr(config, "LLM_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+        self.enabled = getattr(config, "LLM_CACHE_ENABLED", True)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._total_bytes = None
+
+        self._hits = 0
+        self._misses = 0
+        self._bypassed = 0
+        self._saved_input_tokens = 0
+        self._saved_output_tokens = 0
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def ttl(self, profile):
+        ttls = dict(DEFAULT_TTL)
+        ttls.update(getattr(config, "LLM_CACHE_TTL", {}))
+        return ttls.get(profile, ttls.get("default", 0))
+
+    def _ensure_total(self, conn):
+        if self._total_bytes is None:
+            row = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+            self._total_bytes = row[0]
+
+    # ---------- 读写 ----------
+
+    def get(self, profile, key):
+        """返回缓存的文本，未命中或已过期返回 None (数据库出错时也按未命中处理)"""
+        if not self.enabled or self.ttl(profile) <= 0:
+            return None
+        try:
+            return self._get(key)
+        except sqlite3.Error as e:
+            print(f"[LLMCache] 读取缓存失败: {e}")
+            return None
+
+    def _get(self, key):
+        conn = self._conn()
+        now = time.time()
+        row = conn.execute(
+            "SELECT response, input_tokens, output_tokens FROM responses WHERE key = ? AND expires > ?",
+            (key, now),
+        ).fetchone()
+        if row is None:
+            with self._lock:
+                self._misses += 1
+            return None
+        conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+        conn.commit()
+        with self._lock:
+            self._hits += 1
+            self._saved_input_tokens += row[1]
+            self._saved_output_tokens += row[2]
+        return row[0]
+
+    def note_bypass(self):
+        with self._lock:
+            self._bypassed += 1
+
+    def put(self, profile, key, response, usage=None):
+        ttl = self.ttl(profile)
+        if not self.enabled or ttl <= 0:
+            return
+        try:
+            self._put(profile, key, response, usage or {}, ttl)
+        except sqlite3.Error as e:
+            print(f"[LLMCache] 写入缓存失败: {e}")
+
+    def _put(self, profile, key, response, usage, ttl):
+        now = time.time()
+        size = len(response.encode("utf-8")) + 200  # 200 字节估算行开销
+        conn = self._conn()
+        with self._lock:
+            self._ensure_total(conn)
+            old = conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses "
+                    "(key, profile, response, input_tokens, output_tokens, created, expires, last_used, size) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, profile, response, int(usage.get("input_tokens", 0) or 0),
+                     int(usage.get("output_tokens", 0) or 0), now, now + ttl, now, size),
+                )
+            self._total_bytes += size - (old[0] if old else 0)
+            if self._total_bytes > self.max_bytes:
+                self._evict(conn)
+
+    def _evict(self, conn):
+        """先删过期的，仍超出容量时按最近使用时间从旧到新删除"""
+        with conn:
+            conn.execute("DELETE FROM responses WHERE expires <= ?", (time.time(),))
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                excess = total - int(self.max_bytes * 0.9)  # 多删一些，避免每次写入都触发淘汰
+                freed = 0
+                victims = []
+                for key, size in conn.execute("SELECT key, size FROM responses ORDER BY last_used"):
+                    if freed >= excess:
+                        break
+                    victims.append((key,))
+                    freed += size
+                conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+                total -= freed
+        self._total_bytes = total
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "enabled": self.enabled,
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "bypassed": self._bypassed,
+                "hit_rate": round(self._hits / lookups, 3) if lookups else 0.0,
+                "saved_input_tokens": self._saved_input_tokens,
+                "saved_output_tokens": self._saved_output_tokens,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+    """进程内共享的响应缓存 (首次使用时打开数据库)"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = LLMResponseCache()
+    return _cache
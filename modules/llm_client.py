@@ -0,0 +1,375 @@
+# modules/llm_client.py
+"""
+共享的百炼 (DashScope) 大模型客户端
+
+此前 server.py 每个请求都新建 BailianTranslator (新的 Session 和重试适配器)，
+auto_reply / whether_reply 又各自用裸 requests.post，每次调用都要重新建立 TLS 连接。
+现在所有调用方共用这里的一个客户端：
+
+- 一个带连接池的 requests.Session (keep-alive)，大小由 LLM_POOL_SIZE 配置
+- 统一的重试与退避：连接错误、超时、429、5xx 按指数退避 + 抖动重试
+- 按调用类型 (profile) 配置模型、max_tokens、temperature 和超时，见 config.LLM_PROFILES
+- 同步入口 generate() / chat()，异步入口 agenerate() (在 llm 线程池中执行)
+- 成功的结果写入响应缓存 (modules/llm_cache.py)，fresh=True 可跳过缓存
+- 流式入口 stream() / astream()：使用百炼的 SSE 增量输出 (X-DashScope-SSE + incremental_output)，
+  边生成边返回文本片段
+- 按 profile 统计百炼返回的输入/输出 token (stats()["tokens"])
+- 每次请求先经过全局限流器 (modules/llm_limiter.py)：RPM/TPM 令牌桶 + 优先级队列，
+  排队已满或超时时由限流器抛出 modules.llm_limiter.LLMOverloadedError，原样传给调用方
+
+用法:
+    from modules.llm_client import get_llm_client
+    text = get_llm_client().generate(prompt, profile="summarize")
+"""
+import json
+import time
+import asyncio
+import random
+import threading
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import config
+from modules.executors import run_blocking, latency_summary
+from modules.llm_cache import get_llm_cache, cache_key
+from modules.llm_limiter import get_rate_limiter, priority_for
+from modules.token_counter import estimate_tokens
+
+DEFAULT_API_URL = "https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation"
+
+DEFAULT_PROFILES = {
+    "default": {"model": "qwen-plus", "max_tokens": 2000, "temperature": 0.3, "timeout": 300},
+    "whether_reply": {"max_tokens": 10, "temperature": 0.1, "timeout": 30},  # 低温度确保结果稳定
+    "auto_reply": {"max_tokens": 2000, "temperature": 0.3, "timeout": 60},
+    "translate": {"max_tokens": 2000, "temperature": 0.3},
+    "summarize": {"max_tokens": 2000, "temperature": 0.3},
+}
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+    """大模型调用失败 (重试用尽或返回格式异常)"""
+
+
+def parse_output(result):
+    """从百炼返回的 JSON 中取出文本 (兼容 output.text 与 output.choices 两种格式)"""
+    output = result.get("output") or {}
+    if "text" in output and output["text"] is not None:
+        return output["text"].strip()
+    if output.get("choices"):
+        return output["choices"][0]["message"]["content"].strip()
+    raise LLMError(f"API返回格式异常: {result}")
+
+
+def _delta_text(event):
+    """SSE 增量事件中的文本片段 (不做 strip，片段间的空白和换行需要保留)"""
+    output = event.get("output") or {}
+    if output.get("text"):
+        return output["text"]
+    if output.get("choices"):
+        return output["choices"][0].get("message", {}).get("content") or ""
+    return ""
+
+
+class LLMClient:
+    """
+    线程安全的共享客户端 (requests.Session 的连接池可被多个线程同时使用)
+    """
+
+    def __init__(self, api_key=None, api_url=None, pool_size=None, max_retries=None):
+        self.api_key = api_key or config.DASHSCOPE_API_KEY
+        self.api_url = api_url or getattr(config, "DASHSCOPE_API_URL", DEFAULT_API_URL)
+        self.max_retries = max_retries if max_retries is not None else getattr(config, "LLM_MAX_RETRIES", 3)
+        pool_size = pool_size or getattr(config, "LLM_POOL_SIZE", 16)
+
+        self.headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+        }
+        self.session = requests.Session()
+        # 重试由 _post 统一处理，适配器只负责连接池
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._retries = 0
+        self._failures = 0
+        self._latencies = {}  # profile -> deque[秒]
+        self._tokens = {}  # profile -> {"requests", "input_tokens", "output_tokens"}
+
+    # ---------- 参数 ----------
+
+    def profile_params(self, profile):
+        """合并 default 与指定 profile 的参数，config.LLM_PROFILES 优先于内置默认值"""
+        profiles = getattr(config, "LLM_PROFILES", {})
+        params = dict(DEFAULT_PROFILES["default"])
+        params.update(profiles.get("default", {}))
+        params.update(DEFAULT_PROFILES.get(profile, {}))
+        params.update(profiles.get(profile, {}))
+        return params
+
+    def build_payload(self, prompt, params):
+        parameters = {"max_tokens": params["max_tokens"], "temperature": params["temperature"]}
+        parameters.update(params.get("extra_parameters", {}))
+        return {
+            "model": params["model"],
+            "input": {"messages": [{"role": "user", "content": prompt}]},
+            "parameters": parameters,
+        }
+
+    # ---------- 请求 ----------
+
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after:
+            try:
+                return min(30.0, float(retry_after))
+            except ValueError:
+                pass
+        base = min(8.0, 0.5 * (2 ** attempt))
+        return base * (0.5 + random.random() / 2)
+
+    def post(self, payload, timeout, headers=None, stream=False):
+        """
+        发送请求，按统一策略重试，返回 requests.Response (状态码 200)
+        重试用尽或遇到不可重试的错误时抛出 LLMError
+        """
+        request_headers = dict(self.headers)
+        if headers:
+            request_headers.update(headers)
+
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                with self._lock:
+                    self._retries += 1
+            try:
+                response = self.session.post(self.api_url, headers=request_headers, json=payload,
+                                             timeout=timeout, stream=stream)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                last_error = f"网络请求失败: {e}"
+                if attempt < self.max_retries:
+                    time.sleep(self._backoff(attempt))
+                continue
+
+            if response.status_code == 200:
+                return response
+            last_error = f"API请求失败: {response.status_code}, {response.text}"
+            if response.status_code not in RETRY_STATUS:
+                break
+            if attempt < self.max_retries:
+                delay = self._backoff(attempt, response.headers.get("Retry-After"))
+                if response.status_code == 429:
+                    # 触发了平台限流：其他请求也一起暂停，而不是各自立即重试
+                    delay = get_rate_limiter().throttle(delay)
+                time.sleep(delay)
+
+        with self._lock:
+            self._failures += 1
+        raise LLMError(last_error)
+
+    def generate(self, prompt, profile="default", fresh=False, **overrides):
+        """
+        同步调用，返回模型输出文本；失败时抛出 LLMError
+        fresh=True 时不读缓存，直接请求模型 (结果仍会写回缓存)
+        overrides 可覆盖 profile 中的 model / max_tokens / temperature / timeout
+        """
+        params = self.profile_params(profile)
+        params.update(overrides)
+
+        cache = get_llm_cache()
+        key = cache_key(prompt, params)
+        if fresh:
+            cache.note_bypass()
+        else:
+            cached = cache.get(profile, key)
+            if cached is not None:
+                return cached
+
+        limiter = get_rate_limiter()
+        grant = limiter.acquire(priority_for(profile), self._reserve_tokens(prompt, params))
+        used = None
+        try:
+            start = time.time()
+            with self._lock:
+                self._calls += 1
+            response = self.post(self.build_payload(prompt, params), timeout=params["timeout"])
+            result = response.json()
+            text = parse_output(result)
+            used = self._record_usage(profile, result.get("usage"), prompt)
+        finally:
+            limiter.release(grant, used)
+        self._record_latency(profile, time.time() - start)
+        cache.put(profile, key, text, result.get("usage"))
+        return text
+
+    def chat(self, prompt, profile="default", fresh=False, **overrides):
+        """与旧的 call_llm_api 相同的返回格式: {"success": True, "content": ...} 或 {"success": False, "error": ...}"""
+        try:
+            return {"success": True, "content": self.generate(prompt, profile, fresh, **overrides)}
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+
+    async def agenerate(self, prompt, profile="default", fresh=False, **overrides):
+        """异步入口：在 llm 线程池中执行 generate，不阻塞事件循环"""
+        return await run_blocking("llm", self.generate, prompt, profile, fresh, **overrides)
+
+    # ---------- 流式输出 ----------
+
+    def stream(self, prompt, profile="default", fresh=False, **overrides):
+        """
+        同步生成器：逐段产出模型输出的文本 (增量片段，拼接起来即完整结果)
+        命中缓存时一次性产出缓存内容；完整结果在流结束后写入缓存
+        """
+        params = self.profile_params(profile)
+        params.update(overrides)
+
+        cache = get_llm_cache()
+        key = cache_key(prompt, params)
+        if fresh:
+            cache.note_bypass()
+        else:
+            cached = cache.get(profile, key)
+            if cached is not None:
+                yield cached
+                return
+
+        payload = self.build_payload(prompt, params)
+        payload["parameters"]["incremental_output"] = True
+        limiter = get_rate_limiter()
+        grant = limiter.acquire(priority_for(profile), self._reserve_tokens(prompt, params))
+        start = time.time()
+        with self._lock:
+            self._calls += 1
+        try:
+            response = self.post(payload, timeout=params["timeout"],
+                                 headers={"X-DashScope-SSE": "enable", "Accept": "text/event-stream"}, stream=True)
+        except Exception:
+            limiter.release(grant)
+            raise
+
+        parts = []
+        usage = None
+        first_chunk = True
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                try:
+                    event = json.loads(line[len("data:"):].strip())
+                except ValueError:
+                    continue
+                if "output" not in event:
+                    # 流中途出错时百炼返回 code / message
+                    raise LLMError(f"流式输出出错: {event}")
+                usage = event.get("usage") or usage
+                delta = _delta_text(event)
+                if delta:
+                    if first_chunk:
+                        self._record_latency(f"{profile}:first_chunk", time.time() - start)
+                        first_chunk = False
+                    parts.append(delta)
+                    yield delta
+        finally:
+            response.close()
+            limiter.release(grant, self._used_tokens(usage) if usage else None)
+
+        self._record_latency(profile, time.time() - start)
+        self._record_usage(profile, usage, prompt)
+        cache.put(profile, key, "".join(parts), usage)
+
+    async def astream(self, prompt, profile="default", fresh=False, **overrides):
+        """
+        异步生成器：在 llm 线程池中读取 SSE 流，片段通过队列交给事件循环
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        done = object()
+        stop = threading.Event()  # 客户端断开后通知读取线程提前结束
+
+        def pump():
+            chunks = self.stream(prompt, profile, fresh, **overrides)
+            try:
+                for chunk in chunks:
+                    if stop.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, chunk)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                chunks.close()
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+
+        task = asyncio.ensure_future(run_blocking("llm", pump))
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            if not task.done():
+                task.add_done_callback(lambda t: t.exception())
+
+    # ---------- 统计 ----------
+
+    def _record_latency(self, profile, seconds):
+        with self._lock:
+            self._latencies.setdefault(profile, deque(maxlen=500)).append(seconds)
+
+    @staticmethod
+    def _reserve_tokens(prompt, params):
+        """放行前向限流器预扣的 token：估算的输入 + 最大输出"""
+        return estimate_tokens(prompt) + params["max_tokens"]
+
+    @staticmethod
+    def _used_tokens(usage):
+        usage = usage or {}
+        return int(usage.get("input_tokens", 0) or 0) + int(usage.get("output_tokens", 0) or 0)
+
+    def _record_usage(self, profile, usage, prompt):
+        """按 profile 累计百炼返回的输入/输出 token，并打印本次请求的用量；返回总 token 数 (没有 usage 时为 None)"""
+        if not usage:
+            return None
+        input_tokens = int(usage.get("input_tokens", 0) or 0)
+        output_tokens = int(usage.get("output_tokens", 0) or 0)
+        with self._lock:
+            totals = self._tokens.setdefault(profile, {"requests": 0, "input_tokens": 0, "output_tokens": 0})
+            totals["requests"] += 1
+            totals["input_tokens"] += input_tokens
+            totals["output_tokens"] += output_tokens
+        print(f"[LLM] {profile}: 提示词 {len(prompt)} 字，输入 {input_tokens} tokens，输出 {output_tokens} tokens")
+        return input_tokens + output_tokens
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self._calls,
+                "retries": self._retries,
+                "failures": self._failures,
+                "latency": {p: latency_summary(v) for p, v in self._latencies.items()},
+                "tokens": {p: dict(v) for p, v in self._tokens.items()},
+            }
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_llm_client(api_key=None):
+    """进程内共享的客户端，同一个 API Key 只创建一次"""
+    api_key = api_key or config.DASHSCOPE_API_KEY
+    client = _clients.get(api_key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(api_key)
+            if client is None:
+                client = _clients[api_key] = LLMClient(api_key)
+    return client
@@ -0,0 +1,195 @@
+# modules/llm_limiter.py
+"""
+百炼 (DashScope) 调用的全局限流与并发控制
+
+自动回复、whether_reply、重要消息提醒、文档/图片翻译和总结共用同一个百炼账号，
+彼此之间没有协调：突发流量会触发平台的 RPM/TPM 限制，然后所有调用方同时重试。
+这里在进程内统一放行大模型请求：
+
+- 两个令牌桶：每分钟请求数 (LLM_RATE_LIMIT_RPM) 和每分钟 token 数 (LLM_RATE_LIMIT_TPM)；
+  放行时按 "估算输入 + max_tokens" 预扣 token，请求结束后按百炼返回的实际用量多退少补
+- 同时在途的请求数上限 (LLM_MAX_INFLIGHT)
+- 优先级：interactive (自动回复) > normal (总结、提醒) > batch (批量翻译)，
+  同一优先级内先到先得；调用类型与优先级的对应关系见 config.LLM_PRIORITY
+- 收到 429 时暂停放行一段带抖动的时间，避免所有请求同时重试
+- 等待队列有上限 (LLM_LIMITER_MAX_QUEUE)，排满或等待超时时抛出 LLMOverloadedError
+"""
+import time
+import heapq
+import random
+import itertools
+import threading
+from collections import deque
+
+import config
+from modules.executors import latency_summary
+
+PRIORITIES = {"interactive": 0, "normal": 1, "batch": 2}
+
+DEFAULT_PRIORITY = {
+    "whether_reply": "interactive",
+    "auto_reply": "interactive",
+    "summarize": "normal",
+    "default": "normal",
+    "translate": "batch",
+}
+
+DEFAULT_MAX_WAIT = {"interactive": 10.0, "normal": 60.0, "batch": 300.0}
+
+
+class LLMOverloadedError(Exception):
+    """限流队列已满或排队超时，请求被拒绝"""
+
+
+def priority_for(profile):
+    priorities = dict(DEFAULT_PRIORITY)
+    priorities.update(getattr(config, "LLM_PRIORITY", {}))
+    return priorities.get(profile, priorities.get("default", "normal"))
+
+
+class Grant:
+    """一次放行：记录预扣的 token，请求结束后交给 RateLimiter.release 结算"""
+
+    __slots__ = ("priority", "reserved", "released")
+
+    def __init__(self, priority, reserved):
+        self.priority = priority
+        self.reserved = reserved
+        self.released = False
+
+
+class RateLimiter:
+    """
+    线程安全；所有等待者共用一个 Condition，只有队首 (优先级最高、最早到达) 的等待者可以取令牌
+    """
+
+    def __init__(self, rpm=None, tpm=None, max_inflight=None, max_queue=None):
+        self.rpm = rpm if rpm is not None else getattr(config, "LLM_RATE_LIMIT_RPM", 300)
+        self.tpm = tpm if tpm is not None else getattr(config, "LLM_RATE_LIMIT_TPM", 500000)
+        self.max_inflight = max_inflight if max_inflight is not None else getattr(config, "LLM_MAX_INFLIGHT", 16)
+        self.max_queue = max_queue if max_queue is not None else getattr(config, "LLM_LIMITER_MAX_QUEUE", 64)
+        self.max_wait = dict(DEFAULT_MAX_WAIT)
+        self.max_wait.update(getattr(config, "LLM_LIMITER_MAX_WAIT", {}))
+
+        self._cond = threading.Condition()
+        self._requests = float(self.rpm)
+        self._tokens = float(self.tpm)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._inflight = 0
+        self._waiters = []  # heap of (优先级, 序号)
+        self._seq = itertools.count()
+
+        self._counts = {"granted": 0, "shed": 0, "timed_out": 0, "throttled": 0}
+        self._waits = {}  # priority -> deque[秒]
+
+    # ---------- 令牌桶 ----------
+
+    def _refill(self, now):
+        elapsed = now - self._refilled_at
+        self._refilled_at = now
+        self._requests = min(float(self.rpm), self._requests + elapsed * self.rpm / 60.0)
+        self._tokens = min(float(self.tpm), self._tokens + elapsed * self.tpm / 60.0)
+
+    def _ready_in(self, need, now):
+        """距离可以放行还需等待的秒数，0 表示现在即可放行"""
+        waits = [self._paused_until - now]
+        if self._requests < 1:
+            waits.append((1 - self._requests) * 60.0 / self.rpm)
+        if self._tokens < need:
+            waits.append((need - self._tokens) * 60.0 / self.tpm)
+        return max(0.0, *waits)
+
+    # ---------- 放行 ----------
+
+    def acquire(self, priority="normal", tokens=0, timeout=None):
+        """
+        阻塞直到放行，返回 Grant；队列已满或等待超过 timeout (默认按优先级取 LLM_LIMITER_MAX_WAIT)
+        时抛出 LLMOverloadedError
+        """
+        rank = PRIORITIES.get(priority, PRIORITIES["normal"])
+        timeout = self.max_wait.get(priority, 60.0) if timeout is None else timeout
+        need = min(float(tokens), float(self.tpm))  # 超大请求最多等到桶满
+        start = time.monotonic()
+        deadline = start + timeout
+
+        with self._cond:
+            if len(self._waiters) >= self.max_queue:
+                self._counts["shed"] += 1
+                raise LLMOverloadedError(f"大模型请求排队已满 ({self.max_queue})，请稍后再试")
+            ticket = (rank, next(self._seq))
+            heapq.heappush(self._waiters, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self._waiters[0] == ticket and self._inflight < self.max_inflight:
+                        wait = self._ready_in(need, now)
+                        if wait <= 0:
+                            break
+                    else:
+                        wait = 1.0  # 等待前面的请求被放行或结束后唤醒
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._counts["timed_out"] += 1
+                        raise LLMOverloadedError(f"大模型请求排队超时 ({timeout:.0f}s)，请稍后再试")
+                    self._cond.wait(min(wait, remaining))
+            finally:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+
+            self._requests -= 1
+            self._tokens -= need
+            self._inflight += 1
+            self._counts["granted"] += 1
+            self._waits.setdefault(priority, deque(maxlen=500)).append(time.monotonic() - start)
+        return Grant(priority, need)
+
+    def release(self, grant, used_tokens=None):
+        """请求结束：释放在途名额，并按实际用量结算预扣的 token (used_tokens 为 None 时不结算)"""
+        if grant is None or grant.released:
+            return
+        grant.released = True
+        with self._cond:
+            self._inflight -= 1
+            if used_tokens is not None:
+                self._tokens = min(float(self.tpm), self._tokens + grant.reserved - used_tokens)
+            self._cond.notify_all()
+
+    def throttle(self, seconds):
+        """收到 429 后暂停放行新请求 (带抖动，避免暂停结束时所有请求同时涌出)"""
+        seconds *= 0.75 + random.random() / 2
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._counts["throttled"] += 1
+        return seconds
+
+    def stats(self):
+        with self._cond:
+            self._refill(time.monotonic())
+            return {
+                **self._counts,
+                "rpm": self.rpm,
+                "tpm": self.tpm,
+                "inflight": self._inflight,
+                "queued": len(self._waiters),
+                "available_requests": int(self._requests),
+                "available_tokens": int(self._tokens),
+                "paused_for": round(max(0.0, self._paused_until - time.monotonic()), 2),
+                "wait": {p: latency_summary(v) for p, v in self._waits.items()},
+            }
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """进程内共享的限流器 (所有 API Key 共用同一个账号配额)"""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = RateLimiter()
+    return _limiter
@@ -2,10 +2,10 @@
 # 功能：根据聊天历史和当前消息生成智能回复
 # 作者：Agent Penguin 项目组
 
-import requests
 import json
 import sys
 import os
+import threading
 
 # 获取项目根目录
 current_dir = os.path.dirname(os.path.abspath(__file__))  # 当前目录 modules/msg/
@@ -15,11 +15,12 @@ if parent_dir not in sys.path:
 
 from scripts import topk_api_module
 from .whether_reply import whether_reply  # 导入是否回复判断模块
+from .reply_gate import rule_decision
 import config  # 导入配置模块
+from modules.executors import get_pool
+from modules.llm_client import get_llm_client
 
-# 阿里云通义千问API配置
-LLM_API_URL = "https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation"
-LLM_API_KEY = config.DASHSCOPE_API_KEY
+# 阿里云通义千问API：通过共享的大模型客户端调用 (modules/llm_client.py)
 
 # ===== 提示词 =====
 
@@ -96,8 +97,14 @@ def auto_reply(contact_name: str, current_message: str, msgtype: str, chat_histo
 
     # =====================================================
     # Step 1：判断是否需要回复（除非强制回复）
+    # 推测执行模式下，向量检索 (以及可选的回复草稿) 与 whether_reply 同时进行
     # =====================================================
+    speculation = None
     if not force_reply:
+        if getattr(config, "REPLY_SPECULATIVE_ENABLED", True) and rule_decision(current_message)[0] != "NO":
+            # 规则就能判为 NO 的消息 (表情、附和等) 不值得推测
+            speculation = _start_speculation(PROMPT_TEMPLATE, current_message)
+
         # 使用 whether_reply 模块判断是否需要回复
         # 将 chat_history 转换为 whether_reply 需要的格式
         history_list = parse_chat_history(chat_history)
@@ -107,6 +114,8 @@ def auto_reply(contact_name: str, current_message: str, msgtype: str, chat_histo
         print(f"[AutoReply Debug] whether_reply 结果: {should_reply_result}")
 
         if not should_reply_result.get("should_reply", False):
+            if speculation is not None:
+                _discard_speculation(speculation)
             return {
                 "should_reply": False,
                 "reply_content": "",
@@ -119,6 +128,59 @@ def auto_reply(contact_name: str, current_message: str, msgtype: str, chat_histo
     # =====================================================
     # Step 2：确认需要回复 → 从向量库提取历史风格回复
     # =====================================================
+    draft = None
+    conversation_history = None
+    if speculation is not None:
+        try:
+            conversation_history, draft = speculation.result()
+            _count_speculation("used")
+        except Exception as e:
+            print(f"[AutoReply] 推测任务失败，改为顺序执行: {e}")
+    if conversation_history is None:
+        conversation_history = _retrieve_style_replies(current_message)
+
+    if not conversation_history:
+        return {
+            "should_reply": False,
+            "reply_content": "",
+            "reason": "未找到可用的历史风格回复"
+        }
+
+    # =====================================================
+    # Step 3：生成最终回复 (推测生成的草稿可用时直接采用)
+    # =====================================================
+    if draft is not None and draft.get("success", False):
+        _count_speculation("drafts_used")
+        llm_response = draft
+    else:
+        llm_response = _generate_reply(PROMPT_TEMPLATE, conversation_history, current_message)
+
+    if not llm_response.get("success", False):
+        return {
+            "should_reply": False,
+            "reply_content": "",
+            "reason": f"生成回复失败: {llm_response.get('error', '未知错误')}"
+        }
+
+    reply_content = llm_response.get("content", "").strip()
+    print(f"[AutoReply Debug] 生成的回复内容: {reply_content}")
+
+    if not reply_content:
+        return {
+            "should_reply": False,
+            "reply_content": "",
+            "reason": "生成的回复内容为空"
+        }
+
+    return {
+        "should_reply": True,
+        "reply_content": reply_content,
+        "reason": "成功生成回复"
+    }
+
+
+def _retrieve_style_replies(current_message: str) -> list:
+    """从向量库检索相似对话，取每条结果之后的第一条回复作为风格参考"""
     conversation_history = []
 
     try:
@@ -145,47 +207,74 @@ def auto_reply(contact_name: str, current_message: str, msgtype: str, chat_histo
     print(f"[AutoReply Debug] 从向量库获取的历史回复数量: {len(conversation_history)}")
     if conversation_history:
         print(f"[AutoReply Debug] 历史回复预览: {conversation_history[:3]}")  # 打印前3条用于调试
+    return conversation_history
 
-    if not conversation_history:
-        return {
-            "should_reply": False,
-            "reply_content": "",
-            "reason": "未找到可用的历史风格回复"
-        }
 
-    # =====================================================
-    # Step 3：生成最终回复
-    # =====================================================
-    prompt = PROMPT_TEMPLATE.format(
+def _generate_reply(prompt_template: str, conversation_history: list, current_message: str) -> dict:
+    prompt = prompt_template.format(
         conversation_history="\n".join(conversation_history),
         current_message=current_message
     )
     print(f"[AutoReply Debug] 生成回复的提示词预览: {prompt[:500]}...")  # 打印前500个字符用于调试
+    return call_llm_api(prompt)
 
-    llm_response = call_llm_api(prompt)
 
-    if not llm_response.get("success", False):
-        return {
-            "should_reply": False,
-            "reply_content": "",
-            "reason": f"生成回复失败: {llm_response.get('error', '未知错误')}"
-        }
+# ===== 推测执行 =====
+# 检索不依赖 whether_reply 的结果，提前在 speculative 线程池中执行；判断为 NO 时丢弃
 
-    reply_content = llm_response.get("content", "").strip()
-    print(f"[AutoReply Debug] 生成的回复内容: {reply_content}")
+_spec_lock = threading.Lock()
+_spec_counts = {
+    "started": 0,          # 发起的推测任务
+    "used": 0,             # 判断为需要回复，检索结果被采用
+    "drafts_used": 0,      # 推测生成的草稿直接作为回复
+    "cancelled": 0,        # 判断为 NO 时任务尚未开始，直接取消
+    "wasted_retrievals": 0,  # 判断为 NO 时检索已经执行
+    "wasted_drafts": 0,      # 判断为 NO 时草稿已经生成 (浪费了一次大模型调用)
+}
 
-    if not reply_content:
-        return {
-            "should_reply": False,
-            "reply_content": "",
-            "reason": "生成的回复内容为空"
-        }
 
-    return {
-        "should_reply": True,
-        "reply_content": reply_content,
-        "reason": "成功生成回复"
-    }
+def _count_speculation(key, n=1):
+    with _spec_lock:
+        _spec_counts[key] += n
+
+
+def _speculate(prompt_template: str, current_message: str):
+    conversation_history = _retrieve_style_replies(current_message)
+    draft = None
+    if conversation_history and getattr(config, "REPLY_SPECULATIVE_DRAFT", False):
+        draft = _generate_reply(prompt_template, conversation_history, current_message)
+    return conversation_history, draft
+
+
+def _start_speculation(prompt_template: str, current_message: str):
+    _count_speculation("started")
+    return get_pool("speculative").submit(_speculate, prompt_template, current_message)
+
+
+def _discard_speculation(future):
+    """判断为不需要回复：未开始的任务直接取消，已开始的任务结束后计入浪费"""
+    if future.cancel():
+        _count_speculation("cancelled")
+        return
+
+    def account(f):
+        if f.cancelled() or f.exception() is not None:
+            return
+        conversation_history, draft = f.result()
+        _count_speculation("wasted_retrievals")
+        if draft is not None:
+            _count_speculation("wasted_drafts")
+
+    future.add_done_callback(account)
+
+
+def get_speculation_stats() -> dict:
+    """推测执行的采用与浪费情况"""
+    with _spec_lock:
+        counts = dict(_spec_counts)
+    decided = counts["used"] + counts["cancelled"] + counts["wasted_retrievals"]
+    counts["waste_rate"] = round(counts["wasted_retrievals"] / decided, 3) if decided else 0.0
+    return counts
 
 
 def parse_chat_history(chat_history: str) -> list:
@@ -225,62 +314,8 @@ def parse_chat_history(chat_history: str) -> list:
 # ===== LLM API =====
 
 def call_llm_api(prompt: str) -> dict:
-    try:
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {LLM_API_KEY}"
-        }
-
-        payload = {
-            "model": "qwen-plus",
-            "input": {
-                "messages": [
-                    {"role": "user", "content": prompt}
-                ]
-            },
-            "parameters": {
-                "max_tokens": 2000,
-                "temperature": 0.3
-            }
-        }
-
-        response = requests.post(
-            LLM_API_URL,
-            headers=headers,
-            json=payload,
-            timeout=300
-        )
-
-        if response.status_code != 200:
-            return {
-                "success": False,
-                "error": f"API请求失败: {response.status_code}, {response.text}"
-            }
-
-        result = response.json()
-
-        if "output" in result and "text" in result["output"]:
-            return {
-                "success": True,
-                "content": result["output"]["text"].strip()
-            }
-
-        if "output" in result and "choices" in result["output"]:
-            return {
-                "success": True,
-                "content": result["output"]["choices"][0]["message"]["content"].strip()
-            }
-
-        return {
-            "success": False,
-            "error": f"API返回格式异常: {result}"
-        }
-
-    except Exception as e:
-        return {
-            "success": False,
-            "error": f"API调用异常: {str(e)}"
-        }
+    # 使用共享客户端 (连接复用、统一重试)，参数见 config.LLM_PROFILES["auto_reply"]
+    return get_llm_client().chat(prompt, profile="auto_reply")
 
 # ===== 本地测试 =====
 
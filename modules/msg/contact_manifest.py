@@ -0,0 +1,159 @@
+# modules/msg/contact_manifest.py
+"""
+联系人清单 (contact manifest)
+
+为 /api/msg/list 维护一份每个联系人的摘要：类型、名称、消息条数、最后活跃时间、预览。
+save_incoming_message 每保存一条消息就增量更新一次，列表接口直接读内存，
+不再逐个打开聊天记录文件。
+
+清单定期落盘到 CONTACT_MANIFEST_FILE；文件丢失或损坏时会自动从聊天记录重建，
+也可以手动重建:
+    python -m modules.msg.contact_manifest --rebuild
+"""
+import os
+import json
+import time
+import argparse
+import threading
+
+import config
+from .history_store import get_history_store
+
+MANIFEST_FILE = getattr(config, "CONTACT_MANIFEST_FILE", os.path.join(config.DATA_DIR, "contact_manifest.json"))
+
+
+def _entry_from_record(contact_id, record, count):
+    return {
+        "id": str(contact_id),
+        "type": record.get("msgtype", "unknown"),       # group / private
+        "group_name": record.get("group_name", "unkown"),
+        "user_name": record.get("name", "unknown"),
+        "count": count,
+        "last_active": record.get("time", ""),
+        "preview": record.get("text", "")[:20],
+    }
+
+
+class ContactManifest:
+    """
+    内存中的联系人清单，按 flush_interval 节流写盘
+    """
+
+    def __init__(self, path=MANIFEST_FILE, flush_interval=None):
+        self.path = path
+        self.flush_interval = flush_interval if flush_interval is not None else getattr(config, "CONTACT_MANIFEST_FLUSH_INTERVAL", 2.0)
+        self._entries = None
+        self._dirty = False
+        self._last_flush = 0.0
+        self._lock = threading.RLock()
+
+    def _ensure_loaded(self):
+        """加载清单，返回 True 表示本次是从聊天记录重建的"""
+        if self._entries is not None:
+            return False
+        with self._lock:
+            if self._entries is not None:
+                return False
+            if os.path.exists(self.path):
+                try:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        self._entries = json.load(f)
+                    return False
+                except Exception as e:
+                    print(f"[ContactManifest] 清单文件损坏，重新构建: {e}")
+            else:
+                print("[ContactManifest] 清单文件不存在，从聊天记录构建...")
+            self.rebuild()
+            return True
+
+    def rebuild(self, store=None):
+        """扫描全部聊天记录重新生成清单（只读每个联系人的最后一条记录和行数）"""
+        store = store or get_history_store()
+        entries = {}
+        for contact_id in store.list_contacts():
+            try:
+                last_record = store.last_record(contact_id)
+                if last_record:
+                    entries[contact_id] = _entry_from_record(contact_id, last_record, store.count(contact_id))
+            except Exception as e:
+                print(f"[ContactManifest] 读取联系人 {contact_id} 失败: {e}")
+        with self._lock:
+            self._entries = entries
+            self._dirty = True
+            self.flush(force=True)
+        print(f"[ContactManifest] 清单构建完成，共 {len(entries)} 个联系人")
+        return len(entries)
+
+    def update(self, contact_id, record):
+        """保存新消息后调用：计数 +1，刷新最后活跃时间、名称和预览"""
+        if self._ensure_loaded():
+            # 刚从聊天记录重建，已经包含了这条消息
+            return
+        contact_id = str(contact_id)
+        with self._lock:
+            old = self._entries.get(contact_id)
+            count = old["count"] + 1 if old else 1
+            self._entries[contact_id] = _entry_from_record(contact_id, record, count)
+            self._dirty = True
+            self.flush()
+
+    def flush(self, force=False):
+        """把清单写回磁盘（先写临时文件再替换，避免写一半的文件）"""
+        with self._lock:
+            if not self._dirty or self._entries is None:
+                return
+            if not force and time.time() - self._last_flush < self.flush_interval:
+                return
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(self._entries, f, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+                self._dirty = False
+                self._last_flush = time.time()
+            except Exception as e:
+                print(f"[ContactManifest] 写入清单失败: {e}")
+
+    def list(self):
+        """返回与 get_contact_list 相同格式的联系人列表，按最后活跃时间倒序"""
+        self._ensure_loaded()
+        with self._lock:
+            entries = list(self._entries.values())
+
+        contacts = []
+        for e in entries:
+            item = {
+                "id": e["id"],
+                "type": e["type"],
+                "count": e["count"],
+                "last_active": e["last_active"],
+                "preview": e["preview"],
+            }
+            if e["type"] == "group":
+                item["group_name"] = e["group_name"]
+            else:
+                item["user_name"] = e["user_name"]
+            contacts.append(item)
+
+        contacts.sort(key=lambda x: x["last_active"], reverse=True)
+        return contacts
+
+
+_manifest = ContactManifest()
+
+
+def get_contact_manifest():
+    """进程内共享的联系人清单"""
+    return _manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="联系人清单工具")
+    parser.add_argument("--rebuild", action="store_true", help="从聊天记录重建联系人清单")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        ContactManifest().rebuild()
+    else:
+        parser.print_help()
@@ -0,0 +1,127 @@
+# modules/msg/context_builder.py
+"""
+按 token 预算构建发给大模型的聊天上下文
+
+get_recent_messages 原先把 limit 条消息原样拼接，每条图片/文件消息还带最多 1000 字的
+OCR/文件内容；extract_important_messages 把 100 条消息整体 JSON 化塞进提示词。
+长聊天很容易超出上下文，或者在表情包、刷屏上白白花钱。这里统一处理：
+
+- 用 modules/token_counter.py 估算 token 数
+- 每种用途 (summarize / notify / auto_reply) 有自己的预算，见 config.CONTEXT_TOKEN_BUDGETS
+- 从最新消息往回取，预算用完即停止；丢弃纯表情、重复刷屏，截断过长的正文和 OCR/文件内容
+- 每次构建都打印并返回一份报告 (扫描/保留/丢弃条数、估算 token)
+"""
+import re
+
+import config
+from modules.token_counter import estimate_tokens
+
+# 这些 extracted_content 没有信息量，不拼进上下文
+# "[处理中]" 即 msg_handler.PENDING_EXTRACTED_CONTENT (后台提取尚未完成)
+INVALID_EXTRA_KEYWORDS = ["[OCR未识别", "[读取文件出错", "[不支持", "[文件不存在", "[处理中]"]
+
+_STICKER_PATTERN = re.compile(
+    r"^(\s*(\[(表情|动画表情)\]|\[CQ:(face|mface|bface|marketface)[^\]]*\]|"
+    r"[\U0001F000-\U0001FAFF\u2600-\u27BF\uFE0F\u200D]))+\s*$"
+)
+
+
+def purpose_options(purpose):
+    """某种用途的上下文限制；purpose 为 None 时不做任何裁剪 (与旧行为一致)"""
+    if purpose is None:
+        return {"budget": 0, "extra_chars": 0, "message_chars": 0, "drop_stickers": False, "dedupe": False}
+    budgets = getattr(config, "CONTEXT_TOKEN_BUDGETS", {})
+    return {
+        "budget": budgets.get(purpose, budgets.get("default", 4000)),
+        "extra_chars": getattr(config, "CONTEXT_EXTRA_CHARS", 300),
+        "message_chars": getattr(config, "CONTEXT_MESSAGE_CHARS", 500),
+        "drop_stickers": True,
+        "dedupe": True,
+    }
+
+
+def message_content(item, include_media=True, extra_chars=0):
+    """
+    一条记录在上下文中的内容，例如 "你好" 或 "[图片] (内容详情: 账单金额50元)"
+    extra_chars > 0 时截断 OCR/文件内容
+    """
+    msg_content = item.get("text", "")
+    c_type = item.get("content_type", "text")
+    if include_media and c_type in ("image", "file"):
+        extra = item.get("extracted_content", "")
+        # 过滤无效的 OCR 结果，避免干扰 AI
+        if extra and not any(k in extra for k in INVALID_EXTRA_KEYWORDS):
+            if extra_chars and len(extra) > extra_chars:
+                extra = extra[:extra_chars] + "..."
+            msg_content += f" (内容详情: {extra})"
+    return msg_content
+
+
+def is_sticker(item):
+    """纯表情消息 (含 [表情] 占位符、QQ 表情 CQ 码和 emoji)"""
+    return item.get("content_type", "text") == "text" and bool(_STICKER_PATTERN.match(item.get("text", "") or ""))
+
+
+def default_line(item, content):
+    return f"[{item.get('time', '')}] {item.get('name', 'Unknown')}: {content}"
+
+
+def select_messages(records, purpose=None, include_media=True, limit=0, line_format=default_line):
+    """
+    records: 从新到旧的记录迭代器 (预算用完后不再继续读取)
+    limit: 最多查看的记录条数，<= 0 表示不限
+    line_format(item, content): 单条消息在提示词中的形式，用于估算 token
+    返回 (kept, report)，kept 为按时间正序排列的 [(record, content), ...]
+    """
+    opts = purpose_options(purpose)
+    kept = []
+    seen = set()
+    tokens = 0
+    report = {
+        "purpose": purpose,
+        "budget": opts["budget"],
+        "scanned": 0,
+        "kept": 0,
+        "dropped_stickers": 0,
+        "dropped_duplicates": 0,
+        "truncated": 0,
+        "budget_exhausted": False,
+    }
+
+    for item in records:
+        if limit > 0 and report["scanned"] >= limit:
+            break
+        report["scanned"] += 1
+
+        if opts["drop_stickers"] and is_sticker(item):
+            report["dropped_stickers"] += 1
+            continue
+
+        content = message_content(item, include_media, opts["extra_chars"])
+        if opts["dedupe"] and item.get("content_type", "text") == "text":
+            # 刷屏/复读：相同内容只保留最新的一条
+            key = "".join(content.split())
+            if key in seen:
+                report["dropped_duplicates"] += 1
+                continue
+            seen.add(key)
+
+        if opts["message_chars"] and len(content) > opts["message_chars"]:
+            content = content[:opts["message_chars"]] + "...(已截断)"
+            report["truncated"] += 1
+
+        cost = estimate_tokens(line_format(item, content)) + 1  # +1 为换行/分隔符
+        if opts["budget"] and tokens + cost > opts["budget"]:
+            report["budget_exhausted"] = True
+            break
+        tokens += cost
+        kept.append((item, content))
+
+    kept.reverse()
+    report["kept"] = len(kept)
+    report["tokens"] = tokens
+    if purpose is not None:
+        print(f"[Context] {purpose}: 扫描 {report['scanned']} 条，保留 {report['kept']} 条 "
+              f"(表情 -{report['dropped_stickers']}，重复 -{report['dropped_duplicates']}，截断 {report['truncated']})，"
+              f"约 {tokens} tokens / 预算 {opts['budget']}")
+    return kept, report
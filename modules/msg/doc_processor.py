@@ -1,10 +1,208 @@
 # modules/doc_processor.py
 import os
+import hashlib
+import threading
+from collections import OrderedDict
 from docx import Document
 from langchain_community.document_loaders import PyPDFLoader, TextLoader, UnstructuredWordDocumentLoader
 from .translator import BailianTranslator
 import config
 
+# 提取逻辑有改动时递增，旧版本的缓存会自然失效
+EXTRACTOR_VERSION = 1
+
+SUPPORTED_EXTS = (".pdf", ".txt", ".docx", ".doc", ".pptx")
+
+DOC_TEXT_CACHE_DIR = getattr(config, "DOC_TEXT_CACHE_DIR", os.path.join(config.DATA_DIR, "doc_text_cache"))
+
+
+def _load_full_text(file_path: str, ext: str) -> str:
+    """
+    用对应的加载器读取完整文本，不截断；不支持的格式返回 None，读取失败抛出异常
+    """
+    if ext == ".pdf":
+        print(f"[DEBUG] 使用 PyPDFLoader 读取 PDF 文件")
+        loader = PyPDFLoader(file_path)
+    elif ext == ".txt":
+        print(f"[DEBUG] 使用 TextLoader 读取 TXT 文件")
+        loader = TextLoader(file_path, encoding="utf-8")
+    elif ext in [".docx", ".doc"]:
+        print(f"[DEBUG] 使用 UnstructuredWordDocumentLoader 读取 Word 文件")
+        loader = UnstructuredWordDocumentLoader(file_path)
+    elif ext == ".pptx":
+        print(f"[DEBUG] 使用 PowerPoint 文件处理器读取 PPTX 文件")
+        # 导入 PowerPoint 处理模块
+        from pptx import Presentation
+        # 直接读取 PPTX 文件内容
+        prs = Presentation(file_path)
+        full_text = []
+        for slide_num, slide in enumerate(prs.slides):
+            slide_text = f"\n--- 幻面 {slide_num + 1} ---\n"
+            for shape in slide.shapes:
+                if hasattr(shape, "text"):
+                    slide_text += shape.text + "\n"
+            if slide_text.strip():  # 如果幻灯片有文本内容
+                full_text.append(slide_text)
+        full_text = "".join(full_text)
+        print(f"[DEBUG] 从 PPTX 提取的文本长度: {len(full_text)}")
+        return full_text
+    else:
+        return None
+
+    print(f"[DEBUG] 开始加载文档...")
+    docs = loader.load()
+    print(f"[DEBUG] 加载了 {len(docs)} 个文档片段")
+    full_text = "\n".join([d.page_content for d in docs])
+    print(f"[DEBUG] 合并后的文本长度: {len(full_text)}")
+    return full_text
+
+
+class ExtractionCache:
+    """
+    文档全文缓存：DOC_TEXT_CACHE_DIR/<内容 sha256>_v<EXTRACTOR_VERSION>.txt
+
+    - 以文件内容哈希 + 提取器版本为键，同一份文件被转发、改名后仍能命中
+    - 内存里记录 (路径, 大小, mtime) -> 哈希，文件没变时不必重新计算哈希
+    - 只保存一份完整文本，各调用方按自己的 max_chars 截取
+    - 总大小超过 DOC_TEXT_CACHE_MAX_BYTES 时按最近使用时间淘汰
+    """
+
+    def __init__(self, cache_dir=DOC_TEXT_CACHE_DIR, max_bytes=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes if max_bytes is not None else getattr(config, "DOC_TEXT_CACHE_MAX_BYTES", 128 * 1024 * 1024)
+        self._hash_memo = {}   # (path, size, mtime_ns) -> sha256
+        self._index = None     # OrderedDict: 缓存文件名 -> 大小，旧 -> 新
+        self._total_bytes = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def _ensure_loaded(self):
+        if self._index is not None:
+            return
+        with self._lock:
+            if self._index is not None:
+                return
+            found = []
+            if os.path.isdir(self.cache_dir):
+                for name in os.listdir(self.cache_dir):
+                    if not name.endswith(".txt"):
+                        continue
+                    try:
+                        st = os.stat(os.path.join(self.cache_dir, name))
+                    except OSError:
+                        continue
+                    found.append((st.st_mtime, name, st.st_size))
+            found.sort()
+            self._index = OrderedDict((name, size) for _, name, size in found)
+            self._total_bytes = sum(self._index.values())
+
+    def _content_key(self, file_path):
+        st = os.stat(file_path)
+        memo_key = (os.path.abspath(file_path), st.st_size, st.st_mtime_ns)
+        sha = self._hash_memo.get(memo_key)
+        if sha is None:
+            digest = hashlib.sha256()
+            with open(file_path, "rb") as f:
+                for block in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(block)
+            sha = digest.hexdigest()
+            self._hash_memo[memo_key] = sha
+        return f"{sha}_v{EXTRACTOR_VERSION}.txt"
+
+    def get(self, file_path):
+        """返回缓存的完整文本，未命中返回 None"""
+        self._ensure_loaded()
+        name = self._content_key(file_path)
+        with self._lock:
+            if name not in self._index:
+                self.misses += 1
+                return None
+            self._index.move_to_end(name)
+        path = os.path.join(self.cache_dir, name)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+            os.utime(path, None)  # 记录最近使用时间
+        except OSError:
+            with self._lock:
+                self._total_bytes -= self._index.pop(name, 0)
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return text
+
+    def put(self, file_path, text):
+        self._ensure_loaded()
+        name = self._content_key(file_path)
+        path = os.path.join(self.cache_dir, name)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except OSError as e:
+            print(f"[DocCache] 写入缓存失败: {e}")
+            return
+        with self._lock:
+            self._total_bytes -= self._index.pop(name, 0)
+            self._index[name] = size
+            self._total_bytes += size
+            # 超出容量时从最久未使用的开始删除
+            while self._total_bytes > self.max_bytes and len(self._index) > 1:
+                old_name, old_size = self._index.popitem(last=False)
+                self._total_bytes -= old_size
+                try:
+                    os.remove(os.path.join(self.cache_dir, old_name))
+                except OSError:
+                    pass
+
+    def stats(self):
+        self._ensure_loaded()
+        with self._lock:
+            return {
+                "entries": len(self._index),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+_extraction_cache = ExtractionCache()
+
+
+def get_extraction_cache():
+    """进程内共享的文档全文缓存"""
+    return _extraction_cache
+
+
+def extract_full_text(file_path: str) -> str:
+    """
+    返回文件的完整文本 (已去除首尾空白)，优先读缓存
+    不支持的格式返回 None，读取失败抛出异常
+    """
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext not in SUPPORTED_EXTS:
+        return None
+
+    cached = _extraction_cache.get(file_path)
+    if cached is not None:
+        print(f"[DEBUG] 命中文档缓存，文本长度: {len(cached)}")
+        return cached
+
+    full_text = _load_full_text(file_path, ext)
+    if full_text is None:
+        return None
+    # 简单清洗空格
+    full_text = full_text.strip()
+    _extraction_cache.put(file_path, full_text)
+    return full_text
+
+
 # 新增：只提取文本，不总结
 def extract_text_from_file(file_path: str, max_chars: int = 1000) -> str:
     """
@@ -22,53 +220,12 @@ def extract_text_from_file(file_path: str, max_chars: int = 1000) -> str:
     print(f"[DEBUG] 文件扩展名: {ext}")
 
     try:
-        if ext == ".pdf":
-            print(f"[DEBUG] 使用 PyPDFLoader 读取 PDF 文件")
-            loader = PyPDFLoader(file_path)
-            print(f"[DEBUG] 开始加载文档...")
-            docs = loader.load()
-            print(f"[DEBUG] 加载了 {len(docs)} 个文档片段")
-            full_text = "\n".join([d.page_content for d in docs])
-            print(f"[DEBUG] 合并后的文本长度: {len(full_text)}")
-        elif ext == ".txt":
-            print(f"[DEBUG] 使用 TextLoader 读取 TXT 文件")
-            loader = TextLoader(file_path, encoding="utf-8")
-            print(f"[DEBUG] 开始加载文档...")
-            docs = loader.load()
-            print(f"[DEBUG] 加载了 {len(docs)} 个文档片段")
-            full_text = "\n".join([d.page_content for d in docs])
-            print(f"[DEBUG] 合并后的文本长度: {len(full_text)}")
-        elif ext in [".docx", ".doc"]:
-            print(f"[DEBUG] 使用 UnstructuredWordDocumentLoader 读取 Word 文件")
-            loader = UnstructuredWordDocumentLoader(file_path)
-            print(f"[DEBUG] 开始加载文档...")
-            docs = loader.load()
-            print(f"[DEBUG] 加载了 {len(docs)} 个文档片段")
-            full_text = "\n".join([d.page_content for d in docs])
-            print(f"[DEBUG] 合并后的文本长度: {len(full_text)}")
-        elif ext == ".pptx":
-            print(f"[DEBUG] 使用 PowerPoint 文件处理器读取 PPTX 文件")
-            # 导入 PowerPoint 处理模块
-            from pptx import Presentation
-            # 直接读取 PPTX 文件内容
-            prs = Presentation(file_path)
-            full_text = []
-            for slide_num, slide in enumerate(prs.slides):
-                slide_text = f"\n--- 幻面 {slide_num + 1} ---\n"
-                for shape in slide.shapes:
-                    if hasattr(shape, "text"):
-                        slide_text += shape.text + "\n"
-                if slide_text.strip():  # 如果幻灯片有文本内容
-                    full_text.append(slide_text)
-            full_text = "".join(full_text)
-            print(f"[DEBUG] 从 PPTX 提取的文本长度: {len(full_text)}")
-        else:
+        full_text = extract_full_text(file_path)
+        if full_text is None:
             result = f"[不支持的文件格式: {ext}]"
             print(f"[DEBUG] 不支持的文件格式，返回: {result}")
             return result
 
-        # 简单清洗空格
-        full_text = full_text.strip()
         print(f"[DEBUG] 清洗后的文本长度: {len(full_text)}")
 
         if len(full_text) > max_chars:
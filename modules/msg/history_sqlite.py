@@ -0,0 +1,230 @@
+# modules/msg/history_sqlite.py
+"""
+可选的 SQLite 聊天记录存储 (WAL 模式)
+
+与 JsonlHistoryStore 提供相同的方法，在 config.py 中设置
+HISTORY_BACKEND = "sqlite" 即可切换。按 (contact_id, seq) 和 (contact_id, content_type, seq) 建索引：
+最近消息缓存之外的按类型回读 (如"最近 50 条图片")、图片/文件索引的重建都走索引查询，
+不再在 Python 里全量过滤。
+
+一次性迁移现有 server_history 记录:
+    python -m modules.msg.history_sqlite --migrate
+"""
+import os
+import json
+import sqlite3
+import argparse
+import threading
+
+import config
+from .history_store import JsonlHistoryStore, record_epoch
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    seq          INTEGER PRIMARY KEY AUTOINCREMENT,
+    contact_id   TEXT    NOT NULL,
+    msg_id       TEXT,
+    epoch        INTEGER NOT NULL,
+    content_type TEXT    NOT NULL,
+    sender_id    TEXT,
+    record       TEXT    NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_contact_seq   ON messages(contact_id, seq);
+CREATE INDEX IF NOT EXISTS idx_messages_contact_type  ON messages(contact_id, content_type, seq);
+CREATE INDEX IF NOT EXISTS idx_messages_msg_id        ON messages(contact_id, msg_id);
+-- 没有查询使用的旧索引 (按日期筛选走 media_index)
+DROP INDEX IF EXISTS idx_messages_contact_epoch;
+DROP INDEX IF EXISTS idx_messages_type_epoch;
+DROP INDEX IF EXISTS idx_messages_sender;
+"""
+
+# iter_reverse 每次从数据库取出的行数
+_PAGE_SIZE = 200
+
+
+def _row_values(contact_id, record):
+    return (
+        str(contact_id),
+        str(record.get("msg_id", "")) or None,
+        record_epoch(record),
+        record.get("content_type", "text"),
+        str(record.get("id", "")) or None,
+        json.dumps(record, ensure_ascii=False),
+    )
+
+
+class SqliteHistoryStore:
+    """
+    基于 SQLite 的聊天记录存储，每个线程持有独立连接
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or getattr(config, "HISTORY_DB_PATH", os.path.join(config.DATA_DIR, "history.db"))
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript(_SCHEMA)
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def location(self, contact_id):
+        return f"{self.db_path}#{contact_id}"
+
+    # ---------- 写入 ----------
+
+    def append(self, contact_id, record):
+        conn = self._conn()
+        conn.execute(
+            "INSERT INTO messages (contact_id, msg_id, epoch, content_type, sender_id, record) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            _row_values(contact_id, record),
+        )
+        conn.commit()
+
+    def update(self, contact_id, msg_id, fields):
+        """修改一条已保存的记录 (如后台 OCR 回填)"""
+        if not msg_id:
+            return
+        conn = self._conn()
+        with conn:
+            row = conn.execute(
+                "SELECT seq, record FROM messages WHERE contact_id = ? AND msg_id = ? ORDER BY seq DESC LIMIT 1",
+                (str(contact_id), str(msg_id)),
+            ).fetchone()
+            if row is None:
+                return
+            record = json.loads(row[1])
+            record.update(fields)
+            conn.execute(
+                "UPDATE messages SET record = ?, content_type = ? WHERE seq = ?",
+                (json.dumps(record, ensure_ascii=False), record.get("content_type", "text"), row[0]),
+            )
+
+    def bulk_load(self, contact_id, records):
+        """整体替换某个联系人的记录（迁移用），在一个事务里完成"""
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM messages WHERE contact_id = ?", (str(contact_id),))
+            conn.executemany(
+                "INSERT INTO messages (contact_id, msg_id, epoch, content_type, sender_id, record) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (_row_values(contact_id, r) for r in records),
+            )
+
+    # ---------- 读取 ----------
+
+    @staticmethod
+    def _filters(contact_id, content_type, since):
+        clauses = ["contact_id = ?"]
+        params = [str(contact_id)]
+        if content_type:
+            clauses.append("content_type = ?")
+            params.append(content_type)
+        if since is not None:
+            clauses.append("epoch >= ?")
+            params.append(int(since))
+        return clauses, params
+
+    def exists(self, contact_id):
+        row = self._conn().execute(
+            "SELECT 1 FROM messages WHERE contact_id = ? LIMIT 1", (str(contact_id),)
+        ).fetchone()
+        return row is not None
+
+    def iter_reverse(self, contact_id, content_type=None, since=None):
+        """从最新到最旧逐条产出记录，按页查询，调用方停止后不会再取后续页"""
+        clauses, params = self._filters(contact_id, content_type, since)
+        last_seq = None
+        while True:
+            page_clauses = list(clauses)
+            page_params = list(params)
+            if last_seq is not None:
+                page_clauses.append("seq < ?")
+                page_params.append(last_seq)
+            rows = self._conn().execute(
+                f"SELECT seq, record FROM messages WHERE {' AND '.join(page_clauses)} "
+                f"ORDER BY seq DESC LIMIT {_PAGE_SIZE}",
+                page_params,
+            ).fetchall()
+            if not rows:
+                return
+            for seq, record in rows:
+                yield json.loads(record)
+            last_seq = rows[-1][0]
+
+    def tail(self, contact_id, limit, content_type=None, since=None):
+        """返回最近 limit 条记录 (按时间正序)，limit <= 0 表示全部"""
+        clauses, params = self._filters(contact_id, content_type, since)
+        sql = f"SELECT record FROM messages WHERE {' AND '.join(clauses)} ORDER BY seq DESC"
+        if limit > 0:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+        rows = self._conn().execute(sql, params).fetchall()
+        return [json.loads(r[0]) for r in reversed(rows)]
+
+    def read_all(self, contact_id):
+        return self.tail(contact_id, 0)
+
+    def last_record(self, contact_id):
+        records = self.tail(contact_id, 1)
+        return records[0] if records else None
+
+    def count(self, contact_id):
+        row = self._conn().execute(
+            "SELECT COUNT(*) FROM messages WHERE contact_id = ?", (str(contact_id),)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def list_contacts(self):
+        rows = self._conn().execute("SELECT DISTINCT contact_id FROM messages").fetchall()
+        return sorted(r[0] for r in rows)
+
+
+def migrate_json_history(source_dir=None, db_path=None):
+    """
+    把 server_history 下已有的记录（旧版 <id>.json 或分段 JSONL）全部导入 SQLite
+    可重复执行：每个联系人的记录会被整体替换
+    """
+    source_dir = source_dir or config.HISTORY_JSON_DIR
+    source = JsonlHistoryStore(base_dir=source_dir)
+    target = SqliteHistoryStore(db_path=db_path)
+
+    total = 0
+    for contact_id in source.list_contacts():
+        legacy_path = os.path.join(source_dir, f"{contact_id}.json")
+        try:
+            if os.path.exists(legacy_path) and not os.path.isdir(os.path.join(source_dir, contact_id)):
+                # 旧版整文件 JSON 直接读取，不改动源文件
+                with open(legacy_path, "r", encoding="utf-8") as f:
+                    records = json.load(f)
+            else:
+                records = source.read_all(contact_id)
+            target.bulk_load(contact_id, records)
+            total += len(records)
+            print(f"[HistorySqlite] {contact_id}: 导入 {len(records)} 条")
+        except Exception as e:
+            print(f"[HistorySqlite] {contact_id} 导入失败: {e}")
+
+    print(f"[HistorySqlite] 迁移完成，共导入 {total} 条记录 -> {target.db_path}")
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SQLite 聊天记录存储工具")
+    parser.add_argument("--migrate", action="store_true", help="把 server_history 下的记录导入 SQLite")
+    parser.add_argument("--source", default=None, help="记录目录，默认 config.HISTORY_JSON_DIR")
+    parser.add_argument("--db", default=None, help="数据库路径，默认 config.HISTORY_DB_PATH")
+    args = parser.parse_args()
+
+    if args.migrate:
+        migrate_json_history(args.source, args.db)
+    else:
+        parser.print_help()
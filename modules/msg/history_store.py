@@ -0,0 +1,378 @@
+# modules/msg/history_store.py
+"""
+聊天记录存储引擎 (append-only JSONL 分段日志)
+
+目录结构:
+    HISTORY_JSON_DIR/<contact_id>/000001.jsonl
+    HISTORY_JSON_DIR/<contact_id>/000002.jsonl   <- 当前写入段
+
+- 每条消息是一行 JSON，新消息只追加到最新的段，不再整文件读-改-写
+- 段文件超过 HISTORY_SEGMENT_MAX_BYTES 后轮转到新段，只保留最近 HISTORY_MAX_SEGMENTS 段
+- 读取最近 N 条时从最新段的文件末尾倒着读，不解析整个历史
+- 旧版 <contact_id>.json 文件在第一次访问时自动迁移为分段格式
+- 修改已保存的记录 (如后台 OCR 回填) 时追加一行补丁 {"_patch": msg_id, "fields": {...}}，
+  读取时合并到对应记录上
+"""
+import os
+import json
+import hashlib
+import threading
+from datetime import datetime
+
+import config
+
+SEGMENT_SUFFIX = ".jsonl"
+LEGACY_SUFFIX = ".json"
+PATCH_KEY = "_patch"
+# 补丁行以该前缀开头；记录内容里的引号会被转义，不会出现同样的字节序列
+_PATCH_PREFIX = b'{"' + PATCH_KEY.encode() + b'"'
+_READ_BLOCK_SIZE = 64 * 1024
+
+
+def _reverse_lines(file_path):
+    """从文件末尾按块倒序读取，逐行产出 (bytes)，最新的行最先返回"""
+    with open(file_path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        remainder = b""
+        while position > 0:
+            read_size = min(_READ_BLOCK_SIZE, position)
+            position -= read_size
+            f.seek(position)
+            block = f.read(read_size) + remainder
+            lines = block.split(b"\n")
+            # 第一段可能是不完整的行，留到下一次读取时拼接
+            remainder = lines[0]
+            for line in reversed(lines[1:]):
+                if line.strip():
+                    yield line
+        if remainder.strip():
+            yield remainder
+
+
+def parse_time_to_epoch(time_str):
+    """把 "2025-12-19 20:12:16" 或 "2025-12-19" 格式的时间转成时间戳，无法解析时返回 None"""
+    if not time_str:
+        return None
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return int(datetime.strptime(str(time_str), fmt).timestamp())
+        except ValueError:
+            continue
+    return None
+
+
+def record_epoch(record):
+    """记录的时间戳：新记录自带 timestamp 字段，旧记录从 time 字符串解析"""
+    timestamp = record.get("timestamp")
+    if isinstance(timestamp, (int, float)):
+        return int(timestamp)
+    return parse_time_to_epoch(record.get("time")) or 0
+
+
+def _record_fingerprint(record):
+    """没有 msg_id 的旧记录用 (发送者, 时间, 内容) 识别"""
+    key = f"{record.get('id', '')}|{record.get('time', '')}|{record.get('text', '')}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def record_key(record):
+    """记录的唯一标识：有 msg_id 时用 msg_id，旧记录用 (发送者, 时间, 内容) 指纹"""
+    msg_id = record.get("msg_id")
+    return f"id:{msg_id}" if msg_id is not None else f"fp:{_record_fingerprint(record)}"
+
+
+def record_watermark(record):
+    """记录在时间线上的位置 (水位)，用于之后只读取它之后的新消息"""
+    return {
+        "msg_id": record.get("msg_id"),
+        "epoch": record_epoch(record),
+        "time": record.get("time", ""),
+        "fingerprint": _record_fingerprint(record),
+    }
+
+
+def watermark_reached(watermark):
+    """返回 stop_at 函数：从新往旧读到水位对应的消息 (或更早的消息) 时为 True"""
+    epoch = watermark.get("epoch", 0)
+    fingerprint = watermark.get("fingerprint")
+
+    def stop_at(record):
+        if watermark.get("msg_id") is not None:
+            if str(record.get("msg_id")) == str(watermark["msg_id"]):
+                return True
+            return record_epoch(record) < epoch
+        # 水位是没有 msg_id 的旧记录：同一秒内的记录靠指纹找到水位本身，否则同一条消息会被当成新消息反复读到
+        if fingerprint is None:
+            # 早先保存的水位没有指纹，同一秒的记录一律视为已读过
+            return record_epoch(record) <= epoch
+        return record_epoch(record) < epoch or _record_fingerprint(record) == fingerprint
+    return stop_at
+
+
+def _parse_line(line):
+    """解析一行 JSONL，写入中断造成的残行直接跳过"""
+    try:
+        return json.loads(line)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+class JsonlHistoryStore:
+    """
+    按联系人分段存储聊天记录
+    """
+
+    def __init__(self, base_dir=None, segment_max_bytes=None, max_segments=None):
+        self.base_dir = base_dir or config.HISTORY_JSON_DIR
+        self.segment_max_bytes = segment_max_bytes or getattr(config, "HISTORY_SEGMENT_MAX_BYTES", 512 * 1024)
+        self.max_segments = max_segments or getattr(config, "HISTORY_MAX_SEGMENTS", 8)
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        # 已封存的段不会再变化，缓存其行数: {segment_path: (size, count)}
+        self._segment_counts = {}
+        os.makedirs(self.base_dir, exist_ok=True)
+
+    # ---------- 路径与锁 ----------
+
+    def _lock_for(self, contact_id):
+        with self._locks_guard:
+            lock = self._locks.get(contact_id)
+            if lock is None:
+                lock = threading.RLock()
+                self._locks[contact_id] = lock
+            return lock
+
+    def _contact_dir(self, contact_id):
+        return os.path.join(self.base_dir, str(contact_id))
+
+    def _legacy_file(self, contact_id):
+        return os.path.join(self.base_dir, f"{contact_id}{LEGACY_SUFFIX}")
+
+    def _segments(self, contact_id):
+        """返回该联系人的所有段文件路径 (按时间正序)"""
+        contact_dir = self._contact_dir(contact_id)
+        if not os.path.isdir(contact_dir):
+            return []
+        names = sorted(n for n in os.listdir(contact_dir) if n.endswith(SEGMENT_SUFFIX))
+        return [os.path.join(contact_dir, n) for n in names]
+
+    def _new_segment_path(self, contact_id, segments):
+        if segments:
+            last_seq = int(os.path.basename(segments[-1])[:-len(SEGMENT_SUFFIX)])
+        else:
+            last_seq = 0
+        return os.path.join(self._contact_dir(contact_id), f"{last_seq + 1:06d}{SEGMENT_SUFFIX}")
+
+    def location(self, contact_id):
+        """返回联系人记录所在目录（用于日志/接口返回）"""
+        return self._contact_dir(contact_id)
+
+    # ---------- 旧格式迁移 ----------
+
+    def _migrate_legacy(self, contact_id):
+        """把旧版整文件 JSON 转成分段格式，原文件改名为 .json.migrated 保留备份"""
+        legacy_path = self._legacy_file(contact_id)
+        if not os.path.exists(legacy_path) or self._segments(contact_id):
+            return
+        try:
+            with open(legacy_path, "r", encoding="utf-8") as f:
+                records = json.load(f)
+        except Exception as e:
+            print(f"[HistoryStore] 旧记录 {legacy_path} 解析失败，跳过迁移: {e}")
+            return
+
+        os.makedirs(self._contact_dir(contact_id), exist_ok=True)
+        segment_path = self._new_segment_path(contact_id, [])
+        with open(segment_path, "w", encoding="utf-8") as f:
+            for record in records if isinstance(records, list) else []:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        os.replace(legacy_path, legacy_path + ".migrated")
+        print(f"[HistoryStore] 已将 {legacy_path} 迁移为分段格式 ({len(records)} 条)")
+
+    def _ensure_migrated(self, contact_id):
+        if os.path.exists(self._legacy_file(contact_id)):
+            with self._lock_for(contact_id):
+                self._migrate_legacy(contact_id)
+
+    # ---------- 写入 ----------
+
+    def append(self, contact_id, record):
+        """追加一条记录，必要时轮转段文件"""
+        contact_id = str(contact_id)
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock_for(contact_id):
+            self._migrate_legacy(contact_id)
+            os.makedirs(self._contact_dir(contact_id), exist_ok=True)
+
+            segments = self._segments(contact_id)
+            if not segments or os.path.getsize(segments[-1]) >= self.segment_max_bytes:
+                segments.append(self._new_segment_path(contact_id, segments))
+                self._drop_old_segments(segments)
+
+            with open(segments[-1], "a", encoding="utf-8") as f:
+                f.write(line)
+
+    def update(self, contact_id, msg_id, fields):
+        """修改一条已保存的记录：追加一行补丁，不重写原记录"""
+        if not msg_id:
+            return
+        patch = {PATCH_KEY: str(msg_id), "fields": fields}
+        line = json.dumps(patch, ensure_ascii=False) + "\n"
+        contact_id = str(contact_id)
+        with self._lock_for(contact_id):
+            segments = self._segments(contact_id)
+            if not segments:
+                return
+            with open(segments[-1], "a", encoding="utf-8") as f:
+                f.write(line)
+
+    def _drop_old_segments(self, segments):
+        """保留最近 max_segments 段，更早的直接删除"""
+        while len(segments) > self.max_segments:
+            oldest = segments.pop(0)
+            try:
+                os.remove(oldest)
+                self._segment_counts.pop(oldest, None)
+            except OSError as e:
+                print(f"[HistoryStore] 删除旧段 {oldest} 失败: {e}")
+
+    # ---------- 读取 ----------
+
+    def exists(self, contact_id):
+        contact_id = str(contact_id)
+        return bool(self._segments(contact_id)) or os.path.exists(self._legacy_file(contact_id))
+
+    def iter_reverse(self, contact_id, content_type=None, since=None):
+        """
+        从最新到最旧逐条产出记录，调用方读够了即可停止，不会解析更早的段
+        content_type: 只返回该类型的记录 (text / image / file)
+        since: 时间戳，遇到更早的记录即停止
+        """
+        contact_id = str(contact_id)
+        self._ensure_migrated(contact_id)
+        # 倒序读取时补丁总是先于它修改的记录出现: {msg_id: fields}
+        pending_patches = {}
+        for segment_path in reversed(self._segments(contact_id)):
+            try:
+                for line in _reverse_lines(segment_path):
+                    record = _parse_line(line)
+                    if record is None:
+                        continue
+                    if PATCH_KEY in record:
+                        # 越新的补丁越先读到，同名字段以新的为准
+                        merged = dict(record.get("fields", {}))
+                        merged.update(pending_patches.get(record[PATCH_KEY], {}))
+                        pending_patches[record[PATCH_KEY]] = merged
+                        continue
+                    if since is not None and record_epoch(record) < since:
+                        return
+                    if content_type and record.get("content_type", "text") != content_type:
+                        continue
+                    fields = pending_patches.pop(str(record.get("msg_id")), None)
+                    if fields:
+                        record.update(fields)
+                    yield record
+            except FileNotFoundError:
+                # 读取过程中该段被轮转删除
+                continue
+
+    def tail(self, contact_id, limit, content_type=None, since=None):
+        """返回最近 limit 条记录 (按时间正序)，limit <= 0 表示全部"""
+        if limit <= 0 and not content_type and since is None:
+            return self.read_all(contact_id)
+        records = []
+        for record in self.iter_reverse(contact_id, content_type=content_type, since=since):
+            records.append(record)
+            if 0 < limit <= len(records):
+                break
+        records.reverse()
+        return records
+
+    def read_all(self, contact_id):
+        """返回全部记录 (按时间正序)"""
+        contact_id = str(contact_id)
+        self._ensure_migrated(contact_id)
+        records = []
+        by_msg_id = {}
+        for segment_path in self._segments(contact_id):
+            try:
+                with open(segment_path, "rb") as f:
+                    for line in f:
+                        if not line.strip():
+                            continue
+                        record = _parse_line(line)
+                        if record is None:
+                            continue
+                        if PATCH_KEY in record:
+                            target = by_msg_id.get(record[PATCH_KEY])
+                            if target is not None:
+                                target.update(record.get("fields", {}))
+                            continue
+                        if record.get("msg_id"):
+                            by_msg_id[str(record["msg_id"])] = record
+                        records.append(record)
+            except FileNotFoundError:
+                continue
+        return records
+
+    def last_record(self, contact_id):
+        for record in self.iter_reverse(contact_id):
+            return record
+        return None
+
+    def count(self, contact_id):
+        """统计记录条数：只数换行符 (扣除补丁行)，不做 JSON 解析；已封存的段结果会被缓存"""
+        contact_id = str(contact_id)
+        self._ensure_migrated(contact_id)
+        total = 0
+        for segment_path in self._segments(contact_id):
+            try:
+                size = os.path.getsize(segment_path)
+                cached = self._segment_counts.get(segment_path)
+                if cached and cached[0] == size:
+                    total += cached[1]
+                    continue
+                with open(segment_path, "rb") as f:
+                    data = f.read()
+                n = data.count(b"\n") - data.count(_PATCH_PREFIX)
+                self._segment_counts[segment_path] = (size, n)
+                total += n
+            except FileNotFoundError:
+                continue
+        return total
+
+    def list_contacts(self):
+        """返回所有有记录的联系人 ID（含尚未迁移的旧版 JSON 文件）"""
+        if not os.path.exists(self.base_dir):
+            return []
+        contacts = set()
+        for name in os.listdir(self.base_dir):
+            full_path = os.path.join(self.base_dir, name)
+            if os.path.isdir(full_path):
+                if any(n.endswith(SEGMENT_SUFFIX) for n in os.listdir(full_path)):
+                    contacts.add(name)
+            elif name.endswith(LEGACY_SUFFIX):
+                contacts.add(name[:-len(LEGACY_SUFFIX)])
+        return sorted(contacts)
+
+
+_store = None
+_store_guard = threading.Lock()
+
+
+def get_history_store():
+    """
+    进程内共享的存储实例
+    config.HISTORY_BACKEND = "sqlite" 时使用 SQLite 存储，否则使用 JSONL 分段存储
+    """
+    global _store
+    if _store is None:
+        with _store_guard:
+            if _store is None:
+                if getattr(config, "HISTORY_BACKEND", "jsonl") == "sqlite":
+                    from .history_sqlite import SqliteHistoryStore
+                    _store = SqliteHistoryStore()
+                else:
+                    _store = JsonlHistoryStore()
+    return _store
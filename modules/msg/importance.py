@@ -0,0 +1,110 @@
+# modules/msg/importance.py
+"""
+消息重要度的本地预评分
+
+extract_important_messages 发给大模型的大部分内容是提示词里要求忽略的闲聊。
+这里在消息入库时 (save_incoming_message，图片/文件在后台提取完成后重新评分) 用正则和关键词
+给每条消息打一个重要度分数，存在记录的 importance 字段里：
+
+- 日期、DDL/截止、具体时间、金额
+- 会议、任务分配、金钱往来、紧急通知等关键词
+- 文件传输 (文档类文件额外加分)
+- @全体成员
+
+每类信号只计一次，分数为命中信号的权重之和。提醒时只把分数达到 NOTIFY_IMPORTANCE_THRESHOLD 的消息
+连同前后少量相邻消息 (NOTIFY_CONTEXT_BEFORE / NOTIFY_CONTEXT_AFTER) 交给大模型；
+没有 importance 字段的旧记录在读取时现场评分。
+"""
+import re
+
+import config
+from .context_builder import message_content
+
+_DATE_PATTERN = re.compile(
+    r"\d{4}[-/.年]\d{1,2}[-/.月]\d{1,2}|\d{1,2}月\d{1,2}[日号]|(?<!\d)\d{1,2}/\d{1,2}(?!\d)"
+    r"|[今明后]天|[本这下]?(周|星期|礼拜)[一二三四五六日天1-7]|下周|月底|月初"
+)
+_TIME_PATTERN = re.compile(
+    r"\d{1,2}[:：]\d{2}|[上下中]午|早上|晚上|凌晨|\d{1,2}\s*点|[一二三四五六七八九十两]{1,3}点"
+)
+_AMOUNT_PATTERN = re.compile(r"\d+(\.\d+)?\s*(元|块|万|rmb)|[¥￥$]\s*\d+", re.I)
+_DDL_PATTERN = re.compile(r"ddl|deadline|截止|截至|\bdue\b|之前(交|提交|完成)|逾期|过期", re.I)
+_AT_ALL_PATTERN = re.compile(r"@全体成员|@所有人|@all\b|\[CQ:at,qq=all\]", re.I)
+
+_MEETING_WORDS = ("开会", "会议", "例会", "腾讯会议", "线上会", "签到", "讲座", "答辩", "面试", "集合", "地点", "教室", "改到", "改为")
+_ASSIGNMENT_WORDS = ("作业", "任务", "提交", "上交", "报告", "负责", "分工", "安排", "完成", "填写", "报名", "审核", "汇报")
+_MONEY_WORDS = ("转账", "收款", "付款", "报销", "缴费", "交费", "发票", "红包", "AA", "工资", "退款")
+_URGENT_WORDS = ("紧急", "重要", "务必", "通知", "注意", "尽快", "马上", "提醒", "报错", "故障", "出错")
+_DOCUMENT_EXTENSIONS = (".pdf", ".doc", ".docx", ".xls", ".xlsx", ".ppt", ".pptx", ".zip", ".rar", ".7z")
+
+# 各类信号的权重
+SIGNAL_WEIGHTS = {
+    "at_all": 3.0,
+    "ddl": 3.0,
+    "date": 1.5,
+    "time": 1.0,
+    "amount": 1.5,
+    "meeting": 2.0,
+    "assignment": 2.0,
+    "money": 2.0,
+    "urgent": 1.5,
+    "file": 2.0,
+    "document": 1.0,
+}
+
+
+def importance_signals(record):
+    """一条记录命中的信号名列表"""
+    text = message_content(record, include_media=True)
+    signals = []
+    if _AT_ALL_PATTERN.search(text):
+        signals.append("at_all")
+    if _DDL_PATTERN.search(text):
+        signals.append("ddl")
+    if _DATE_PATTERN.search(text):
+        signals.append("date")
+    if _TIME_PATTERN.search(text):
+        signals.append("time")
+    if _AMOUNT_PATTERN.search(text):
+        signals.append("amount")
+    for name, words in (("meeting", _MEETING_WORDS), ("assignment", _ASSIGNMENT_WORDS),
+                        ("money", _MONEY_WORDS), ("urgent", _URGENT_WORDS)):
+        if any(word in text for word in words):
+            signals.append(name)
+    if record.get("content_type") == "file":
+        signals.append("file")
+        if (record.get("local_path") or record.get("text", "")).lower().rstrip("]").endswith(_DOCUMENT_EXTENSIONS):
+            signals.append("document")
+    return signals
+
+
+def score_message(record):
+    """记录的重要度分数 (命中信号的权重之和)"""
+    return round(sum((SIGNAL_WEIGHTS[s] for s in importance_signals(record)), 0.0), 2)
+
+
+def importance_of(record):
+    """入库时保存的分数；旧记录没有该字段时现场计算"""
+    score = record.get("importance")
+    return score_message(record) if score is None else score
+
+
+def select_candidates(records, threshold=None, before=None, after=None):
+    """
+    records: 时间正序的记录列表
+    返回 (selected, report)：selected 为分数达到阈值的消息及其前后相邻消息 (保持时间正序)
+    """
+    threshold = getattr(config, "NOTIFY_IMPORTANCE_THRESHOLD", 2.0) if threshold is None else threshold
+    before = getattr(config, "NOTIFY_CONTEXT_BEFORE", 2) if before is None else before
+    after = getattr(config, "NOTIFY_CONTEXT_AFTER", 1) if after is None else after
+
+    hits = [i for i, record in enumerate(records) if importance_of(record) >= threshold]
+    chosen = set()
+    for i in hits:
+        chosen.update(range(max(0, i - before), min(len(records), i + after + 1)))
+    selected = [records[i] for i in sorted(chosen)]
+
+    report = {"scanned": len(records), "candidates": len(hits), "selected": len(selected), "threshold": threshold}
+    print(f"[Importance] 预筛选: {len(records)} 条消息中 {len(hits)} 条达到阈值 {threshold}，"
+          f"连同上下文共 {len(selected)} 条交给大模型")
+    return selected, report
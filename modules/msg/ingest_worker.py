@@ -0,0 +1,290 @@
+# modules/msg/ingest_worker.py
+"""
+后台入库任务队列
+
+/api/message/save 只负责把消息立即落盘 (extracted_content 先记为"处理中")，
+OCR、文件内容提取这类慢操作交给这里的固定大小线程池完成，再回填到记录里。
+
+- 每种任务 (kind) 由调用方通过 register() 注册处理函数，处理函数自行回填结果
+- 任务先写入 INGEST_JOURNAL_FILE 再执行，完成后记一笔 done；
+  服务重启时未完成的任务会被重新执行
+- 内存队列有上限 (INGEST_MAX_QUEUE)：队列满时新任务只留在任务日志里，
+  队列降到一半以下时再从日志补充进来，不会丢失也不会无限占用内存
+- 每完成 INGEST_JOURNAL_COMPACT_EVERY 个任务压缩一次任务日志，只保留未完成的任务
+- 失败的任务按指数退避重试，超过 INGEST_MAX_RETRIES 后交给 on_give_up 回调
+- 任务属于低优先级通道：@ 回复等高优先级任务进行中时，工作线程暂缓开始新任务
+  (最多 LOW_PRIORITY_MAX_DEFER 秒)
+- stats() 提供队列深度、处理耗时 (从入队到完成) 和失败次数
+"""
+import os
+import json
+import time
+import uuid
+import queue
+import threading
+from collections import deque
+
+import config
+from modules.executors import latency_summary, wait_for_high_priority_idle
+
+JOURNAL_FILE = getattr(config, "INGEST_JOURNAL_FILE", os.path.join(config.DATA_DIR, "ingest_pending.jsonl"))
+
+
+class IngestWorkerPool:
+    """
+    固定数量工作线程 + 持久化任务日志
+    """
+
+    def __init__(self, workers=None, max_retries=None, journal_file=JOURNAL_FILE, max_queue=None):
+        self.workers = workers or getattr(config, "INGEST_WORKERS", 2)
+        self.max_retries = max_retries if max_retries is not None else getattr(config, "INGEST_MAX_RETRIES", 3)
+        self.journal_file = journal_file
+        self.max_queue = max_queue or getattr(config, "INGEST_MAX_QUEUE", 1000)
+        self.compact_every = getattr(config, "INGEST_JOURNAL_COMPACT_EVERY", 500)
+        self._handlers = {}
+        self._give_up_handlers = {}
+        self._queue = queue.Queue(maxsize=self.max_queue)
+        self._live = set()      # 已载入内存的任务 (排队、执行中或等待重试)
+        self._spilled = 0       # 队列满时只写入日志、尚未载入内存的任务数
+        self._done_since_compact = 0
+        self._compacting = False
+        self._threads = []
+        self._started = False
+        self._lock = threading.Lock()
+        self._journal_lock = threading.Lock()
+
+        # 统计信息
+        self._in_flight = 0
+        self._completed = 0
+        self._failed = 0
+        self._retried = 0
+        self._deferred = 0
+        self._overflowed = 0
+        self._compactions = 0
+        self._latencies = {}  # kind -> deque[秒]
+
+    # ---------- 注册与启动 ----------
+
+    def register(self, kind, handler, on_give_up=None):
+        """
+        handler(task)：执行任务并回填结果；抛异常表示失败，会按退避策略重试
+        on_give_up(task, error)：重试次数用尽后调用
+        """
+        self._handlers[kind] = handler
+        if on_give_up:
+            self._give_up_handlers[kind] = on_give_up
+
+    def start(self):
+        """启动工作线程，并恢复上次未完成的任务"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+
+        for task in self._recover_pending():
+            self._enqueue(task)
+
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker_loop, name=f"ingest-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        print(f"[Ingest] 已启动 {self.workers} 个后台工作线程，待处理任务 {self._queue.qsize()} 个")
+
+    def submit(self, kind, payload):
+        """提交一个任务，立即返回 task_id"""
+        if kind not in self._handlers:
+            raise ValueError(f"未注册的任务类型: {kind}")
+        if not self._started:
+            self.start()
+        task = {
+            "task_id": uuid.uuid4().hex,
+            "kind": kind,
+            "payload": payload,
+            "attempts": 0,
+            "enqueued_at": time.time(),
+        }
+        # 先登记为已载入再写日志，避免并发的日志补充把同一任务再载入一次
+        with self._lock:
+            self._live.add(task["task_id"])
+        self._journal({"op": "enqueue", "task": task})
+        if not self._put(task):
+            with self._lock:
+                self._overflowed += 1
+                first = self._spilled == 1
+            if first:
+                print(f"[Ingest] 任务队列已满 ({self.max_queue})，新任务暂存在任务日志中")
+        return task["task_id"]
+
+    def _put(self, task):
+        """放入内存队列；队列已满时任务只留在日志里，返回 False"""
+        try:
+            self._queue.put_nowait(task)
+            return True
+        except queue.Full:
+            with self._lock:
+                self._live.discard(task["task_id"])
+                self._spilled += 1
+            return False
+
+    def _enqueue(self, task):
+        with self._lock:
+            self._live.add(task["task_id"])
+        return self._put(task)
+
+    # ---------- 任务日志 ----------
+
+    def _journal(self, entry):
+        with self._journal_lock:
+            try:
+                os.makedirs(os.path.dirname(self.journal_file), exist_ok=True)
+                with open(self.journal_file, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            except Exception as e:
+                print(f"[Ingest] 写入任务日志失败: {e}")
+
+    def _recover_pending(self):
+        """读取任务日志，找出未完成的任务，并把日志压缩为只含这些任务"""
+        tasks = [t for t in self._compact_journal().values() if t.get("kind") in self._handlers]
+        if tasks:
+            print(f"[Ingest] 恢复 {len(tasks)} 个上次未完成的任务")
+        return tasks
+
+    def _compact_journal(self):
+        """把任务日志重写为只含未完成的任务，返回 {task_id: task}"""
+        if not os.path.exists(self.journal_file):
+            return {}
+        pending = {}
+        with self._journal_lock:
+            try:
+                with open(self.journal_file, "r", encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            continue
+                        if entry.get("op") == "enqueue":
+                            task = entry["task"]
+                            pending[task["task_id"]] = task
+                        elif entry.get("op") == "done":
+                            pending.pop(entry.get("task_id"), None)
+
+                tmp_path = self.journal_file + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    for task in pending.values():
+                        f.write(json.dumps({"op": "enqueue", "task": task}, ensure_ascii=False) + "\n")
+                os.replace(tmp_path, self.journal_file)
+            except Exception as e:
+                print(f"[Ingest] 压缩任务日志失败: {e}")
+                return {}
+        with self._lock:
+            self._compactions += 1
+        return pending
+
+    def _finish(self, task):
+        """记录任务完成；按需压缩日志，并把只在日志里的任务补充进内存队列"""
+        # 先写 done 再移出内存，补充时不会把刚完成的任务当成未载入的任务
+        self._journal({"op": "done", "task_id": task["task_id"]})
+        with self._lock:
+            self._live.discard(task["task_id"])
+            self._done_since_compact += 1
+            refill = self._spilled and self._queue.qsize() < self.max_queue // 2
+            if self._compacting or not (refill or self._done_since_compact >= self.compact_every):
+                return
+            self._compacting = True
+        try:
+            pending = self._compact_journal()
+            with self._lock:
+                self._done_since_compact = 0
+                self._spilled = 0
+                missing = [t for tid, t in pending.items() if tid not in self._live and t.get("kind") in self._handlers]
+            for pending_task in missing:
+                self._enqueue(pending_task)
+        finally:
+            with self._lock:
+                self._compacting = False
+
+    # ---------- 执行 ----------
+
+    def _worker_loop(self):
+        while True:
+            task = self._queue.get()
+            try:
+                self._run(task)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, task):
+        kind = task["kind"]
+        handler = self._handlers.get(kind)
+        # 低优先级：让正在进行的 @ 回复先用 OCR 服务和 CPU
+        if not wait_for_high_priority_idle(0):
+            with self._lock:
+                self._deferred += 1
+            wait_for_high_priority_idle()
+        with self._lock:
+            self._in_flight += 1
+        try:
+            handler(task)
+            # 从入队 (重试则从本次重新入队) 到完成的总耗时
+            self._record_latency(kind, time.time() - task.get("queued_at", task["enqueued_at"]))
+            with self._lock:
+                self._completed += 1
+            self._finish(task)
+        except Exception as e:
+            task["attempts"] += 1
+            if task["attempts"] <= self.max_retries:
+                delay = min(60, 2 ** task["attempts"])
+                print(f"[Ingest] 任务 {kind} 失败 ({e})，{delay} 秒后第 {task['attempts']} 次重试")
+                with self._lock:
+                    self._retried += 1
+                timer = threading.Timer(delay, self._requeue, args=(task,))
+                timer.daemon = True
+                timer.start()
+            else:
+                print(f"[Ingest] 任务 {kind} 重试 {self.max_retries} 次后仍失败: {e}")
+                with self._lock:
+                    self._failed += 1
+                give_up = self._give_up_handlers.get(kind)
+                if give_up:
+                    try:
+                        give_up(task, e)
+                    except Exception as cb_error:
+                        print(f"[Ingest] 失败回调出错: {cb_error}")
+                self._finish(task)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def _requeue(self, task):
+        task["queued_at"] = time.time()
+        self._enqueue(task)
+
+    def _record_latency(self, kind, seconds):
+        with self._lock:
+            self._latencies.setdefault(kind, deque(maxlen=500)).append(seconds)
+
+    def stats(self):
+        with self._lock:
+            latency = {kind: latency_summary(values) for kind, values in self._latencies.items()}
+            return {
+                "workers": self.workers,
+                "queue_depth": self._queue.qsize(),
+                "max_queue": self.max_queue,
+                "spilled_to_journal": self._spilled,
+                "overflowed": self._overflowed,
+                "journal_compactions": self._compactions,
+                "in_flight": self._in_flight,
+                "completed": self._completed,
+                "retried": self._retried,
+                "failed": self._failed,
+                "deferred": self._deferred,
+                "latency": latency,
+            }
+
+
+_pool = IngestWorkerPool()
+
+
+def get_ingest_pool():
+    """进程内共享的后台任务池"""
+    return _pool
@@ -0,0 +1,226 @@
+# modules/msg/media_index.py
+"""
+图片 / 文件索引
+
+每个联系人一个追加写入的 JSONL 索引 (MEDIA_INDEX_DIR/<contact_id>.jsonl)，
+保存图片或文件消息时写入一条 add 记录：路径、大小、mtime、发送者、时间、OCR/文本预览。
+图库和文档列表直接读索引，不再解析完整聊天记录。
+
+- 存在性检查是懒惰的：只检查当前要返回的那一页，结果按 MEDIA_STAT_TTL 缓存
+- 文件已被删除时追加一条 tombstone 记录，之后不再返回
+- 预览内容可以后补 (update 记录)，例如后台 OCR 完成后
+
+索引丢失时会从聊天记录自动重建，也可以手动重建:
+    python -m modules.msg.media_index --rebuild [contact_id]
+"""
+import os
+import json
+import time
+import argparse
+import threading
+
+import config
+from .history_store import get_history_store, record_epoch
+
+MEDIA_INDEX_DIR = getattr(config, "MEDIA_INDEX_DIR", os.path.join(config.DATA_DIR, "media_index"))
+MEDIA_KINDS = ("image", "file")
+
+
+def _entry_from_record(record):
+    local_path = record.get("local_path", "")
+    size, mtime = None, None
+    try:
+        st = os.stat(local_path)
+        size, mtime = st.st_size, int(st.st_mtime)
+    except OSError:
+        pass
+    preview_chars = getattr(config, "MEDIA_PREVIEW_CHARS", 200)
+    return {
+        "op": "add",
+        "kind": record.get("content_type"),
+        "path": local_path,
+        "size": size,
+        "mtime": mtime,
+        "sender": record.get("name", "Unknown"),
+        "time": record.get("time"),
+        "timestamp": record_epoch(record),
+        "msg_id": record.get("msg_id"),
+        "preview": (record.get("extracted_content") or "")[:preview_chars],
+    }
+
+
+class MediaIndex:
+    """
+    所有联系人的媒体索引，按联系人懒加载到内存
+    """
+
+    def __init__(self, index_dir=MEDIA_INDEX_DIR, stat_ttl=None):
+        self.index_dir = index_dir
+        self.stat_ttl = stat_ttl if stat_ttl is not None else getattr(config, "MEDIA_STAT_TTL", 60)
+        # contact_id -> {path: entry}，dict 保持插入顺序 (旧 -> 新)
+        self._contacts = {}
+        # path -> (checked_at, exists)
+        self._stat_cache = {}
+        self._lock = threading.RLock()
+
+    def _index_file(self, contact_id):
+        return os.path.join(self.index_dir, f"{contact_id}.jsonl")
+
+    def _write(self, contact_id, op):
+        os.makedirs(self.index_dir, exist_ok=True)
+        with open(self._index_file(contact_id), "a", encoding="utf-8") as f:
+            f.write(json.dumps(op, ensure_ascii=False) + "\n")
+
+    def _load(self, contact_id):
+        """读取某个联系人的索引；索引文件不存在时从聊天记录重建"""
+        contact_id = str(contact_id)
+        entries = self._contacts.get(contact_id)
+        if entries is not None:
+            return entries
+
+        with self._lock:
+            if contact_id in self._contacts:
+                return self._contacts[contact_id]
+            index_file = self._index_file(contact_id)
+            if not os.path.exists(index_file):
+                return self.rebuild(contact_id)
+
+            entries = {}
+            with open(index_file, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        op = json.loads(line)
+                    except ValueError:
+                        continue
+                    path = op.get("path")
+                    if op.get("op") == "add":
+                        entries.pop(path, None)
+                        entries[path] = op
+                    elif op.get("op") == "update" and path in entries:
+                        entries[path].update(op.get("fields", {}))
+                    elif op.get("op") == "tombstone":
+                        entries.pop(path, None)
+            self._contacts[contact_id] = entries
+            return entries
+
+    def rebuild(self, contact_id, store=None):
+        """从聊天记录重新生成某个联系人的索引"""
+        contact_id = str(contact_id)
+        store = store or get_history_store()
+        entries = {}
+        if store.exists(contact_id):
+            for kind in MEDIA_KINDS:
+                for record in store.iter_reverse(contact_id, content_type=kind):
+                    if record.get("local_path"):
+                        entries.setdefault(record["local_path"], _entry_from_record(record))
+        # iter_reverse 是从新到旧，这里按时间正序重排后整体写入
+        ordered = sorted(entries.values(), key=lambda e: e.get("timestamp") or 0)
+
+        with self._lock:
+            os.makedirs(self.index_dir, exist_ok=True)
+            tmp_path = self._index_file(contact_id) + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for entry in ordered:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            os.replace(tmp_path, self._index_file(contact_id))
+            self._contacts[contact_id] = {e["path"]: e for e in ordered}
+            return self._contacts[contact_id]
+
+    def add(self, contact_id, record):
+        """保存图片/文件消息时调用"""
+        if record.get("content_type") not in MEDIA_KINDS or not record.get("local_path"):
+            return
+        contact_id = str(contact_id)
+        entries = self._load(contact_id)
+        entry = _entry_from_record(record)
+        with self._lock:
+            self._write(contact_id, entry)
+            entries.pop(entry["path"], None)
+            entries[entry["path"]] = entry
+            self._stat_cache[entry["path"]] = (time.time(), entry["size"] is not None)
+
+    def update(self, contact_id, path, **fields):
+        """后补字段，例如 OCR 完成后的 preview"""
+        contact_id = str(contact_id)
+        entries = self._load(contact_id)
+        with self._lock:
+            if path not in entries:
+                return
+            if "preview" in fields:
+                fields["preview"] = (fields["preview"] or "")[:getattr(config, "MEDIA_PREVIEW_CHARS", 200)]
+            entries[path].update(fields)
+            self._write(contact_id, {"op": "update", "path": path, "fields": fields})
+
+    def _still_exists(self, contact_id, entry):
+        """带 TTL 缓存的存在性检查；文件消失时写入 tombstone"""
+        path = entry["path"]
+        now = time.time()
+        cached = self._stat_cache.get(path)
+        if cached and now - cached[0] < self.stat_ttl:
+            return cached[1]
+        try:
+            st = os.stat(path)
+            entry["size"], entry["mtime"] = st.st_size, int(st.st_mtime)
+            self._stat_cache[path] = (now, True)
+            return True
+        except OSError:
+            self._stat_cache[path] = (now, False)
+            with self._lock:
+                self._contacts.get(str(contact_id), {}).pop(path, None)
+                self._write(contact_id, {"op": "tombstone", "path": path})
+            print(f"[MediaIndex] 文件已不存在，标记删除: {path}")
+            return False
+
+    def list(self, contact_id, kind, offset=0, limit=0, since=None):
+        """
+        按时间倒序分页返回某类媒体
+        limit <= 0 表示返回 offset 之后的全部
+        返回 {"items": [...], "total": int}；total 为索引中的条数，尚未检查过的失效文件可能仍被计入
+        """
+        entries = self._load(contact_id)
+        with self._lock:
+            candidates = [
+                e for e in reversed(list(entries.values()))
+                if e.get("kind") == kind and (since is None or (e.get("timestamp") or 0) >= since)
+            ]
+
+        items = []
+        skipped = 0
+        for entry in candidates:
+            if limit > 0 and len(items) >= limit:
+                break
+            if not self._still_exists(contact_id, entry):
+                continue
+            if skipped < offset:
+                skipped += 1
+                continue
+            items.append(entry)
+
+        with self._lock:
+            total = sum(1 for e in entries.values()
+                        if e.get("kind") == kind and (since is None or (e.get("timestamp") or 0) >= since))
+        return {"items": items, "total": total}
+
+
+_media_index = MediaIndex()
+
+
+def get_media_index():
+    """进程内共享的媒体索引"""
+    return _media_index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="图片/文件索引工具")
+    parser.add_argument("--rebuild", nargs="?", const="__all__", default=None,
+                        help="从聊天记录重建索引，可指定联系人 ID，不指定则重建全部")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        index = MediaIndex()
+        contacts = get_history_store().list_contacts() if args.rebuild == "__all__" else [args.rebuild]
+        for cid in contacts:
+            entries = index.rebuild(cid)
+            print(f"[MediaIndex] {cid}: {len(entries)} 条")
+    else:
+        parser.print_help()
@@ -1,67 +1,316 @@
 # modules/msg/msg_handler.py
 import os
-import json
 import time
+import threading
 import requests
+from collections import OrderedDict, deque
 from datetime import datetime
 import config
 
 from .doc_processor import extract_text_from_file
-from modules.comic_translator.utils.paddle_ocr import image_to_base64
+from .history_store import get_history_store, parse_time_to_epoch, record_epoch, record_key
+from .contact_manifest import get_contact_manifest
+from .media_index import get_media_index
+from .ingest_worker import get_ingest_pool
+from .context_builder import select_messages, default_line
+from .importance import score_message
+from modules.comic_translator.utils.ocr_cache import get_ocr_cache
 
 os.makedirs(config.HISTORY_JSON_DIR, exist_ok=True)
 
-def _perform_ocr(image_path):
+# 聊天记录存储 (按联系人分段追加写入)
+_history = get_history_store()
+# 联系人清单 (供 /api/msg/list 使用，随保存增量更新)
+_manifest = get_contact_manifest()
+# 图片/文件索引 (供图库和文档列表使用)
+_media = get_media_index()
+# 后台 OCR / 文件提取任务池
+_ingest = get_ingest_pool()
+# 按图片内容寻址的 OCR 结果缓存 (与 /api/image/translate 共用)
+_ocr_cache = get_ocr_cache()
+
+# 后台任务尚未完成时 extracted_content 的占位内容
+PENDING_EXTRACTED_CONTENT = "[处理中]"
+OCR_EMPTY_CONTENT = "[OCR未识别到文字或服务不可用]"
+
+
+def _estimate_record_bytes(record):
+    """粗略估算一条记录在内存中的大小 (字符串按每字符 2 字节计，外加对象开销)"""
+    return 200 + sum(2 * len(str(v)) for v in record.values())
+
+
+class _RecentMessageCache:
+    """
+    进程内最近消息缓存
+    - 每个活跃联系人一个有界环形缓冲区，保存最近 per_contact 条原始记录
+    - 保存新消息时写穿 (write-through) 更新缓冲区
+    - 总内存估算超过 max_bytes 时，按 LRU 淘汰最久未访问的联系人
+    """
+
+    def __init__(self, per_contact, max_bytes):
+        self.per_contact = per_contact
+        self.max_bytes = max_bytes
+        # contact_id -> {"records": deque, "complete": bool, "bytes": int}
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, contact_id):
+        with self._lock:
+            return contact_id in self._entries
+
+    def get(self, contact_id):
+        """
+        返回 (records, complete)：records 为按时间正序的快照列表；
+        complete 表示缓冲区已包含该联系人的全部记录。未缓存时返回 None
+        """
+        with self._lock:
+            entry = self._entries.get(contact_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(contact_id)
+            self.hits += 1
+            return list(entry["records"]), entry["complete"]
+
+    def load(self, contact_id, records):
+        """用存储中的最近记录初始化缓冲区"""
+        buffer = deque(records[-self.per_contact:], maxlen=self.per_contact)
+        entry = {
+            "records": buffer,
+            "complete": len(records) < self.per_contact,
+            "bytes": sum(_estimate_record_bytes(r) for r in buffer),
+        }
+        with self._lock:
+            old = self._entries.pop(contact_id, None)
+            if old:
+                self._total_bytes -= old["bytes"]
+            self._entries[contact_id] = entry
+            self._total_bytes += entry["bytes"]
+            self._evict()
+        return list(buffer), entry["complete"]
+
+    def append(self, contact_id, record):
+        """写穿：只更新已缓存的联系人，返回是否命中"""
+        with self._lock:
+            entry = self._entries.get(contact_id)
+            if entry is None:
+                return False
+            buffer = entry["records"]
+            if len(buffer) == buffer.maxlen:
+                # 环形缓冲区满了，最旧的一条会被挤出，缓冲区不再包含全部历史
+                dropped = _estimate_record_bytes(buffer[0])
+                entry["bytes"] -= dropped
+                self._total_bytes -= dropped
+                entry["complete"] = False
+            buffer.append(record)
+            size = _estimate_record_bytes(record)
+            entry["bytes"] += size
+            self._total_bytes += size
+            self._entries.move_to_end(contact_id)
+            self._evict()
+            return True
+
+    def update(self, contact_id, msg_id, fields):
+        """回填缓冲区中的某条记录 (按 msg_id 查找)"""
+        with self._lock:
+            entry = self._entries.get(contact_id)
+            if entry is None:
+                return
+            for record in reversed(entry["records"]):
+                if str(record.get("msg_id")) == str(msg_id):
+                    record.update(fields)
+                    return
+
+    def _evict(self):
+        # 至少保留最近使用的一个联系人
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            _, entry = self._entries.popitem(last=False)
+            self._total_bytes -= entry["bytes"]
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "contacts": len(self._entries),
+                "approx_bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+_recent_cache = _RecentMessageCache(
+    per_contact=getattr(config, "RECENT_CACHE_PER_CONTACT", 200),
+    max_bytes=getattr(config, "RECENT_CACHE_MAX_BYTES", 64 * 1024 * 1024),
+)
+
+
+_contact_locks = {}
+_contact_locks_guard = threading.Lock()
+
+
+def _contact_lock(contact_id):
+    """
+    同一联系人的存储写入与缓存更新在同一把锁内完成，
+    保证缓存与存储的顺序一致 (加载缓存时不会漏掉并发保存的新消息)
+    """
+    with _contact_locks_guard:
+        lock = _contact_locks.get(contact_id)
+        if lock is None:
+            lock = _contact_locks[contact_id] = threading.Lock()
+        return lock
+
+
+def _cached_recent(contact_id):
+    """从缓存获取最近记录，未命中时从存储加载一次"""
+    with _contact_lock(contact_id):
+        cached = _recent_cache.get(contact_id)
+        if cached is None:
+            cached = _recent_cache.load(contact_id, _history.tail(contact_id, _recent_cache.per_contact))
+        return cached
+
+
+def _iter_recent(contact_id, content_type=None):
+    """
+    从最新到最旧产出记录：先读内存缓冲区，缓冲区不够时才回退到存储继续往前读
+    """
+    records, complete = _cached_recent(contact_id)
+    for record in reversed(records):
+        if content_type and record.get("content_type", "text") != content_type:
+            continue
+        yield record
+    if complete or not records:
+        return
+    # 从缓冲区中最旧的一条之前继续读取：跳过缓冲区里已经给出的记录和快照之后新保存的记录
+    # (按记录标识和时间判断，不按位置，读取期间有新消息保存也不会重复或遗漏)
+    cached_keys = {record_key(record) for record in records}
+    oldest_epoch = record_epoch(records[0])
+    # 按类型读取时交给存储过滤 (SQLite 后端走 content_type 索引)
+    for record in _history.iter_reverse(contact_id, content_type=content_type):
+        if record_key(record) in cached_keys or record_epoch(record) > oldest_epoch:
+            continue
+        yield record
+
+
+def get_recent_cache_stats():
+    """最近消息缓存的命中统计"""
+    return _recent_cache.stats()
+
+def _call_ocr_service(b64):
+    """请求 OCR API，返回原始识别结果，服务不可用时抛出异常"""
+    payload = {"file": b64, "fileType": 1, "visualize": False}
+    resp = requests.post(config.OCR_URL, json=payload, timeout=5)
+
+    if resp.status_code != 200:
+        raise RuntimeError(f"OCR 请求失败，HTTP 状态码: {resp.status_code}")
+    res = resp.json()
+    if res.get("errorCode", 1) != 0:
+        raise RuntimeError(f"OCR 服务错误: {res.get('errorMsg')}")
+    return res.get("result", {})
+
+def _request_ocr(image_path):
     """
-    调用本地 PaddleOCR 服务提取文字
+    调用本地 PaddleOCR 服务提取文字，服务不可用时抛出异常（后台任务据此重试）
+    相同内容的图片直接复用 OCR 缓存中的结果
     """
     if not os.path.exists(image_path):
         return ""
-    
-    try:
-        # 1. 转 Base64
-        b64 = image_to_base64(image_path)
-        
-        # 2. 请求 OCR API
-        payload = {"file": b64, "fileType": 1, "visualize": False}
-        resp = requests.post(config.OCR_URL, json=payload, timeout=5)
-        
-        if resp.status_code == 200:
-            res = resp.json()
-            if res.get("errorCode", 1) == 0:
-                # 3. 修正：从正确的字段提取文字
-                texts = []
-                for page in res.get("result", {}).get("ocrResults", []):
-                    pruned_result = page.get("prunedResult", {})
-                    
-                    # 方法1：从rec_texts字段提取
-                    rec_texts = pruned_result.get("rec_texts", [])
-                    if isinstance(rec_texts, list):
-                        texts.extend([text for text in rec_texts if text])
-                    elif isinstance(rec_texts, str) and rec_texts.strip():
-                        # 如果rec_texts是字符串，尝试解析
-                        try:
-                            import ast
-                            parsed_texts = ast.literal_eval(rec_texts)
-                            if isinstance(parsed_texts, list):
-                                texts.extend([text for text in parsed_texts if text])
-                        except:
-                            # 如果解析失败，直接使用
-                            texts.append(rec_texts.strip())
-                    
-                    # 方法2：同时检查res字段（如果有的话）
-                    for item in pruned_result.get("res", []):
-                        text = item.get("text", "")
-                        if text:
-                            texts.append(text)
-                
-                result = " ".join(texts) if texts else ""
-                print(f"[OCR] 提取到文字: {result}")
-                return result
-    except Exception as e:
-        print(f"[MsgHandler] OCR 失败: {e}")
-    
-    return ""
+
+    # 1. 查缓存，未命中时转 Base64 请求 OCR API
+    ocr_result = _ocr_cache.ocr_file(image_path, _call_ocr_service)
+
+    # 2. 修正：从正确的字段提取文字
+    texts = []
+    for page in ocr_result.get("ocrResults", []):
+        pruned_result = page.get("prunedResult", {})
+
+        # 方法1：从rec_texts字段提取
+        rec_texts = pruned_result.get("rec_texts", [])
+        if isinstance(rec_texts, list):
+            texts.extend([text for text in rec_texts if text])
+        elif isinstance(rec_texts, str) and rec_texts.strip():
+            # 如果rec_texts是字符串，尝试解析
+            try:
+                import ast
+                parsed_texts = ast.literal_eval(rec_texts)
+                if isinstance(parsed_texts, list):
+                    texts.extend([text for text in parsed_texts if text])
+            except:
+                # 如果解析失败，直接使用
+                texts.append(rec_texts.strip())
+
+        # 方法2：同时检查res字段（如果有的话）
+        for item in pruned_result.get("res", []):
+            text = item.get("text", "")
+            if text:
+                texts.append(text)
+
+    result = " ".join(texts) if texts else ""
+    print(f"[OCR] 提取到文字: {result}")
+    return result
+
+def update_message(contact_id: str, msg_id: str, fields: dict):
+    """
+    回填一条已保存的记录（存储 + 最近消息缓存）
+    """
+    with _contact_lock(contact_id):
+        _history.update(contact_id, msg_id, fields)
+        _recent_cache.update(contact_id, msg_id, fields)
+
+def _ocr_task(task):
+    """后台任务：图片 OCR 并回填 extracted_content"""
+    payload = task["payload"]
+    print(f"[MsgHandler] 正在对图片进行 OCR: {payload['path']}...")
+    ocr_text = _request_ocr(payload["path"])
+    if ocr_text:
+        print(f"[MsgHandler] OCR 成功，提取字符数: {len(ocr_text)}")
+    extracted_content = ocr_text or OCR_EMPTY_CONTENT
+    # OCR 文字可能包含日期、金额等信号，回填时重新评分
+    importance = score_message({"content_type": "image", "text": "[图片]", "extracted_content": extracted_content})
+    update_message(payload["contact_id"], payload["msg_id"],
+                   {"extracted_content": extracted_content, "importance": importance})
+    _media.update(payload["contact_id"], payload["path"], preview=extracted_content)
+
+def _ocr_give_up(task, error):
+    payload = task["payload"]
+    update_message(payload["contact_id"], payload["msg_id"], {"extracted_content": OCR_EMPTY_CONTENT})
+    _media.update(payload["contact_id"], payload["path"], preview=OCR_EMPTY_CONTENT)
+
+def _extract_task(task):
+    """后台任务：读取文件内容并回填 extracted_content"""
+    payload = task["payload"]
+    print(f"[MsgHandler] 正在读取文件内容: {payload['path']}...")
+    # 限制读取前 1000 字符，避免存太大的记录
+    file_text = extract_text_from_file(payload["path"], max_chars=1000)
+    print(f"[MsgHandler] 文件读取完成")
+    importance = score_message({
+        "content_type": "file",
+        "text": f"[文件: {os.path.basename(payload['path'])}]",
+        "local_path": payload["path"],
+        "extracted_content": file_text,
+    })
+    update_message(payload["contact_id"], payload["msg_id"], {"extracted_content": file_text, "importance": importance})
+    _media.update(payload["contact_id"], payload["path"], preview=file_text)
+
+def _extract_give_up(task, error):
+    payload = task["payload"]
+    content = f"[读取文件出错: {error}]"
+    update_message(payload["contact_id"], payload["msg_id"], {"extracted_content": content})
+
+_ingest.register("ocr", _ocr_task, on_give_up=_ocr_give_up)
+_ingest.register("extract", _extract_task, on_give_up=_extract_give_up)
+
+def start_ingest_workers():
+    """启动后台任务池（服务启动时调用，会重新执行上次未完成的任务）"""
+    _ingest.start()
+
+def get_ingest_stats():
+    """后台任务池的队列深度、耗时和失败统计"""
+    return _ingest.stats()
 
 def save_incoming_message(data: dict):
     """
@@ -106,33 +355,30 @@ def save_incoming_message(data: dict):
     local_path = ""
     extracted_content = ""
     
+    ingest_kind = None
+
     # 图片处理
     if "image_path" in data:
         content_type = "image"
-        local_path = data.get("image_path")
+        local_path = data.get("image_path") or ""
         save_text = "[图片]"
-        
-        # 立即执行 OCR
-        print(f"[MsgHandler] 正在对图片进行 OCR: {local_path}...")
-        ocr_text = _perform_ocr(local_path)
-        if ocr_text:
-            extracted_content = ocr_text
-            print(f"[MsgHandler] OCR 成功，提取字符数: {len(ocr_text)}")
-        else:
-            extracted_content = "[OCR未识别到文字或服务不可用]"
-    
+        # OCR 交给后台任务，先记为处理中
+        extracted_content = PENDING_EXTRACTED_CONTENT if local_path else OCR_EMPTY_CONTENT
+        ingest_kind = "ocr" if local_path else None
+
     # 文件处理
     elif "file_path" in data:
         content_type = "file"
-        local_path = data.get("file_path")
+        local_path = data.get("file_path") or ""
         file_name = os.path.basename(local_path)
         save_text = f"[文件: {file_name}]"
-        # 立即读取文件
-        print(f"[MsgHandler] 正在读取文件内容: {local_path}...")
-        # 限制读取前 1000 字符，避免存太大的 JSON
-        file_text = extract_text_from_file(local_path, max_chars=1000) 
-        extracted_content = file_text
-        print(f"[MsgHandler] 文件读取完成")
+        # 文件内容提取交给后台任务，先记为处理中
+        extracted_content = PENDING_EXTRACTED_CONTENT if local_path else "[文件不存在]"
+        ingest_kind = "extract" if local_path else None
+
+    # 同一条消息里的多张图片共用 message_id，用文件名区分，便于后台任务回填
+    if local_path:
+        msg_id = f"{msg_id}:{os.path.basename(local_path)}"
 
     # 5. 构造统一的记录结构
     new_record = {
@@ -144,8 +390,12 @@ def save_incoming_message(data: dict):
         "content_type": content_type,
         "local_path": local_path,
         "extracted_content": extracted_content, # 【新字段】存 OCR 或文件内容
-        "msgtype": msg_type
+        "msgtype": msg_type,
+        "timestamp": timestamp,     # 时间戳，用于按时间范围查询
+        "msg_id": msg_id
     }
+    # 本地预评分，提醒时只把高分消息及其上下文交给 AI (见 importance.py)
+    new_record["importance"] = score_message(new_record)
 
     # 6. 【分流保存逻辑】
     # 策略：如果是纯文本，存入 history_json (用于 AI RAG/总结)
@@ -154,292 +404,214 @@ def save_incoming_message(data: dict):
     
     # 这里采用“全部存入但标记类型”的策略，并在 get_recent_messages 时过滤
     
-    target_file = os.path.join(config.HISTORY_JSON_DIR, f"{contact_id}.json")
-    
-    _append_to_json(target_file, new_record)
-
-    return {"status": "saved", "type": content_type, "file": target_file}
-
-def _append_to_json(file_path, record):
-    """辅助函数：追加写入 JSON"""
-    current_history = []
-    if os.path.exists(file_path):
-        try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                current_history = json.load(f)
-        except Exception:
-            current_history = []
-    
-    current_history.append(record)
-    
-    # 保持最近 2000 条，防止文件过大
-    if len(current_history) > 2000:
-        current_history = current_history[-2000:]
+    with _contact_lock(contact_id):
+        _history.append(contact_id, new_record)
+
+        # 写穿缓存；该联系人尚未缓存时加载一次最近记录（已包含刚写入的这条）
+        if not _recent_cache.append(contact_id, new_record):
+            _recent_cache.load(contact_id, _history.tail(contact_id, _recent_cache.per_contact))
+    _manifest.update(contact_id, new_record)
+    if content_type in ("image", "file"):
+        _media.add(contact_id, new_record)
+
+    # 7. 记录已落盘，OCR / 文件提取在后台完成后回填
+    if ingest_kind:
+        _ingest.submit(ingest_kind, {"contact_id": contact_id, "msg_id": msg_id, "path": local_path})
 
-    with open(file_path, "w", encoding="utf-8") as f:
-        json.dump(current_history, f, ensure_ascii=False, indent=2)
+    return {"status": "saved", "type": content_type, "file": _history.location(contact_id)}
+
+def _resolve_contact_id(contact_id: str):
+    """
+    确认联系人存在记录；不存在时尝试模糊匹配 (防止 contact_id 与记录名有差异)
+    返回匹配到的 contact_id，找不到则返回 None
+    """
+    if contact_id in _recent_cache or _history.exists(contact_id):
+        return contact_id
+    for candidate in _history.list_contacts():
+        if contact_id in candidate:
+            return candidate
+    return None
 
 # modules/msg/msg_handler.py
 
-def get_recent_messages(contact_id: str, limit: int = 50, include_media: bool = True):
+def _take_until(records, stop_at):
+    for record in records:
+        if stop_at(record):
+            return
+        yield record
+
+def _note_newest(records, report):
+    for record in records:
+        report.setdefault("newest", record)
+        yield record
+
+def get_recent_context(contact_id: str, limit: int = 50, include_media: bool = True, purpose: str = None,
+                       stop_at=None, report=None):
     """
-    读取指定对象的最近 N 条消息
-    contact_id: 对应文件名（通常是QQ号）
-    include_media: 是否包含图片/文件记录（及其OCR内容）
+    读取指定对象的最近 N 条消息，返回按时间正序排列的 [(record, 上下文中的内容), ...]
+    参数含义同 get_recent_messages；找不到记录或读取失败时返回空列表
+    stop_at(record): 从新往旧读到该函数返回 True 的记录时停止 (不含该记录)，用于只取某个位置之后的新消息
+    report: 传入字典时写入本次实际读到的最新一条原始记录 ("newest"，包括被过滤掉的表情、刷屏)，用于记录水位
     """
-    # 1. 尝试直接拼接路径 (最快)
-    file_path = os.path.join(config.HISTORY_JSON_DIR, f"{contact_id}.json")
-    
-    # 2. 如果文件不存在，尝试模糊匹配 (防止 contact_id 传进来不带后缀，或者文件名有差异)
-    if not os.path.exists(file_path):
-        found = False
-        if os.path.exists(config.HISTORY_JSON_DIR):
-            all_files = os.listdir(config.HISTORY_JSON_DIR)
-            for f in all_files:
-                # 假设 contact_id 是 "123456"，文件名是 "123456.json"
-                if f == f"{contact_id}.json" or (contact_id in f and f.endswith(".json")):
-                    file_path = os.path.join(config.HISTORY_JSON_DIR, f)
-                    found = True
-                    break
-        
-        if not found:
-            print(f"[MsgHandler] 未找到联系人 {contact_id} 的聊天记录")
-            return ""
+    # 1. 确认记录存在，不存在时尝试模糊匹配
+    resolved_id = _resolve_contact_id(contact_id)
+    if resolved_id is None:
+        print(f"[MsgHandler] 未找到联系人 {contact_id} 的聊天记录")
+        return []
 
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        # 2. 倒序遍历：从最新消息开始往回找，凑够 limit 条或用完 token 预算就停止
+        # 优先读内存缓存，缓存不够时才读磁盘；如果不包含媒体，只取文本类型的记录
+        content_type = None if include_media else "text"
+        records = _iter_recent(resolved_id, content_type=content_type)
+        if stop_at is not None:
+            records = _take_until(records, stop_at)
+        if report is not None:
+            records = _note_newest(records, report)
+        kept, _ = select_messages(records, purpose=purpose, include_media=include_media, limit=limit)
+        return kept
     except Exception as e:
         print(f"[MsgHandler] 读取记录失败: {e}")
-        return ""
+        return []
 
-    collected_messages = []
-    count = 0
-
-    # 倒序遍历：从最新消息开始往回找
-    for item in reversed(data):
-        if count >= limit:
-            break
-            
-        c_type = item.get("content_type", "text")
-        
-        # 如果不包含媒体，且当前消息不是文本，则跳过
-        if not include_media and c_type != "text":
-            continue
-        
-        # 获取基础文本 (例如 "你好" 或 "[图片]" 或 "[文件: xxx.pdf]")
-        msg_content = item.get("text", "")
-
-        # 如果是媒体类型，且我们需要包含它，尝试追加 extracted_content
-        if include_media and (c_type == "image" or c_type == "file"):
-            extra = item.get("extracted_content", "")
-            
-            # 过滤无效的 OCR 结果，避免干扰 AI
-            invalid_keywords = ["[OCR未识别", "[读取文件出错", "[不支持", "[文件不存在"]
-            is_valid_extra = extra and not any(k in extra for k in invalid_keywords)
-            
-            if is_valid_extra:
-                # 拼接格式： [图片] (内容详情: 图片里的文字...)
-                msg_content += f" (内容详情: {extra})"
-            
-        # 格式化消息行
-        # 结果示例: "[2023-10-27 10:00:00] 懒猫: [图片] (内容详情: 账单金额50元)"
-        line = f"[{item['time']}] {item['name']}: {msg_content}"
-        collected_messages.append(line)
-        count += 1
-
-    # 因为是倒序找的，最后要反转回来，变成正常的时间顺序 (旧 -> 新)
-    return "\n".join(reversed(collected_messages))
+def get_recent_messages(contact_id: str, limit: int = 50, include_media: bool = True, purpose: str = None):
+    """
+    读取指定对象的最近 N 条消息
+    contact_id: 对应文件名（通常是QQ号）
+    include_media: 是否包含图片/文件记录（及其OCR内容）
+    purpose: 上下文用途 (summarize / auto_reply 等)，指定后按 config.CONTEXT_TOKEN_BUDGETS
+             中的预算裁剪 (丢弃表情和刷屏、截断过长内容)，不指定则原样返回 limit 条
+    """
+    kept = get_recent_context(contact_id, limit, include_media, purpose)
+    # 结果示例: "[2023-10-27 10:00:00] 懒猫: [图片] (内容详情: 账单金额50元)"
+    return "\n".join(default_line(item, content) for item, content in kept)
 
 def get_contact_list():
     """
-    遍历 history 目录，返回所有聊天列表。
-    文件名即为 contact_id (群号或好友QQ)。
-    内容根据最后一条消息判断类型和时间。
+    返回所有聊天列表（来自联系人清单，不再逐个打开聊天记录文件）
+    每项包含 id、类型、名称、消息条数、最后活跃时间和最后一条消息的预览，
+    按最后活跃时间倒序排列。
     """
-    if not os.path.exists(config.HISTORY_JSON_DIR):
-        return []
+    return _manifest.list()
 
-    contacts = []
-    files = os.listdir(config.HISTORY_JSON_DIR)
-    
-    for f in files:
-        if not f.endswith(".json"):
-            continue
-            
-        file_path = os.path.join(config.HISTORY_JSON_DIR, f)
-        # 1. 获取 ID：文件名即 ID (如 "8937283.json" -> "8937283")
-        contact_id = os.path.splitext(f)[0]
-        
-        try:
-            # 读取文件内容
-            with open(file_path, "r", encoding="utf-8") as json_file:
-                data = json.load(json_file)
-                
-            if not data:
-                continue
-            
-            # 2. 获取元数据：基于最后一条消息
-            last_msg = data[-1]
-            msg_count = len(data)
-            
-            # 根据你提供的数据结构提取字段
-            msg_type = last_msg.get("msgtype", "unknown")  # group / private
-            last_time = last_msg.get("time", "")
-            user_name = last_msg.get("name","unknown")
-            group_name = last_msg.get("group_name","unkown")
-            
-            # 3. 构建返回对象
-            if msg_type == "group":
-                contacts.append({
-                    "id": contact_id,       # 这是群号或好友QQ号 (用于传回给后端进行总结)
-                    "group_name": group_name,
-                    "type": msg_type,       # "group" 或 "private" (前端可用来画图标)
-                    "count": msg_count,     # 消息条数
-                    "last_active": last_time, # 最后活跃时间
-                    "preview": last_msg.get("text", "")[:20] # 预览最后一条消息
-                })
-            else:
-                contacts.append({
-                    "id": contact_id,       # 这是群号或好友QQ号 (用于传回给后端进行总结)
-                    "user_name": user_name,
-                    "type": msg_type,       # "group" 或 "private" (前端可用来画图标)
-                    "count": msg_count,     # 消息条数
-                    "last_active": last_time, # 最后活跃时间
-                    "preview": last_msg.get("text", "")[:20] # 预览最后一条消息
-                })
-            
-        except Exception as e:
-            print(f"[MsgHandler] 读取列表文件 {f} 失败: {e}")
-            continue
-
-    # 4. 排序：按最后活跃时间倒序排列 (最新的在最前)
-    # 注意：你的时间格式是 "2025-12-19 20:12:16"，可以直接字符串排序
-    contacts.sort(key=lambda x: x["last_active"], reverse=True)
+def flush_contact_manifest():
+    """把联系人清单立即写盘（服务关闭时调用）"""
+    _manifest.flush(force=True)
 
-    return contacts
-
-def get_raw_recent_messages(contact_id: str, limit: int = 100):
+def get_raw_recent_messages(contact_id: str, limit: int = 100, stop_at=None):
     """
     【新函数】获取原始的消息记录列表（字典格式），用于程序处理而非直接显示。
+    stop_at(record): 同 get_recent_context，只取该位置之后的新消息
     """
-    # 1. 尝试直接拼接路径
-    file_path = os.path.join(config.HISTORY_JSON_DIR, f"{contact_id}.json")
-    
-    # 2. 只有当文件存在时才读取
-    if not os.path.exists(file_path):
+    # 只有当记录存在时才读取
+    if contact_id not in _recent_cache and not _history.exists(contact_id):
         return []
 
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            
-        # 截取最近的 limit 条 (注意 data 是按时间正序存的，我们要最后 limit 条)
-        recent_data = data[-limit:] if limit > 0 else data
-        return recent_data
-        
+        # 截取最近的 limit 条 (按时间正序返回；limit <= 0 表示全部)
+        if limit <= 0 and stop_at is None:
+            return _history.read_all(contact_id)
+        recent = []
+        records = _iter_recent(contact_id)
+        if stop_at is not None:
+            records = _take_until(records, stop_at)
+        for record in records:
+            recent.append(record)
+            if 0 < limit <= len(recent):
+                break
+        recent.reverse()
+        return recent
+
     except Exception as e:
         print(f"[MsgHandler] 读取原始记录失败: {e}")
         return []
-    
+
+def get_full_history(contact_id: str):
+    """
+    获取指定联系人的全部聊天记录（按时间正序），用于前端本地搜索
+    """
+    if not _history.exists(contact_id):
+        return []
+    return _history.read_all(contact_id)
+
 def get_recent_files(contact_id: str, limit: int = 5):
     """
-    【新函数】从聊天记录中查找最近发送的 n 个文件
+    【新函数】从媒体索引中查找最近发送的 n 个文件
     返回格式: [{"name": "test.docx", "path": "/abs/path/...", "time": "..."}]
     """
-    # 复用之前的逻辑获取原始消息列表
-    # 注意：这里我们取 limit*5 是为了防止最近几条全是文本，导致找不到文件，
-    # 所以多取一点历史记录，然后再在内存里过滤
-    raw_msgs = get_raw_recent_messages(contact_id, limit=limit * 10) 
-    
+    page = _media.list(contact_id, "file", offset=0, limit=limit)
+
     file_list = []
-    # 倒序遍历（从最新到最旧）
-    for msg in reversed(raw_msgs):
-        if len(file_list) >= limit:
-            break
-            
-        # 筛选 content_type 为 file 的消息
-        if msg.get("content_type") == "file" and msg.get("local_path"):
-            # 确保文件实际存在
-            if os.path.exists(msg.get("local_path")):
-                file_list.append({
-                    "name": os.path.basename(msg.get("local_path")),
-                    "path": msg.get("local_path"),
-                    "time": msg.get("time"),
-                    # 如果之前存过文件提取内容，也可以带上，省去重复读取
-                    "extracted_content": msg.get("extracted_content", "") 
-                })
-    
+    for entry in page["items"]:
+        file_list.append({
+            "name": os.path.basename(entry["path"]),
+            "path": entry["path"],
+            "time": entry.get("time"),
+            # 索引里存有文件内容的预览，可以省去重复读取
+            "extracted_content": entry.get("preview", "")
+        })
+
     return file_list
 
-def get_all_files(contact_id: str):
+def get_all_files(contact_id: str, since: str = None, offset: int = 0, limit: int = 0):
     """
     【新函数】获取指定联系人/群聊历史记录中的所有文件列表
     用于前端展示文件列表供用户选择翻译
+    since: 可选，只返回该时间之后的文件，如 "2025-12-01"
+    offset / limit: 分页参数，limit <= 0 表示不分页
     """
-    file_path = os.path.join(config.HISTORY_JSON_DIR, f"{contact_id}.json")
-    
-    if not os.path.exists(file_path):
-        return []
-
     file_list = []
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            
-        # 遍历所有记录 (倒序，让最新的文件排在前面)
-        for msg in reversed(data):
-            if msg.get("content_type") == "file":
-                local_path = msg.get("local_path", "")
-                
-                # 仅返回依然存在于磁盘上的文件
-                if local_path and os.path.exists(local_path):
-                    file_list.append({
-                        "file_name": os.path.basename(local_path),
-                        "file_path": local_path,  # 这是传给翻译接口的关键参数
-                        "sender": msg.get("name", "Unknown"),
-                        "time": msg.get("time"),
-                        "size": os.path.getsize(local_path) # 可选：返回文件大小
-                    })
-                    
+        # 从媒体索引读取 (最新的文件排在前面)，只检查当前页的文件是否还在磁盘上
+        page = _media.list(contact_id, "file", offset=offset, limit=limit, since=parse_time_to_epoch(since))
+        for entry in page["items"]:
+            file_list.append({
+                "file_name": os.path.basename(entry["path"]),
+                "file_path": entry["path"],  # 这是传给翻译接口的关键参数
+                "sender": entry.get("sender", "Unknown"),
+                "time": entry.get("time"),
+                "size": entry.get("size") # 可选：返回文件大小
+            })
+
     except Exception as e:
         print(f"[MsgHandler] 获取文件列表失败: {e}")
-    
+
     return file_list
 
 
-def get_all_images(contact_id: str):
+def get_all_images(contact_id: str, since: str = None, offset: int = 0, limit: int = 0):
     """
     【新函数】获取指定联系人/群聊历史记录中的所有图片列表
     用于前端展示图片列表供用户选择翻译
+    since: 可选，只返回该时间之后的图片，如 "2025-12-01"
+    offset / limit: 分页参数，limit <= 0 表示不分页
     """
-    file_path = os.path.join(config.HISTORY_JSON_DIR, f"{contact_id}.json")
-    
-    if not os.path.exists(file_path):
-        return []
-
     image_list = []
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            
-        # 倒序遍历，让最新的图片排在前面
-        for msg in reversed(data):
-            if msg.get("content_type") == "image":
-                local_path = msg.get("local_path", "")
-                
-                # 仅返回依然存在于磁盘上的图片
-                if local_path and os.path.exists(local_path):
-                    image_list.append({
-                        "file_name": os.path.basename(local_path),
-                        "file_path": local_path,  # 这是传给翻译接口的关键参数
-                        "sender": msg.get("name", "Unknown"),
-                        "time": msg.get("time"),
-                        # 可以选择性地返回已有的 OCR 内容作为预览
-                        "ocr_preview": msg.get("extracted_content", "")[:50] 
-                    })
-                    
+        # 从媒体索引读取 (最新的图片排在前面)，只检查当前页的图片是否还在磁盘上
+        page = _media.list(contact_id, "image", offset=offset, limit=limit, since=parse_time_to_epoch(since))
+        for entry in page["items"]:
+            image_list.append({
+                "file_name": os.path.basename(entry["path"]),
+                "file_path": entry["path"],  # 这是传给翻译接口的关键参数
+                "sender": entry.get("sender", "Unknown"),
+                "time": entry.get("time"),
+                # 可以选择性地返回已有的 OCR 内容作为预览
+                "ocr_preview": entry.get("preview", "")[:50]
+            })
+
     except Exception as e:
         print(f"[MsgHandler] 获取图片列表失败: {e}")
-    
-    return image_list
\ No newline at end of file
+
+    return image_list
+
+
+def count_media(contact_id: str, kind: str, since: str = None):
+    """
+    统计某类媒体 ("file" / "image") 在索引中的条数，用于分页
+    """
+    try:
+        return _media.list(contact_id, kind, limit=1, since=parse_time_to_epoch(since))["total"]
+    except Exception as e:
+        print(f"[MsgHandler] 统计媒体数量失败: {e}")
+        return 0
@@ -1,45 +1,197 @@
 # modules/msg/notifier.py
+"""
+重要消息提醒
+
+每个联系人保存已经分析过的位置 (水位) 和累计的重要消息列表 (NOTIFY_STORE_DIR 下每个联系人一个 JSON 文件)，
+再次请求时只把水位之后的新消息交给大模型，结果合并进已保存的列表；rescan=True 时重新分析最近 limit 条并替换列表。
+新消息先按入库时的重要度预评分 (importance.py) 筛选，只有高分消息和它们的上下文会发给大模型。
+"""
+import os
 import json
+import time
 import logging
+import threading
 import config
 from modules.msg.translator import BailianTranslator
-from modules.msg.msg_handler import get_raw_recent_messages
+from modules.msg.msg_handler import get_raw_recent_messages, PENDING_EXTRACTED_CONTENT
+from modules.msg.context_builder import select_messages
+from modules.msg.history_store import record_watermark, watermark_reached, record_epoch
+from modules.msg.importance import select_candidates
+
+STORE_DIR = getattr(config, "NOTIFY_STORE_DIR", os.path.join(config.DATA_DIR, "important_messages"))
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def _contact_lock(contact_id):
+    """同一联系人的分析串行执行，避免并发请求重复分析同一批新消息"""
+    with _locks_guard:
+        lock = _locks.get(contact_id)
+        if lock is None:
+            lock = _locks[contact_id] = threading.Lock()
+        return lock
+
+
+def _store_path(contact_id):
+    return os.path.join(STORE_DIR, f"{contact_id}.json")
+
+
+def load_important_messages(contact_id: str):
+    """读取已保存的 {"watermark", "important", "updated_at"}，没有时返回 None"""
+    path = _store_path(contact_id)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"[Notifier] 读取 {contact_id} 的重要消息记录失败: {e}")
+        return None
 
-def extract_important_messages(contact_id: str, limit: int = 100):
+
+def _save_important_messages(contact_id, entry):
+    path = _store_path(contact_id)
+    try:
+        os.makedirs(STORE_DIR, exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        print(f"[Notifier] 保存 {contact_id} 的重要消息记录失败: {e}")
+
+
+def _merge_important(existing, new_items):
+    """按 (时间, 发送者, 内容) 去重后追加，只保留最近 NOTIFY_MAX_IMPORTANT 条"""
+    merged = list(existing)
+    seen = {(m.get("time"), m.get("sender"), m.get("content")) for m in merged}
+    for item in new_items:
+        key = (item.get("time"), item.get("sender"), item.get("content"))
+        if key not in seen:
+            seen.add(key)
+            merged.append(item)
+    return merged[-getattr(config, "NOTIFY_MAX_IMPORTANT", 200):]
+
+
+def _ready_prefix(raw_msgs):
+    """
+    截到第一条仍在等待后台 OCR/文件提取的记录之前：这些记录的内容回填后才能判断，
+    水位不能越过它们。等待超过 NOTIFY_PENDING_MAX_AGE 秒的记录视为提取已失败，不再等待
+    """
+    max_age = getattr(config, "NOTIFY_PENDING_MAX_AGE", 600)
+    now = time.time()
+    for index, record in enumerate(raw_msgs):
+        if record.get("extracted_content") == PENDING_EXTRACTED_CONTENT and now - record_epoch(record) < max_age:
+            return raw_msgs[:index]
+    return raw_msgs
+
+
+def extract_important_messages(contact_id: str, limit: int = 100, fresh: bool = False, rescan: bool = False):
     """
     获取指定 ID 的最近消息，并使用 AI 筛选出重要消息。
-    返回结构化的重要消息列表。
+    返回结构化的重要消息列表 (data 为累计的全部重要消息，new 为本次新发现的)。
+    首次分析或 rescan 为 True 时分析最近 limit 条 (rescan 会替换已保存的列表)；
+    之后只分析上次水位之后的全部新消息，超出 notify 预算时分批交给 AI，水位只在全部分析完后推进
+    fresh: 为 True 时跳过大模型响应缓存，重新分析
     """
-    # 1. 获取原始数据
-    raw_msgs = get_raw_recent_messages(contact_id, limit)
-    if not raw_msgs:
-        return {"success": False, "msg": "未找到聊天记录", "data": []}
+    with _contact_lock(contact_id):
+        entry = None if rescan else load_important_messages(contact_id)
+        stop_at = watermark_reached(entry["watermark"]) if entry else None
+
+        # 1. 获取原始数据 (水位之后的新消息不受 limit 限制，否则超出的部分会被水位跳过)
+        raw_msgs = get_raw_recent_messages(contact_id, 0 if entry else limit, stop_at=stop_at)
+        if not raw_msgs:
+            if entry is not None:
+                return {"success": True, "data": entry["important"], "new": [], "total_scanned": 0, "incremental": True}
+            return {"success": False, "msg": "未找到聊天记录", "data": []}
+
+        ready = _ready_prefix(raw_msgs)
+        if len(ready) < len(raw_msgs):
+            print(f"[Notifier] {contact_id}: {len(raw_msgs) - len(ready)} 条新消息含未完成的 OCR/文件提取，留到下次分析")
+        raw_msgs = ready
+        if not raw_msgs:
+            important = entry["important"] if entry else []
+            return {"success": True, "data": important, "new": [], "total_scanned": 0, "incremental": entry is not None}
+
+        result = _classify(raw_msgs, fresh)
+        if not result["success"]:
+            # 分析失败时不推进水位，下次重新分析这批消息
+            return result
+
+        merged = _merge_important(entry["important"] if entry else [], result["data"])
+        _save_important_messages(contact_id, {
+            "watermark": record_watermark(raw_msgs[-1]),
+            "important": merged,
+            "updated_at": time.time(),
+        })
+        print(f"[Notifier] {contact_id}: 分析新消息 {len(raw_msgs)} 条，新增重要消息 {len(result['data'])} 条")
+        return {
+            "success": True,
+            "data": merged,
+            "new": result["data"],
+            "total_scanned": len(raw_msgs),
+            "incremental": entry is not None,
+        }
 
+
+def _classify(raw_msgs, fresh=False):
+    """让 AI 从 raw_msgs 中筛选重要消息，返回 {"success", "data", ...}"""
     # 2. 数据预处理：精简发送给 AI 的数据量，节省 Token 并提高准确率
-    # 我们只保留 AI 判断所需的字段
-    messages_for_ai = []
-    for msg in raw_msgs:
-        base_text = msg.get("text", "") # 例如 "[图片]" 或 "[文件: xxx.docx]"
-        extra_content = msg.get("extracted_content", "") # 这里已经是 OCR 或文件读取的结果了
-        
-        # 组装发给 AI 的内容
-        # 如果有提取的内容（OCR文字/文件摘要），拼接到后面
-        if extra_content and len(extra_content) > 1:
-            # 限制长度，防止长篇小说把 Token 撑爆 (例如限制前 300 字符)
-            final_content = f"{base_text} \n(内容详情: {extra_content[:300]}...)"
-        else:
-            final_content = base_text
-
-        messages_for_ai.append({
+    # 我们只保留 AI 判断所需的字段；按 notify 的 token 预算从最新消息往回取，
+    # 丢弃表情包和刷屏，OCR/文件内容截断到 CONTEXT_EXTRA_CHARS
+    def to_ai_item(msg, content):
+        return {
             "id": msg.get("time"),   # 用时间字符串作为临时 ID
             "sender": msg.get("name", "Unknown"),
-            "content": final_content
-        })
+            "content": content
+        }
+
+    # 只把本地预评分达到阈值的消息及其前后几条交给 AI，闲聊在这里就被过滤掉
+    candidates = raw_msgs
+    if getattr(config, "NOTIFY_PREFILTER_ENABLED", True):
+        candidates, _ = select_candidates(raw_msgs)
+        if not candidates:
+            return {"success": True, "data": [], "total_scanned": len(raw_msgs)}
+
+    # 一次放不进预算时分批：每批取剩余消息中最新的一段，直到全部消息都交给过 AI
+    batches = []
+    remaining = candidates
+    while remaining:
+        kept, report = select_messages(
+            reversed(remaining), purpose="notify",
+            line_format=lambda msg, content: json.dumps(to_ai_item(msg, content), ensure_ascii=False),
+        )
+        if kept:
+            batches.append([to_ai_item(msg, content) for msg, content in kept])
+        if not kept or not report["budget_exhausted"]:
+            break
+        oldest = kept[0][0]
+        remaining = remaining[:next(i for i, msg in enumerate(remaining) if msg is oldest)]
 
-    # 3. 如果没有消息，直接返回
-    if not messages_for_ai:
-        return {"success": True, "data": []}
+    # 3. 如果没有消息 (全是表情、刷屏)，直接返回
+    if not batches:
+        return {"success": True, "data": [], "total_scanned": len(raw_msgs)}
 
+    # 按时间正序逐批分析；任一批失败则整体失败 (不推进水位，已成功的批次下次会命中响应缓存)
+    important_list = []
+    for messages_for_ai in reversed(batches):
+        result = _ask_ai(messages_for_ai, fresh)
+        if not result["success"]:
+            return result
+        important_list.extend(result["data"])
+    if len(batches) > 1:
+        print(f"[Notifier] 新消息超出单次预算，分 {len(batches)} 批分析")
+
+    return {
+        "success": True,
+        "data": important_list,
+        "total_scanned": len(raw_msgs)
+    }
+
+
+def _ask_ai(messages_for_ai, fresh=False):
+    """把一批消息交给 AI 判断，返回 {"success", "data"} 或错误信息"""
     # 3. 构建 Prompt
     # 这里的关键是要求 AI 返回纯 JSON 格式
     prompt = (
@@ -66,23 +218,22 @@ def extract_important_messages(contact_id: str, limit: int = 100):
     try:
         translator = BailianTranslator(config.DASHSCOPE_API_KEY)
         # 使用 mode="custom" 透传 prompt
-        ai_response = translator._call_api(prompt, mode="custom")
+        ai_response = translator._call_api(prompt, mode="custom", fresh=fresh)
         
         # 5. 清洗和解析 AI 返回的 JSON
         # 有时候 AI 会忍不住加 ```json ... ```，我们需要去掉
         clean_json = ai_response.replace("```json", "").replace("```", "").strip()
         
         important_list = json.loads(clean_json)
+        if not isinstance(important_list, list):
+            print(f"[Notifier] AI 返回的不是 JSON 列表: {ai_response}")
+            return {"success": False, "msg": "AI 解析失败", "data": []}
         
-        return {
-            "success": True, 
-            "data": important_list, 
-            "total_scanned": len(raw_msgs)
-        }
+        return {"success": True, "data": important_list}
         
     except json.JSONDecodeError:
         print(f"[Notifier] AI 返回的不是合法 JSON: {ai_response}")
         return {"success": False, "msg": "AI 解析失败", "data": []}
     except Exception as e:
         print(f"[Notifier] 执行出错: {e}")
-        return {"success": False, "msg": str(e), "data": []}
\ No newline at end of file
+        return {"success": False, "msg": str(e), "data": []}
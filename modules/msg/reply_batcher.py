@@ -0,0 +1,161 @@
+# modules/msg/reply_batcher.py
+"""
+whether_reply 的跨聊天微批 (micro-batching)
+
+几十个群开着自动回复时，whether_reply 每条消息都要单独调用一次 qwen-plus (max_tokens=10)，
+耗时几乎全是单次请求的固定开销。这里把短时间内来自不同聊天的待判断消息攒成一批，
+用一个结构化提示词一次判断，再把每条的 YES/NO 分发回各自等待的 auto_reply 调用：
+
+- 第一条进入空批次的调用方成为本批的发起者，等待 REPLY_BATCH_MAX_WAIT 秒
+  (或攒满 REPLY_BATCH_MAX_SIZE 条) 后发出请求，其余调用方阻塞等待结果
+- 只有一条时仍使用原来的单条提示词
+- 模型漏答或答错格式的条目，单独用原提示词重新判断
+
+auto_reply 在 llm 线程池中同步执行，所以这里用线程同步原语，而不是 asyncio。
+"""
+import re
+import json
+import time
+import threading
+
+import config
+from modules.llm_client import get_llm_client
+
+_JSON_PATTERN = re.compile(r"\{.*\}", re.S)
+
+BATCH_PROMPT_TEMPLATE = """
+你是群聊中的机器人，名字是{bot_name}。下面有 {count} 条来自不同聊天的消息，每条附带该聊天最近的对话历史。
+请分别判断每条消息是否需要你回复。
+
+判断规则：
+1. 如果消息明确提到了你，或者你是被提及的对象，应该回复，判为"YES"
+2. 如果消息是无关紧要的表情、符号、或者明显不需要回复的内容，判为"NO"
+3. 能不回复就不回复，判为"NO"
+4. 如果消息是转发的信息、广告或与对话无关的内容，判为"NO"
+5. 请根据每条消息所在聊天的上下文判断，不同聊天之间互不相关
+6. 如果叫了你的名字，就需要回复
+7. 如果有人让你别说话，判为"NO"
+大多数情况下应该判为"NO"。
+
+{items}
+
+请只输出一个 JSON 对象，键为消息编号，值为"YES"或"NO"，例如 {{"1": "NO", "2": "YES"}}，不要输出其他内容。
+"""
+
+
+class _Pending:
+    __slots__ = ("contact", "history", "message", "fallback", "result", "done")
+
+    def __init__(self, contact, history, message, fallback):
+        self.contact = contact
+        self.history = history
+        self.message = message
+        self.fallback = fallback
+        self.result = None
+        self.done = threading.Event()
+
+
+class ReplyDecisionBatcher:
+
+    def __init__(self, max_size=None, max_wait=None):
+        self.max_size = max_size or getattr(config, "REPLY_BATCH_MAX_SIZE", 8)
+        self.max_wait = max_wait if max_wait is not None else getattr(config, "REPLY_BATCH_MAX_WAIT", 0.3)
+        self._cond = threading.Condition()
+        self._batch = []
+
+        self._counts = {"submitted": 0, "batches": 0, "batched_items": 0, "single_calls": 0, "fallbacks": 0}
+
+    def submit(self, contact, history, message, fallback):
+        """
+        提交一条待判断的消息，阻塞直到得到结果
+        fallback(): 单独判断这条消息 (原来的单条调用)，返回 call_llm_api 格式的字典
+        返回 {"success": True, "content": "YES"/"NO"} 或 {"success": False, "error": ...}
+        """
+        item = _Pending(contact, history, message, fallback)
+        with self._cond:
+            self._counts["submitted"] += 1
+            self._batch.append(item)
+            leader = len(self._batch) == 1
+            if len(self._batch) >= self.max_size:
+                self._cond.notify_all()
+
+            if leader:
+                # 发起者等待窗口结束或批次攒满，然后取走整批
+                deadline = time.monotonic() + self.max_wait
+                while len(self._batch) < self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch, self._batch = self._batch, []
+
+        if leader:
+            self._run(batch)
+        item.done.wait()
+        return item.result
+
+    def _run(self, batch):
+        try:
+            if len(batch) == 1:
+                with self._cond:
+                    self._counts["single_calls"] += 1
+                batch[0].result = batch[0].fallback()
+                return
+
+            with self._cond:
+                self._counts["batches"] += 1
+                self._counts["batched_items"] += len(batch)
+            try:
+                answers = self._ask(batch)
+            except Exception as e:
+                print(f"[ReplyBatcher] 批量判断失败 ({len(batch)} 条): {e}")
+                for item in batch:
+                    item.result = {"success": False, "error": str(e)}
+                return
+
+            for index, item in enumerate(batch, start=1):
+                answer = answers.get(str(index))
+                if answer in ("YES", "NO"):
+                    item.result = {"success": True, "content": answer}
+                else:
+                    # 漏答或格式不对的条目单独判断
+                    with self._cond:
+                        self._counts["fallbacks"] += 1
+                    item.result = item.fallback()
+        finally:
+            for item in batch:
+                if item.result is None:
+                    item.result = {"success": False, "error": "批量判断未返回结果"}
+                item.done.set()
+
+    def _ask(self, batch):
+        items = "\n\n".join(
+            f"【消息 {i}】(聊天: {item.contact})\n对话历史：\n{item.history or '(无)'}\n当前收到的消息：\n{item.message}"
+            for i, item in enumerate(batch, start=1)
+        )
+        prompt = BATCH_PROMPT_TEMPLATE.format(
+            bot_name=getattr(config, "BOT_NAME", "机器人"), count=len(batch), items=items
+        )
+        # 每条约 8 个 token ({"12": "YES", })，另留余量
+        text = get_llm_client().generate(prompt, profile="whether_reply", max_tokens=10 * len(batch) + 20)
+        match = _JSON_PATTERN.search(text.replace("```json", "").replace("```", ""))
+        if not match:
+            raise ValueError(f"模型返回的不是 JSON: {text[:100]}")
+        answers = json.loads(match.group(0))
+        return {str(k): str(v).strip().upper() for k, v in answers.items()}
+
+    def stats(self):
+        with self._cond:
+            counts = dict(self._counts)
+        counts["max_size"] = self.max_size
+        counts["max_wait_seconds"] = self.max_wait
+        counts["avg_batch_size"] = round(counts["batched_items"] / counts["batches"], 2) if counts["batches"] else 0.0
+        return counts
+
+
+_batcher = ReplyDecisionBatcher()
+
+
+def get_reply_batcher():
+    """进程内共享的 whether_reply 批处理器"""
+    return _batcher
@@ -0,0 +1,121 @@
+# modules/msg/reply_coalescer.py
+"""
+自动回复决策的按聊天合并 (debounce / coalescing)
+
+活跃群里两秒内来十条消息时，不必对每一条都走一遍 whether_reply -> qwen-plus。
+/api/message/save 对非 @ 消息的处理改为：
+
+1. 消息照常立即保存
+2. 该聊天的代数 (generation) +1，然后等待 REPLY_COALESCE_WINDOW 秒
+3. 等待期间又来了新消息 -> 本条不再评估，交给最新那条 (它会读到包括本条在内的最新记录)
+4. 评估受每个聊天的并发上限 REPLY_MAX_CONCURRENT_PER_CHAT 约束
+5. 评估完成时若已有更新的消息 (或 @ 回复) 到达，结果作废，不再发出过时的回复
+
+等待时间 + 大模型耗时需小于 NCatBot 的 10 秒请求超时。
+"""
+import asyncio
+import threading
+
+import config
+
+
+class ReplyCoalescer:
+    """
+    每个聊天一个递增代数 + 一个信号量，只在事件循环线程中使用
+    该聊天没有进行中的决策时删除这两项，长期运行、群很多时也不会累积
+    """
+
+    def __init__(self, window=None, max_concurrent=None):
+        self.window = window if window is not None else getattr(config, "REPLY_COALESCE_WINDOW", 1.5)
+        self.max_concurrent = max_concurrent or getattr(config, "REPLY_MAX_CONCURRENT_PER_CHAT", 1)
+        self._generations = {}
+        self._semaphores = {}
+        self._active = {}  # contact_id -> 进行中的 decide 数
+        self._lock = threading.Lock()
+
+        self._evaluated = 0
+        self._coalesced = 0
+        self._dropped = 0
+
+    def supersede(self, contact_id):
+        """记录一条新消息，返回新的代数；之前尚未完成的决策都会作废 (没有进行中的决策时什么也不做)"""
+        with self._lock:
+            if contact_id not in self._active:
+                return 0
+            gen = self._generations[contact_id] + 1
+            self._generations[contact_id] = gen
+            return gen
+
+    def _begin(self, contact_id):
+        with self._lock:
+            self._active[contact_id] = self._active.get(contact_id, 0) + 1
+            gen = self._generations.get(contact_id, 0) + 1
+            self._generations[contact_id] = gen
+            return gen
+
+    def _end(self, contact_id):
+        """一次决策结束；该聊天已没有进行中的决策时，代数和信号量都不再需要"""
+        with self._lock:
+            remaining = self._active[contact_id] - 1
+            if remaining:
+                self._active[contact_id] = remaining
+                return
+            del self._active[contact_id]
+            self._generations.pop(contact_id, None)
+            self._semaphores.pop(contact_id, None)
+
+    def is_latest(self, contact_id, gen):
+        return self._generations.get(contact_id, 0) == gen
+
+    def _semaphore(self, contact_id):
+        sem = self._semaphores.get(contact_id)
+        if sem is None:
+            sem = self._semaphores[contact_id] = asyncio.Semaphore(self.max_concurrent)
+        return sem
+
+    async def decide(self, contact_id, evaluate):
+        """
+        等待合并窗口后执行 evaluate() (协程函数)，返回其结果
+        被更新的消息取代时返回 None
+        """
+        gen = self._begin(contact_id)
+        try:
+            if self.window > 0:
+                await asyncio.sleep(self.window)
+            if not self.is_latest(contact_id, gen):
+                self._coalesced += 1
+                return None
+
+            async with self._semaphore(contact_id):
+                # 排队等待并发名额期间也可能被取代
+                if not self.is_latest(contact_id, gen):
+                    self._coalesced += 1
+                    return None
+                result = await evaluate()
+
+            self._evaluated += 1
+            if not self.is_latest(contact_id, gen):
+                self._dropped += 1
+                print(f"[Coalescer] 聊天 {contact_id} 有更新的消息，丢弃过时的回复决策")
+                return None
+            return result
+        finally:
+            self._end(contact_id)
+
+    def stats(self):
+        return {
+            "window_seconds": self.window,
+            "max_concurrent_per_chat": self.max_concurrent,
+            "evaluated": self._evaluated,
+            "coalesced": self._coalesced,
+            "dropped": self._dropped,
+            "tracked_chats": len(self._active),
+        }
+
+
+_coalescer = ReplyCoalescer()
+
+
+def get_reply_coalescer():
+    """进程内共享的回复决策合并器"""
+    return _coalescer
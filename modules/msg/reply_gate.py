@@ -0,0 +1,307 @@
+# modules/msg/reply_gate.py
+"""
+whether_reply 的本地预筛 (reply gate)
+
+提示词里写着"大多数情况下，你应该回复NO"，但每条消息仍要走一次远程大模型才能得到这个 NO。
+这里在调用大模型之前先做两级本地判断，只有拿不准的消息才交给大模型：
+
+1. 规则：纯表情 / [表情] / [图片]、转发的聊天记录和卡片、指令、很短的附和语 -> NO；
+   叫了机器人名字 -> YES
+2. 分类器：m3e-small 向量 + 逻辑回归，用大模型的历史判断结果 (REPLY_GATE_DECISIONS_LOG) 训练；
+   概率足够低/高时直接给出结果，中间区间交给大模型
+
+大模型的每次判断都会写入决策日志，积累到一定数量后训练分类器:
+    python -m modules.msg.reply_gate --train
+
+为了持续评估预筛是否可靠，按 REPLY_GATE_SHADOW_RATE 的比例对本地已判定的消息
+仍调用一次大模型 (影子模式)，统计两者的一致率。
+"""
+import os
+import re
+import json
+import random
+import argparse
+import threading
+
+import config
+
+try:
+    import numpy as np
+except ImportError:  # 没有 numpy 时只使用规则
+    np = None
+
+DECISIONS_LOG = getattr(config, "REPLY_GATE_DECISIONS_LOG", os.path.join(config.DATA_DIR, "reply_decisions.jsonl"))
+MODEL_PATH = getattr(config, "REPLY_GATE_MODEL_PATH", os.path.join(config.DATA_DIR, "reply_gate_model.npz"))
+EMBEDDING_MODEL = getattr(config, "REPLY_GATE_EMBEDDING_MODEL", "models/embedding/m3e-small")
+
+# 转发的聊天记录、小程序/链接卡片等
+_CARD_PATTERN = re.compile(r"\[CQ:(forward|json|xml|share|music|contact|location|redbag)\b")
+# 去掉表情、图片、回复引用等 CQ 码以及占位符后若为空，说明只有表情/图片
+_CQ_PATTERN = re.compile(r"\[CQ:[^\]]*\]")
+_PLACEHOLDER_PATTERN = re.compile(r"\[(表情|图片|动画表情|语音|视频|文件[^\]]*)\]")
+_SYMBOL_PATTERN = re.compile(r"^[\W\d_]*$", re.UNICODE)
+# emoji 和常见符号区段
+_EMOJI_PATTERN = re.compile("[\U0001F000-\U0001FAFF\u2600-\u27BF\uFE0F\u200D]+")
+
+ACKNOWLEDGEMENTS = {
+    "好", "好的", "好滴", "好吧", "嗯", "嗯嗯", "哦", "哦哦", "噢", "行", "行吧", "可以", "收到", "了解",
+    "ok", "okk", "okay", "1", "11", "111", "6", "66", "666", "6666", "+1", "草", "绷", "确实", "是的",
+    "对", "对对", "对对对", "哈", "哈哈", "哈哈哈", "哈哈哈哈", "笑死", "233", "2333", "xswl", "nb", "牛",
+    "谢谢", "谢了", "thx", "晚安", "早", "早安",
+}
+
+
+def rule_decision(message):
+    """
+    规则判定：返回 ("YES" | "NO", 原因)，无法判定时返回 (None, "")
+    """
+    text = (message or "").strip()
+    bot_name = getattr(config, "BOT_NAME", "")
+
+    if bot_name and bot_name in text:
+        return "YES", "叫了机器人名字"
+    if not text:
+        return "NO", "空消息"
+    if text.startswith(("/", "！", "!")):
+        return "NO", "指令消息"
+    if _CARD_PATTERN.search(text):
+        return "NO", "转发或卡片消息"
+
+    plain = _PLACEHOLDER_PATTERN.sub("", _CQ_PATTERN.sub("", text))
+    plain = _EMOJI_PATTERN.sub("", plain).strip()
+    if not plain:
+        return "NO", "纯表情或图片"
+    if _SYMBOL_PATTERN.match(plain):
+        return "NO", "只有符号或数字"
+    normalized = re.sub(r"[\s~～!！。.,，?？]+$", "", plain.lower())
+    if normalized in ACKNOWLEDGEMENTS:
+        return "NO", "简短附和"
+    return None, ""
+
+
+def _load_embedding_model():
+    """加载 m3e-small，依赖或模型文件缺失时返回 None"""
+    if np is None:
+        return None
+    try:
+        # 与向量库检索共用同一份已加载的模型
+        from scripts.vector_db_manager import get_embedding_model
+        return get_embedding_model(EMBEDDING_MODEL)
+    except Exception as e:
+        print(f"[ReplyGate] 向量模型不可用，仅使用规则预筛: {e}")
+        return None
+
+
+class ReplyGate:
+    """
+    规则 + 分类器两级预筛，带决策日志与统计
+    """
+
+    def __init__(self, model_path=MODEL_PATH, decisions_log=DECISIONS_LOG):
+        self.model_path = model_path
+        self.decisions_log = decisions_log
+        self.enabled = getattr(config, "REPLY_GATE_ENABLED", True)
+        self.no_threshold = getattr(config, "REPLY_GATE_NO_THRESHOLD", 0.1)
+        self.yes_threshold = getattr(config, "REPLY_GATE_YES_THRESHOLD", 0.95)
+        self.shadow_rate = getattr(config, "REPLY_GATE_SHADOW_RATE", 0.05)
+
+        self._embedder = None
+        self._weights = None
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._log_lock = threading.Lock()
+        self._count_lock = threading.Lock()
+
+        self._counts = {
+            "checked": 0,
+            "rule_decided": 0,
+            "model_decided": 0,
+            "escalated": 0,
+            "llm_calls_avoided": 0,
+            "shadow_checked": 0,
+            "shadow_agreed": 0,
+        }
+
+    def _incr(self, key):
+        with self._count_lock:
+            self._counts[key] += 1
+
+    # ---------- 分类器 ----------
+
+    def _ensure_model(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            if np is None or not os.path.exists(self.model_path):
+                return
+            embedder = _load_embedding_model()
+            if embedder is None:
+                return
+            data = np.load(self.model_path)
+            self._weights = (data["w"], float(data["b"]))
+            self._embedder = embedder
+            print(f"[ReplyGate] 已加载预筛分类器: {self.model_path}")
+
+    def predict_proba(self, message):
+        """返回"需要回复"的概率，分类器不可用时返回 None"""
+        self._ensure_model()
+        if self._weights is None:
+            return None
+        vec = np.asarray(self._embedder.embed_query(message), dtype=np.float32)
+        w, b = self._weights
+        return float(1.0 / (1.0 + np.exp(-(vec @ w + b))))
+
+    # ---------- 判定 ----------
+
+    def check(self, message):
+        """
+        返回 {"decision": "YES"/"NO"/None, "source": "rule"/"model"/None, "reason": str, "shadow": bool}
+        decision 为 None 表示需要交给大模型；shadow 为 True 表示虽已判定，仍应调用大模型做一致性抽查
+        """
+        result = {"decision": None, "source": None, "reason": "", "shadow": False}
+        if not self.enabled:
+            return result
+        self._incr("checked")
+
+        decision, reason = rule_decision(message)
+        if decision:
+            result.update(decision=decision, source="rule", reason=reason)
+        else:
+            try:
+                prob = self.predict_proba(message)
+            except Exception as e:
+                print(f"[ReplyGate] 分类器预测失败: {e}")
+                prob = None
+            if prob is not None and prob <= self.no_threshold:
+                result.update(decision="NO", source="model", reason=f"分类器判定 (p={prob:.2f})")
+            elif prob is not None and prob >= self.yes_threshold:
+                result.update(decision="YES", source="model", reason=f"分类器判定 (p={prob:.2f})")
+
+        if result["decision"] is None:
+            self._incr("escalated")
+            return result
+
+        self._incr(f"{result['source']}_decided")
+        if random.random() < self.shadow_rate:
+            result["shadow"] = True
+        else:
+            self._incr("llm_calls_avoided")
+        return result
+
+    def record(self, message, llm_decision, gate_result=None):
+        """记录大模型的判断结果 (训练数据)，影子模式下同时统计一致率"""
+        gate_result = gate_result or {}
+        if gate_result.get("shadow"):
+            self._incr("shadow_checked")
+            if gate_result.get("decision") == llm_decision:
+                self._incr("shadow_agreed")
+            else:
+                print(f"[ReplyGate] 预筛与大模型不一致: gate={gate_result.get('decision')} llm={llm_decision} msg={message[:30]}")
+
+        entry = {
+            "message": message,
+            "label": llm_decision,
+            "gate": gate_result.get("decision"),
+            "gate_source": gate_result.get("source"),
+        }
+        with self._log_lock:
+            try:
+                os.makedirs(os.path.dirname(self.decisions_log), exist_ok=True)
+                with open(self.decisions_log, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            except Exception as e:
+                print(f"[ReplyGate] 写入决策日志失败: {e}")
+
+    def stats(self):
+        with self._count_lock:
+            counts = dict(self._counts)
+        counts["classifier_loaded"] = self._weights is not None
+        counts["agreement_rate"] = (
+            round(counts["shadow_agreed"] / counts["shadow_checked"], 3) if counts["shadow_checked"] else None
+        )
+        return counts
+
+
+def train(decisions_log=DECISIONS_LOG, model_path=MODEL_PATH, epochs=300, lr=0.5, l2=1e-3, min_samples=50):
+    """
+    用决策日志训练逻辑回归 (只使用规则判定不了的消息)，按类别加权以应对 NO 占多数的情况
+    """
+    if np is None:
+        print("[ReplyGate] 需要 numpy 才能训练")
+        return False
+    samples = {}
+    if os.path.exists(decisions_log):
+        with open(decisions_log, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                message, label = entry.get("message", ""), entry.get("label")
+                if label in ("YES", "NO") and message and rule_decision(message)[0] is None:
+                    samples[message] = 1.0 if label == "YES" else 0.0  # 同一消息以最新判断为准
+    if len(samples) < min_samples:
+        print(f"[ReplyGate] 样本不足 ({len(samples)} < {min_samples})，暂不训练")
+        return False
+
+    embedder = _load_embedding_model()
+    if embedder is None:
+        return False
+    messages = list(samples.keys())
+    X = np.asarray(embedder.embed_documents(messages), dtype=np.float32)
+    y = np.asarray([samples[m] for m in messages], dtype=np.float32)
+
+    # 留出 20% 做验证
+    order = np.random.RandomState(0).permutation(len(y))
+    split = max(1, int(len(y) * 0.8))
+    train_idx, val_idx = order[:split], order[split:]
+
+    positives = max(1.0, y[train_idx].sum())
+    negatives = max(1.0, len(train_idx) - y[train_idx].sum())
+    sample_weight = np.where(y[train_idx] == 1, len(train_idx) / (2 * positives), len(train_idx) / (2 * negatives))
+
+    w = np.zeros(X.shape[1], dtype=np.float32)
+    b = 0.0
+    Xt, yt = X[train_idx], y[train_idx]
+    for _ in range(epochs):
+        p = 1.0 / (1.0 + np.exp(-(Xt @ w + b)))
+        grad = (p - yt) * sample_weight
+        w -= lr * (Xt.T @ grad / len(yt) + l2 * w)
+        b -= lr * float(grad.mean())
+
+    def accuracy(idx):
+        if len(idx) == 0:
+            return None
+        p = 1.0 / (1.0 + np.exp(-(X[idx] @ w + b)))
+        return float(((p >= 0.5) == (y[idx] == 1)).mean())
+
+    os.makedirs(os.path.dirname(model_path), exist_ok=True)
+    np.savez(model_path, w=w, b=b)
+    print(f"[ReplyGate] 训练完成: 样本 {len(y)} (YES {int(y.sum())})，"
+          f"训练集准确率 {accuracy(train_idx):.3f}，验证集准确率 {accuracy(val_idx) or 0:.3f} -> {model_path}")
+    return True
+
+
+_gate = ReplyGate()
+
+
+def get_reply_gate():
+    """进程内共享的回复预筛"""
+    return _gate
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="whether_reply 本地预筛工具")
+    parser.add_argument("--train", action="store_true", help="用决策日志训练分类器")
+    parser.add_argument("--check", default=None, help="查看某条消息的预筛结果")
+    args = parser.parse_args()
+
+    if args.train:
+        train()
+    elif args.check is not None:
+        print(ReplyGate().check(args.check))
+    else:
+        parser.print_help()
@@ -0,0 +1,175 @@
+# modules/msg/rolling_summary.py
+"""
+按联系人维护的滚动总结 (rolling summary)
+
+每次 /api/msg/summarize 都把整个窗口从头总结一遍，哪怕上次总结之后只来了五条消息。
+这里为每个联系人保存上一次的总结和它覆盖到的最后一条消息 (水位 watermark)：
+
+- 再次请求时只读取水位之后的新消息，连同旧总结一起交给大模型"增量合并"，
+  耗时和 token 只与新消息的数量有关；没有新消息时直接返回保存的总结
+- 以下情况重新完整总结 (走 summarizer 的分段总结)：没有保存的总结、fresh=True、
+  目标语言或条数变化、增量合并次数达到 ROLLING_SUMMARY_MAX_FOLDS、
+  距上次完整总结超过 ROLLING_SUMMARY_MAX_AGE、新消息超出单次总结预算或超过 limit 条
+
+总结保存在 ROLLING_SUMMARY_DIR 下，每个联系人一个 JSON 文件。
+"""
+import os
+import json
+import time
+import threading
+
+import config
+from modules.executors import run_blocking
+from modules.llm_client import get_llm_client
+from .msg_handler import get_recent_context
+from .history_store import record_watermark, watermark_reached
+from .context_builder import estimate_tokens, default_line
+from .summarizer import build_summary_prompt_with_newest
+
+SUMMARY_DIR = getattr(config, "ROLLING_SUMMARY_DIR", os.path.join(config.DATA_DIR, "rolling_summaries"))
+
+
+def _fold_prompt(summary, delta_text, count, target_lang):
+    return (
+        f"以下是此前聊天记录的总结，以及之后新增的 {count} 条消息。请用{target_lang}更新总结："
+        f"把新消息中的话题、结论和待办事项并入原总结，已过时或已完成的事项相应修改，保持精炼。"
+        f"只输出更新后的完整总结。\n\n【此前的总结】\n{summary}\n\n【新增消息】\n{delta_text}"
+    )
+
+
+class RollingSummaryStore:
+    """每个联系人一个 JSON 文件，写入时先写临时文件再替换"""
+
+    def __init__(self, base_dir=SUMMARY_DIR):
+        self.base_dir = base_dir
+        self._lock = threading.Lock()
+
+    def _path(self, contact_id):
+        return os.path.join(self.base_dir, f"{contact_id}.json")
+
+    def load(self, contact_id):
+        path = self._path(contact_id)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"[RollingSummary] 读取 {contact_id} 的滚动总结失败: {e}")
+            return None
+
+    def save(self, contact_id, entry):
+        path = self._path(contact_id)
+        with self._lock:
+            try:
+                os.makedirs(self.base_dir, exist_ok=True)
+                tmp_path = path + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(entry, f, ensure_ascii=False, indent=2)
+                os.replace(tmp_path, path)
+            except Exception as e:
+                print(f"[RollingSummary] 保存 {contact_id} 的滚动总结失败: {e}")
+
+
+_store = RollingSummaryStore()
+
+
+def get_rolling_summary_store():
+    return _store
+
+
+def _refresh_reason(entry, limit, target_lang, fresh):
+    """需要完整重新总结的原因，不需要时返回 None"""
+    if fresh:
+        return "fresh"
+    if entry is None:
+        return "首次总结"
+    if entry.get("target_lang") != target_lang or entry.get("limit") != limit:
+        return "参数变化"
+    if entry.get("folds", 0) >= getattr(config, "ROLLING_SUMMARY_MAX_FOLDS", 20):
+        return "增量合并次数已达上限"
+    if time.time() - entry.get("refreshed_at", 0) > getattr(config, "ROLLING_SUMMARY_MAX_AGE", 24 * 3600):
+        return "距上次完整总结时间过长"
+    return None
+
+
+class SummaryPlan:
+    """
+    一次总结请求的执行计划：
+    - summary 不为 None：没有新消息，直接使用保存的总结
+    - 否则调用方用 prompt 请求大模型 (可以流式)，得到结果后调用 commit(summary) 更新保存的总结
+    """
+
+    def __init__(self, contact_id, report, summary=None, prompt=None, entry=None):
+        self.contact_id = contact_id
+        self.report = report
+        self.summary = summary
+        self.prompt = prompt
+        self.entry = entry
+
+    def commit(self, summary):
+        if self.entry is None or not summary:
+            return
+        self.entry["summary"] = summary
+        self.entry["updated_at"] = time.time()
+        _store.save(self.contact_id, self.entry)
+
+
+async def plan_summary(contact_id, limit=100, target_lang="Chinese", fresh=False):
+    """决定本次是直接返回、增量合并还是完整重新总结，返回 SummaryPlan；没有聊天记录时返回 None"""
+    limit = int(limit)
+    entry = await run_blocking("disk", _store.load, contact_id)
+    reason = _refresh_reason(entry, limit, target_lang, fresh)
+
+    if reason is None:
+        read = {}
+        delta = await run_blocking("disk", get_recent_context, contact_id, limit, True, "summarize_map",
+                                   watermark_reached(entry["watermark"]), report=read)
+        if not delta:
+            report = {"mode": "rolling", "new_messages": 0, "folds": entry["folds"]}
+            if "newest" in read:
+                # 新消息全是被过滤掉的表情、刷屏：不需要合并，但水位要越过它们，下次不再重复读取
+                entry = dict(entry, watermark=record_watermark(read["newest"]))
+                await run_blocking("disk", _store.save, contact_id, entry)
+            return SummaryPlan(contact_id, report, summary=entry["summary"])
+
+        delta_text = "\n".join(default_line(item, content) for item, content in delta)
+        single_budget = getattr(config, "CONTEXT_TOKEN_BUDGETS", {}).get("summarize", 6000)
+        if len(delta) >= limit or estimate_tokens(delta_text) > single_budget:
+            reason = "新消息过多"
+        else:
+            # 水位取实际读到的最新原始记录，而不是过滤后保留的最后一条
+            entry = dict(entry, watermark=record_watermark(read["newest"]), folds=entry["folds"] + 1)
+            report = {"mode": "rolling", "new_messages": len(delta), "folds": entry["folds"]}
+            prompt = _fold_prompt(entry["summary"], delta_text, len(delta), target_lang)
+            return SummaryPlan(contact_id, report, prompt=prompt, entry=entry)
+
+    # 完整重新总结：水位取生成提示词时实际读到的最新消息，之后到达的消息留给下一次增量合并
+    prompt, report, newest = await build_summary_prompt_with_newest(contact_id, limit, target_lang, fresh)
+    if prompt is None or newest is None:
+        return None
+    print(f"[RollingSummary] {contact_id} 完整重新总结: {reason}")
+    report["refresh_reason"] = reason
+    now = time.time()
+    entry = {
+        "contact_id": contact_id,
+        "limit": limit,
+        "target_lang": target_lang,
+        "watermark": record_watermark(newest),
+        "folds": 0,
+        "refreshed_at": now,
+        "updated_at": now,
+    }
+    return SummaryPlan(contact_id, report, prompt=prompt, entry=entry)
+
+
+async def rolling_summarize(contact_id, limit=100, target_lang="Chinese", fresh=False):
+    """返回 (summary, report)；没有聊天记录时 summary 为 None"""
+    plan = await plan_summary(contact_id, limit, target_lang, fresh)
+    if plan is None:
+        return None, {}
+    if plan.summary is not None:
+        return plan.summary, plan.report
+    summary = await get_llm_client().agenerate(plan.prompt, profile="summarize", fresh=fresh)
+    await run_blocking("disk", plan.commit, summary)
+    return summary, plan.report
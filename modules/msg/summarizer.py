@@ -0,0 +1,199 @@
+# modules/msg/summarizer.py
+"""
+聊天记录的分段 (map-reduce) 总结
+
+/api/msg/summarize 原先把最近 limit 条消息拼成一个提示词：limit 大了要么超出 token 预算被截掉，
+要么一次串行调用耗时很长。这里在聊天记录超过单次总结预算 (CONTEXT_TOKEN_BUDGETS["summarize"]) 时：
+
+1. 按时间切分：先按自然日和会话间隔 (SUMMARY_SESSION_GAP) 切成会话，过长的会话再按
+   SUMMARY_CHUNK_TOKENS 拆开，同一天内相邻的小会话合并成一段
+2. map：各段并发调用大模型生成分段摘要 (llm 线程池 + 全局限流)，
+   分段的提示词只取决于该段内容，重叠的请求直接命中响应缓存
+3. reduce：把分段摘要合并成最终总结；摘要加起来仍超出 SUMMARY_REDUCE_TOKENS 时先分组合并
+
+总耗时约为 (分段数 / 并发数) 次调用加上 reduce，而不是随总长度线性增长。
+"""
+import time
+import asyncio
+from datetime import datetime
+
+import config
+from modules.executors import run_blocking
+from modules.llm_client import get_llm_client
+from .msg_handler import get_recent_context
+from .history_store import record_epoch
+from .context_builder import estimate_tokens, default_line
+from .translator import BailianTranslator
+
+
+def _single_prompt(chat_text, target_lang):
+    # 与原来的 /api/msg/summarize 使用同一提示词，可以复用已有的缓存
+    return BailianTranslator._build_prompt(chat_text, "summarize", target_lang)[0]
+
+
+def _map_prompt(chunk, target_lang):
+    return (
+        f"以下是 {chunk['start']} 至 {chunk['end']} 的一段聊天记录。请用{target_lang}简要总结这段时间内"
+        f"讨论的主要话题、结论、待办事项和重要信息，保留人名、时间和数字：\n\n{chunk['text']}"
+    )
+
+
+def _reduce_prompt(parts, target_lang):
+    sections = "\n\n".join(f"【{p['start']} ~ {p['end']}】\n{p['summary']}" for p in parts)
+    return (
+        f"以下是同一会话按时间顺序排列的若干分段摘要。请用{target_lang}把它们合并成一份完整、精炼的总结，"
+        f"按话题归纳，保留关键结论、待办事项和时间节点：\n\n{sections}"
+    )
+
+
+def split_chunks(kept, chunk_tokens=None, session_gap=None):
+    """
+    把 [(record, content), ...] (时间正序) 切成时间上连续的分段
+    返回 [{"start", "end", "text", "tokens", "messages"}, ...]
+    """
+    chunk_tokens = chunk_tokens or getattr(config, "SUMMARY_CHUNK_TOKENS", 3000)
+    session_gap = session_gap or getattr(config, "SUMMARY_SESSION_GAP", 1800)
+
+    # 1. 按自然日和会话间隔切成会话，过长的会话按 token 数拆开
+    pieces = []  # 每项: {"day", "lines": [(record, line)], "tokens"}
+    prev_epoch, prev_day = None, None
+    for item, content in kept:
+        epoch = record_epoch(item)
+        day = datetime.fromtimestamp(epoch).strftime("%Y-%m-%d") if epoch else prev_day
+        line = default_line(item, content)
+        cost = estimate_tokens(line) + 1
+        new_session = (
+            not pieces
+            or day != prev_day
+            or (epoch and prev_epoch and epoch - prev_epoch >= session_gap)
+            or pieces[-1]["tokens"] + cost > chunk_tokens
+        )
+        if new_session:
+            pieces.append({"day": day, "lines": [], "tokens": 0})
+        pieces[-1]["lines"].append((item, line))
+        pieces[-1]["tokens"] += cost
+        prev_epoch, prev_day = epoch or prev_epoch, day
+
+    # 2. 同一天内相邻的小会话合并，不跨天 (新消息只影响当天的分段，更早的分段提示词保持不变)
+    merged = []
+    for piece in pieces:
+        last = merged[-1] if merged else None
+        if last and last["day"] == piece["day"] and last["tokens"] + piece["tokens"] <= chunk_tokens:
+            last["lines"].extend(piece["lines"])
+            last["tokens"] += piece["tokens"]
+        else:
+            merged.append(piece)
+
+    return [
+        {
+            "start": piece["lines"][0][0].get("time", ""),
+            "end": piece["lines"][-1][0].get("time", ""),
+            "text": "\n".join(line for _, line in piece["lines"]),
+            "tokens": piece["tokens"],
+            "messages": len(piece["lines"]),
+        }
+        for piece in merged
+    ]
+
+
+async def _summarize_parts(prompts, fresh):
+    """并发调用大模型，返回与 prompts 对应的结果列表 (失败的位置为异常对象)"""
+    client = get_llm_client()
+    return await asyncio.gather(
+        *(client.agenerate(prompt, profile="summarize", fresh=fresh) for prompt in prompts),
+        return_exceptions=True,
+    )
+
+
+async def _map(chunks, target_lang, fresh, report):
+    results = await _summarize_parts([_map_prompt(c, target_lang) for c in chunks], fresh)
+    parts = []
+    for chunk, result in zip(chunks, results):
+        if isinstance(result, Exception):
+            print(f"[Summarizer] 分段 {chunk['start']} ~ {chunk['end']} 总结失败: {result}")
+            report["failed_chunks"] += 1
+            continue
+        parts.append({"start": chunk["start"], "end": chunk["end"], "summary": result})
+    if not parts:
+        raise results[0]
+    return parts
+
+
+async def _reduce(parts, target_lang, fresh, report):
+    """分段摘要加起来超出 reduce 预算时，按预算分组先合并一轮，直到可以一次合并"""
+    reduce_tokens = getattr(config, "SUMMARY_REDUCE_TOKENS", 6000)
+    while len(parts) > 1 and estimate_tokens(_reduce_prompt(parts, target_lang)) > reduce_tokens:
+        groups, current, tokens = [], [], 0
+        for part in parts:
+            cost = estimate_tokens(part["summary"]) + 20
+            if current and tokens + cost > reduce_tokens:
+                groups.append(current)
+                current, tokens = [], 0
+            current.append(part)
+            tokens += cost
+        groups.append(current)
+        if len(groups) == len(parts):
+            break  # 每个摘要单独就超出预算，不再继续分组
+        results = await _summarize_parts([_reduce_prompt(g, target_lang) for g in groups], fresh)
+        report["reduce_rounds"] += 1
+        parts = [
+            {"start": g[0]["start"], "end": g[-1]["end"],
+             "summary": "\n".join(p["summary"] for p in g) if isinstance(r, Exception) else r}
+            for g, r in zip(groups, results)
+        ]
+    return parts
+
+
+async def build_summary_prompt(contact_id, limit=100, target_lang="Chinese", fresh=False, mode="auto"):
+    """
+    生成最终总结所用的提示词 (map 阶段在这里完成)，返回 (prompt, report)；没有聊天记录时 prompt 为 None
+    mode: "auto" 超出单次预算时分段总结；"single" 与原来一样只总结预算内最近的消息；"map_reduce" 总是分段
+    """
+    prompt, report, _ = await build_summary_prompt_with_newest(contact_id, limit, target_lang, fresh, mode)
+    return prompt, report
+
+
+async def build_summary_prompt_with_newest(contact_id, limit=100, target_lang="Chinese", fresh=False, mode="auto"):
+    """同 build_summary_prompt，另外返回生成提示词时读到的最新一条原始记录 (供滚动总结记录水位)"""
+    report = {"mode": "single", "messages": 0, "chunks": 1, "failed_chunks": 0, "reduce_rounds": 0}
+    read = {}
+    if mode == "single":
+        kept = await run_blocking("disk", get_recent_context, contact_id, int(limit),
+                                  include_media=True, purpose="summarize", report=read)
+        chat_text = "\n".join(default_line(item, content) for item, content in kept)
+        return (_single_prompt(chat_text, target_lang) if chat_text else None), report, read.get("newest")
+
+    # include_media=True 确保图片里的 OCR 文字也能被 AI 读到
+    kept = await run_blocking("disk", get_recent_context, contact_id, int(limit),
+                              include_media=True, purpose="summarize_map", report=read)
+    newest = read.get("newest")
+    report["messages"] = len(kept)
+    if not kept:
+        return None, report, newest
+
+    chunks = split_chunks(kept)
+    total_tokens = sum(c["tokens"] for c in chunks)
+    single_budget = getattr(config, "CONTEXT_TOKEN_BUDGETS", {}).get("summarize", 6000)
+    if len(chunks) == 1 or (mode == "auto" and total_tokens <= single_budget):
+        chat_text = "\n".join(default_line(item, content) for item, content in kept)
+        return _single_prompt(chat_text, target_lang), report, newest
+
+    start = time.time()
+    report.update(mode="map_reduce", chunks=len(chunks))
+    parts = await _map(chunks, target_lang, fresh, report)
+    parts = await _reduce(parts, target_lang, fresh, report)
+    report["map_seconds"] = round(time.time() - start, 2)
+    print(f"[Summarizer] {contact_id}: {len(kept)} 条消息分为 {len(chunks)} 段 (约 {total_tokens} tokens)，"
+          f"失败 {report['failed_chunks']} 段，分段耗时 {report['map_seconds']}s")
+    if len(parts) == 1:
+        return _single_prompt(parts[0]["summary"], target_lang), report, newest
+    return _reduce_prompt(parts, target_lang), report, newest
+
+
+async def summarize_history(contact_id, limit=100, target_lang="Chinese", fresh=False, mode="auto"):
+    """返回 (summary, report)；没有聊天记录时 summary 为 None"""
+    prompt, report = await build_summary_prompt(contact_id, limit, target_lang, fresh, mode)
+    if prompt is None:
+        return None, report
+    summary = await get_llm_client().agenerate(prompt, profile="summarize", fresh=fresh)
+    return summary, report
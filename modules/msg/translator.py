@@ -1,11 +1,9 @@
 # modules/comic_translator/translator.py
 import json
-import requests
-import time
 from typing import List, Dict, Any, Union
 from pathlib import Path
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+
+from modules.llm_client import get_llm_client
 
 class BailianTranslator:
     """
@@ -14,54 +12,50 @@ class BailianTranslator:
     
     def __init__(self, api_key: str):
         self.api_key = api_key
-        self.api_url = "https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation"
-        self.headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        self.session = requests.Session()
-        retry = Retry(total=3, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504])
-        adapter = HTTPAdapter(max_retries=retry)
-        self.session.mount('https://', adapter)
+        # 共用进程内的大模型客户端 (连接池、重试)，构造翻译器不再建立新连接
+        self.client = get_llm_client(api_key)
     
-    def _call_api(self, text: str, mode: str = "translate", target_lang: str = "Chinese") -> str:
-        """
-        核心调用方法：支持翻译和总结
-        """
-        if not text or not text.strip():
-            return ""
-
-        # 根据模式构建 Prompt
+    @staticmethod
+    def _build_prompt(text: str, mode: str, target_lang: str):
+        """根据模式构建 Prompt，返回 (prompt, profile)"""
         if mode == "translate":
             prompt = f"Translate the following text to {target_lang}. Only output the translated text without explanations:\n\n{text}"
         elif mode == "summarize":
             prompt = f"请阅读以下文本，并用{target_lang}生成一份精炼的摘要总结，提取核心信息：\n\n{text}"
         else:
             prompt = text 
+        return prompt, mode if mode in ("translate", "summarize") else "default"
+
+    def _call_api(self, text: str, mode: str = "translate", target_lang: str = "Chinese", fresh: bool = False) -> str:
+        """
+        核心调用方法：支持翻译和总结
+        fresh: 为 True 时跳过响应缓存，强制重新生成
+        """
+        if not text or not text.strip():
+            return ""
+
+        prompt, profile = self._build_prompt(text, mode, target_lang)
 
-        payload = {
-            "model": "qwen-plus",
-            "input": {"messages": [{"role": "user", "content": prompt}]},
-            "parameters": {"max_tokens": 2000, "temperature": 0.3}
-        }
-        
         try:
-            response = self.session.post(self.api_url, headers=self.headers, json=payload, timeout=300)
-            if response.status_code == 200:
-                result = response.json()
-                if 'output' in result and 'text' in result['output']:
-                    # 尝试清洗可能存在的 markdown 标记
-                    clean_text = result['output']['text'].strip()
-                    return clean_text.replace("```json", "").replace("```", "")
-                elif 'output' in result and 'choices' in result['output']:
-                     return result['output']['choices'][0]['message']['content'].strip()
-            print(f"API Error: {response.text}")
-            return text
+            clean_text = self.client.generate(prompt, profile=profile, fresh=fresh)
+            # 尝试清洗可能存在的 markdown 标记
+            return clean_text.replace("```json", "").replace("```", "")
         except Exception as e:
-            print(f"Exception: {e}")
+            print(f"API Error: {e}")
             return text
 
-    def translate_json_file(self, file_path: Union[str, Path], target_lang: str = "Chinese") -> Union[List[Dict], Dict]:
+    async def stream_api(self, text: str, mode: str = "translate", target_lang: str = "Chinese", fresh: bool = False):
+        """
+        _call_api 的流式版本：异步生成器，模型每输出一段就产出一段
+        出错时抛出异常，由调用方决定如何告知前端
+        """
+        if not text or not text.strip():
+            return
+        prompt, profile = self._build_prompt(text, mode, target_lang)
+        async for chunk in self.client.astream(prompt, profile=profile, fresh=fresh):
+            yield chunk
+
+    def translate_json_file(self, file_path: Union[str, Path], target_lang: str = "Chinese", fresh: bool = False) -> Union[List[Dict], Dict]:
         """
         翻译JSON文件 - 修复后的逻辑
         """
@@ -81,7 +75,7 @@ class BailianTranslator:
                     # 将列表转为字符串发送给 LLM
                     # 修正点：这里强制 mode="translate"
                     text_to_translate = str(rec_texts)
-                    translated_str = self._call_api(text_to_translate, mode="translate", target_lang=target_lang)
+                    translated_str = self._call_api(text_to_translate, mode="translate", target_lang=target_lang, fresh=fresh)
                     
                     # 尝试把翻译回来的字符串变回列表 (为了保持JSON格式兼容性)
                     try:
@@ -1,7 +1,6 @@
 # whether_reply.py
 # 判断是否需要自动回复的模块
 
-import requests
 import json
 
 import sys
@@ -16,10 +15,11 @@ if parent_dir not in sys.path:
 import sys
 sys.path.append(parent_dir)  # 确保父目录在路径中
 import config  # 导入配置模块
+from modules.llm_client import get_llm_client
+from modules.msg.reply_gate import get_reply_gate  # 本地预筛，明显不需要回复的消息不调用大模型
+from modules.msg.reply_batcher import get_reply_batcher  # 多个聊天的判断攒批后一次调用大模型
 
-# 百炼API配置
-LLM_API_URL = "https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation"  # 百炼API地址
-LLM_API_KEY = config.DASHSCOPE_API_KEY  # 使用配置文件中的API密钥
+# 百炼API：通过共享的大模型客户端调用 (modules/llm_client.py)
 
 # 判断是否需要回复的提示词模板
 def get_prompt_template():
@@ -72,7 +72,7 @@ def get_prompt_template():
 
 def call_llm_api(prompt: str) -> dict:
     """
-    调用百炼大模型API
+    调用百炼大模型API (共享客户端，参数见 config.LLM_PROFILES["whether_reply"])
     
     Args:
         prompt (str): 提示词
@@ -80,56 +80,11 @@ def call_llm_api(prompt: str) -> dict:
     Returns:
         dict: 包含API调用结果的字典
     """
-    try:
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {LLM_API_KEY}"
-        }
-        
-        # 百炼API请求格式
-        payload = {
-            "model": "qwen-plus",
-            "input": {"messages": [{"role": "user", "content": prompt}]},
-            "parameters": {"max_tokens": 10, "temperature": 0.1}  # 低温度确保结果稳定
-        }
-        
-        response = requests.post(LLM_API_URL, headers=headers, json=payload, timeout=30)
-        
-        if response.status_code == 200:
-            result = response.json()
-            if 'output' in result and 'text' in result['output']:
-                # 尝试清洗可能存在的 markdown 标记
-                clean_text = result['output']['text'].strip()
-                return {
-                    "success": True,
-                    "content": clean_text.replace("```json", "").replace("```", "")
-                }
-            elif 'output' in result and 'choices' in result['output']:
-                return {
-                    "success": True,
-                    "content": result['output']['choices'][0]['message']['content'].strip()
-                }
-            else:
-                return {
-                    "success": False,
-                    "error": f"API返回格式错误: {result}"
-                }
-        else:
-            return {
-                "success": False,
-                "error": f"API请求失败: {response.status_code}, {response.text}"
-            }
-            
-    except requests.exceptions.RequestException as e:
-        return {
-            "success": False,
-            "error": f"网络请求失败: {str(e)}"
-        }
-    except Exception as e:
-        return {
-            "success": False,
-            "error": f"API调用失败: {str(e)}"
-        }
+    result = get_llm_client().chat(prompt, profile="whether_reply")
+    if result.get("success"):
+        # 尝试清洗可能存在的 markdown 标记
+        result["content"] = result["content"].replace("```json", "").replace("```", "")
+    return result
 
 def whether_reply(contact_name: str, current_message: str, recent_history: list = None) -> dict:
     """
@@ -144,6 +99,15 @@ def whether_reply(contact_name: str, current_message: str, recent_history: list
         dict: 包含是否需要回复和原因的字典
     """
     try:
+        # 先做本地预筛，能确定结果的消息直接返回 (影子抽查的除外)
+        gate = get_reply_gate()
+        gate_result = gate.check(current_message)
+        if gate_result["decision"] and not gate_result["shadow"]:
+            return {
+                "should_reply": gate_result["decision"] == "YES",
+                "reason": f"本地预筛判断: {gate_result['reason']}"
+            }
+
         # 构建对话历史字符串
         conversation_history = ""
         if recent_history and isinstance(recent_history, list):
@@ -159,8 +123,13 @@ def whether_reply(contact_name: str, current_message: str, recent_history: list
             current_message=current_message
         )
 
-        # 调用大模型API
-        llm_response = call_llm_api(prompt)
+        # 调用大模型API (开启批处理时与其他聊天的待判断消息合并为一次调用)
+        if getattr(config, "REPLY_BATCH_ENABLED", True):
+            llm_response = get_reply_batcher().submit(
+                contact_name, conversation_history.strip(), current_message, lambda: call_llm_api(prompt)
+            )
+        else:
+            llm_response = call_llm_api(prompt)
 
         if not llm_response.get("success", False):
             return {
@@ -171,6 +140,10 @@ def whether_reply(contact_name: str, current_message: str, recent_history: list
         # 解析大模型回复
         reply_content = llm_response.get("content", "").strip().upper()
 
+        # 记录大模型的判断，用于训练预筛分类器和统计一致率
+        if reply_content in ("YES", "NO"):
+            gate.record(current_message, reply_content, gate_result)
+
         # 判断结果
         if reply_content == "YES":
             return {
@@ -0,0 +1,48 @@
+# modules/token_counter.py
+"""
+token 数估算
+
+配置了 TOKENIZER_PATH 且装有 transformers 时使用真实 tokenizer，
+否则按"中日韩字符 1 token、其他字符约 4 个 1 token"估算。
+llm_client (限流器的 TPM 预估) 和 msg.context_builder (上下文预算) 共用这里的实现。
+"""
+import os
+import re
+import threading
+
+import config
+
+_CJK_PATTERN = re.compile("[\u3000-\u303F\u3040-\u30FF\u3400-\u4DBF\u4E00-\u9FFF\uAC00-\uD7AF\uFF00-\uFFEF]")
+
+_tokenizer = None
+_tokenizer_loaded = False
+_tokenizer_lock = threading.Lock()
+
+
+def _load_tokenizer():
+    global _tokenizer, _tokenizer_loaded
+    if _tokenizer_loaded:
+        return _tokenizer
+    with _tokenizer_lock:
+        if not _tokenizer_loaded:
+            path = getattr(config, "TOKENIZER_PATH", None)
+            if path and os.path.exists(path):
+                try:
+                    from transformers import AutoTokenizer
+                    _tokenizer = AutoTokenizer.from_pretrained(path, trust_remote_code=True)
+                    print(f"[Tokens] 已加载 tokenizer: {path}")
+                except Exception as e:
+                    print(f"[Tokens] tokenizer 加载失败，改用估算: {e}")
+            _tokenizer_loaded = True
+    return _tokenizer
+
+
+def estimate_tokens(text):
+    """估算一段文本的 token 数"""
+    if not text:
+        return 0
+    tokenizer = _load_tokenizer()
+    if tokenizer is not None:
+        return len(tokenizer.encode(text))
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
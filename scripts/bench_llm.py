@@ -0,0 +1,94 @@
+# scripts/bench_llm.py
+"""
+大模型调用链路压测 (配合 scripts/mock_dashscope.py 离线运行)
+
+按比例混合 whether_reply / auto_reply / summarize / translate 四类请求，经过完整的
+LLMClient (连接池、重试、全局限流、响应缓存) 并发发出，输出吞吐、各类请求的延迟分位数
+以及客户端和限流器的统计。
+
+用法:
+    python scripts/mock_dashscope.py --latency lognormal:-0.5,0.4 --throttle-rate 0.05 &
+    python scripts/bench_llm.py --requests 500 --concurrency 32
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.llm_client import LLMClient
+from modules.llm_limiter import get_rate_limiter
+from modules.executors import latency_summary
+
+MOCK_URL = "http://127.0.0.1:8089/api/v1/services/aigc/text-generation/generation"
+
+# profile -> (权重, 提示词模板)
+WORKLOAD = {
+    "whether_reply": (50, "判断是否需要回复这条消息，只回复YES或NO：消息 {i}"),
+    "auto_reply": (10, "根据以下聊天记录生成回复：\n[10:00] 小明: 今天第 {i} 次开会在哪？"),
+    "summarize": (20, "请阅读以下文本，并用Chinese生成一份精炼的摘要总结，提取核心信息：\n\n" + "会议纪要第 {i} 段。" * 50),
+    "translate": (20, "Translate the following text to Chinese. Only output the translated text without explanations:\n\nline {i}"),
+}
+
+
+def run(args):
+    client = LLMClient(api_url=args.url)
+    rng = random.Random(args.seed)
+    profiles = list(WORKLOAD)
+    weights = [WORKLOAD[p][0] for p in profiles]
+    jobs = [(rng.choices(profiles, weights)[0], i) for i in range(args.requests)]
+
+    latencies = {}
+    failures = {}
+    lock = threading.Lock()
+
+    def one(job):
+        profile, i = job
+        prompt = WORKLOAD[profile][1].format(i=i)
+        start = time.time()
+        try:
+            client.generate(prompt, profile=profile, fresh=not args.use_cache)
+            ok = True
+        except Exception as e:
+            ok = False
+            if args.verbose:
+                print(f"[Bench] {profile} 失败: {e}")
+        with lock:
+            if ok:
+                latencies.setdefault(profile, []).append(time.time() - start)
+            else:
+                failures[profile] = failures.get(profile, 0) + 1
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(one, jobs))
+    elapsed = time.time() - start
+
+    done = sum(len(v) for v in latencies.values())
+    report = {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(done / elapsed, 2) if elapsed else 0.0,
+        "failures": failures,
+        "latency": {p: latency_summary(v) for p, v in latencies.items()},
+        "client": client.stats(),
+        "limiter": get_rate_limiter().stats(),
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="大模型调用链路压测")
+    parser.add_argument("--url", default=os.getenv("DASHSCOPE_API_URL", MOCK_URL), help="文本生成接口地址")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--use-cache", action="store_true", help="允许命中响应缓存 (默认每次都请求接口)")
+    parser.add_argument("--verbose", action="store_true")
+    run(parser.parse_args())
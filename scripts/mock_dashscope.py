@@ -0,0 +1,220 @@
+# scripts/mock_dashscope.py
+"""
+离线的百炼 (DashScope) 文本生成接口替身，用于回归测试和压测，不需要联网也不产生费用
+
+与真实接口使用相同的请求/响应格式 (POST /api/v1/services/aigc/text-generation/generation)，
+支持 X-DashScope-SSE 流式输出 (incremental_output)。输出由提示词的哈希决定，同一提示词每次返回相同内容：
+
+- whether_reply (max_tokens <= 10)：按 --yes-rate 的比例返回 YES，其余返回 NO
+- whether_reply 批量判断：逐条返回 {"1": "NO", ...}
+- 要求输出 JSON 列表的提示词 (重要消息提醒)：返回 []
+- 翻译提示词：返回 "[MOCK] " + 原文
+- 其他：返回固定格式的模拟文本，长度由 --output-tokens 决定
+- --canned 指定的 JSON 文件 ([{"contains": "...", "text": "..."}]) 优先匹配
+
+延迟和错误注入:
+    --latency fixed:0.5 | uniform:0.2,1.5 | normal:0.8,0.2 | lognormal:-0.5,0.4  (秒)
+    --chunk-delay 0.05        流式输出每个片段之间的间隔
+    --error-rate 0.02         返回 500
+    --throttle-rate 0.05      返回 429 (带 Retry-After)
+    --hang-rate 0.01          挂起 --hang-seconds 秒后再返回，用于触发客户端超时
+
+用法:
+    python scripts/mock_dashscope.py --port 8089 --latency lognormal:-0.5,0.4 --throttle-rate 0.05
+    然后设置 DASHSCOPE_API_URL=http://127.0.0.1:8089/api/v1/services/aigc/text-generation/generation
+    运行统计: GET /mock/stats
+"""
+import re
+import json
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+import threading
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+API_PATH = "/api/v1/services/aigc/text-generation/generation"
+
+_CJK_PATTERN = re.compile("[\u3000-\u303F\u3040-\u30FF\u3400-\u4DBF\u4E00-\u9FFF\uAC00-\uD7AF\uFF00-\uFFEF]")
+_FILLER = "这是一段用于压测的模拟输出。"
+
+
+def count_tokens(text):
+    """与 modules/token_counter.estimate_tokens 的估算方式一致"""
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def parse_latency(spec):
+    """把 "分布:参数" 解析为返回随机延迟 (秒) 的函数"""
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",") if v]
+    if kind == "fixed":
+        return lambda rng: values[0] if values else 0.0
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "normal":
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(values[0], values[1])
+    raise ValueError(f"未知的延迟分布: {spec}")
+
+
+class MockBackend:
+    def __init__(self, args):
+        self.args = args
+        self.latency = parse_latency(args.latency)
+        self.rng = random.Random(args.seed)
+        self.rng_lock = threading.Lock()
+        self.canned = []
+        if args.canned:
+            with open(args.canned, "r", encoding="utf-8") as f:
+                self.canned = json.load(f)
+        self.counts = {"requests": 0, "stream_requests": 0, "ok": 0, "errors": 0, "throttled": 0, "hung": 0,
+                       "input_tokens": 0, "output_tokens": 0}
+
+    def draw(self):
+        """一次请求的随机量 (延迟与注入的故障)，由 --seed 决定，便于复现"""
+        with self.rng_lock:
+            delay = self.latency(self.rng)
+            roll = self.rng.random()
+        a = self.args
+        if roll < a.error_rate:
+            fault = "error"
+        elif roll < a.error_rate + a.throttle_rate:
+            fault = "throttle"
+        elif roll < a.error_rate + a.throttle_rate + a.hang_rate:
+            fault = "hang"
+        else:
+            fault = None
+        return delay, fault
+
+    def output_for(self, prompt, max_tokens):
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        for entry in self.canned:
+            if entry.get("contains", "") in prompt:
+                return entry["text"]
+        if max_tokens <= 10:
+            return "YES" if int(digest[:8], 16) / 0xFFFFFFFF < self.args.yes_rate else "NO"
+        if "键为消息编号" in prompt:
+            # whether_reply 批量判断 (modules/msg/reply_batcher.py)：逐条按哈希给出 YES/NO
+            count = len(re.findall(r"【消息 \d+】", prompt))
+            answers = {}
+            for i in range(1, count + 1):
+                item_digest = hashlib.sha256(f"{digest}:{i}".encode("utf-8")).hexdigest()
+                answers[str(i)] = "YES" if int(item_digest[:8], 16) / 0xFFFFFFFF < self.args.yes_rate else "NO"
+            return json.dumps(answers)
+        if "JSON 列表" in prompt:
+            return "[]"
+        if prompt.startswith("Translate the following text"):
+            return "[MOCK] " + prompt.split("\n\n", 1)[-1]
+        length = min(max_tokens, self.args.output_tokens)
+        text = f"[MOCK {digest[:8]}] "
+        while count_tokens(text) < length:
+            text += _FILLER
+        return text
+
+    def usage(self, prompt, text):
+        usage = {"input_tokens": count_tokens(prompt), "output_tokens": count_tokens(text)}
+        usage["total_tokens"] = usage["input_tokens"] + usage["output_tokens"]
+        self.counts["input_tokens"] += usage["input_tokens"]
+        self.counts["output_tokens"] += usage["output_tokens"]
+        return usage
+
+
+def create_app(args):
+    app = FastAPI(title="Mock DashScope")
+    backend = MockBackend(args)
+    counts = backend.counts
+
+    @app.post(API_PATH)
+    async def generation(request: Request):
+        body = await request.json()
+        messages = (body.get("input") or {}).get("messages") or []
+        prompt = "\n".join(m.get("content", "") for m in messages)
+        parameters = body.get("parameters") or {}
+        max_tokens = int(parameters.get("max_tokens", 2000))
+        stream = request.headers.get("X-DashScope-SSE") == "enable"
+        request_id = hashlib.md5(f"{time.time()}{prompt}".encode("utf-8")).hexdigest()
+
+        counts["requests"] += 1
+        if stream:
+            counts["stream_requests"] += 1
+        delay, fault = backend.draw()
+        await asyncio.sleep(delay)
+
+        if fault == "hang":
+            counts["hung"] += 1
+            await asyncio.sleep(args.hang_seconds)
+        elif fault == "error":
+            counts["errors"] += 1
+            return JSONResponse({"code": "InternalError", "message": "mock injected error", "request_id": request_id},
+                                status_code=500)
+        elif fault == "throttle":
+            counts["throttled"] += 1
+            return JSONResponse({"code": "Throttling.RateQuota", "message": "mock injected throttling",
+                                 "request_id": request_id},
+                                status_code=429, headers={"Retry-After": str(args.retry_after)})
+
+        text = backend.output_for(prompt, max_tokens)
+        usage = backend.usage(prompt, text)
+        counts["ok"] += 1
+
+        if not stream:
+            return {"output": {"text": text, "finish_reason": "stop"}, "usage": usage, "request_id": request_id}
+
+        incremental = parameters.get("incremental_output", False)
+        size = max(1, args.chunk_chars)
+        pieces = [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+        async def events():
+            sent = ""
+            for i, piece in enumerate(pieces):
+                if i:
+                    await asyncio.sleep(args.chunk_delay)
+                sent += piece
+                last = i == len(pieces) - 1
+                event = {
+                    "output": {"text": piece if incremental else sent, "finish_reason": "stop" if last else "null"},
+                    "usage": usage,
+                    "request_id": request_id,
+                }
+                yield f"id:{i + 1}\nevent:result\n:HTTP_STATUS/200\ndata:{json.dumps(event, ensure_ascii=False)}\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/mock/stats")
+    async def stats():
+        return dict(counts)
+
+    return app
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="离线的百炼文本生成接口替身")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--seed", type=int, default=0, help="随机种子 (延迟与故障注入)")
+    parser.add_argument("--latency", default="fixed:0.3", help="fixed:s | uniform:a,b | normal:mu,sigma | lognormal:mu,sigma")
+    parser.add_argument("--chunk-delay", type=float, default=0.05, help="流式片段间隔 (秒)")
+    parser.add_argument("--chunk-chars", type=int, default=8, help="流式每个片段的字符数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 500 的比例")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="返回 429 的比例")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="429 响应的 Retry-After (秒)")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="挂起的比例")
+    parser.add_argument("--hang-seconds", type=float, default=120.0)
+    parser.add_argument("--yes-rate", type=float, default=0.2, help="whether_reply 返回 YES 的比例")
+    parser.add_argument("--output-tokens", type=int, default=200, help="普通提示词的输出长度 (token)")
+    parser.add_argument("--canned", default=None, help="固定输出的 JSON 文件")
+    return parser
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    cli_args = build_parser().parse_args()
+    print(f"[MockDashScope] http://{cli_args.host}:{cli_args.port}{API_PATH}")
+    uvicorn.run(create_app(cli_args), host=cli_args.host, port=cli_args.port, log_level="warning")
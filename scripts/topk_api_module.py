@@ -1,5 +1,10 @@
 # topk_api_module.py
-from .vector_db_manager import VectorDBManager
+import config
+from .vector_db_manager import get_vector_db
+
+# 自动回复检索用的向量库和嵌入模型 (进程内共享，只在首次使用或服务启动预热时加载)
+VECTOR_DB_PATH = getattr(config, "AUTO_REPLY_VECTOR_DB_PATH", "data/chat_vector_db")
+EMBEDDING_MODEL = getattr(config, "VECTOR_DB_EMBEDDING_MODEL", "models/embedding/m3e-small")
 
 def search_messages_api(contact_name, query, k=20, n=1):
     """
@@ -15,8 +20,8 @@ def search_messages_api(contact_name, query, k=20, n=1):
         dict: 包含检索结果的字典
     """
     try:
-        # 初始化向量数据库管理器
-        db_manager = VectorDBManager()
+        # 获取共享的向量数据库管理器 (不再每次请求重新加载模型和索引)
+        db_manager = get_vector_db(VECTOR_DB_PATH, EMBEDDING_MODEL)
         
         # 执行检索
         results = db_manager.search_by_contact(contact_name, query, k)
@@ -1,12 +1,84 @@
 # vector_db_manager.py
 # 供topk_api_module.py调：加载指定向量数据库，根据关键词返回特定对象的聊天记录topk
+# 嵌入模型和向量库在进程内共享 (get_embedding_model / get_vector_db)，同一模型、同一路径只加载一次
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_community.vectorstores import FAISS
 import json
 import os
+import time
+import threading
+
+DEFAULT_MODEL_NAME = "models/embedding/m3e-small"
+
+_embedding_models = {}   # model_name -> HuggingFaceEmbeddings
+_vector_dbs = {}         # (绝对路径, model_name) -> VectorDBManager
+_load_seconds = {}       # 各模型/向量库的加载耗时，供统计接口使用
+_load_locks = {}
+_registry_lock = threading.Lock()
+
+
+def _load_lock(key):
+    """每个模型/向量库一把加载锁：并发的首次请求只加载一次，不同对象的加载互不阻塞"""
+    with _registry_lock:
+        return _load_locks.setdefault(key, threading.Lock())
+
+
+def get_embedding_model(model_name=DEFAULT_MODEL_NAME):
+    """进程内共享的嵌入模型，首次使用时加载"""
+    model = _embedding_models.get(model_name)
+    if model is not None:
+        return model
+    with _load_lock(("embedding", model_name)):
+        model = _embedding_models.get(model_name)
+        if model is None:
+            start = time.time()
+            model = HuggingFaceEmbeddings(model_name=model_name)
+            _embedding_models[model_name] = model
+            _load_seconds[f"embedding:{model_name}"] = round(time.time() - start, 2)
+            print(f"[VectorDB] 已加载嵌入模型: {model_name} ({time.time() - start:.1f}s)")
+    return model
+
+
+def get_vector_db(db_path="data/chat_vector_db", model_name=DEFAULT_MODEL_NAME):
+    """
+    进程内共享的 VectorDBManager，首次使用时加载；加载失败抛出 RuntimeError，下次调用会重试
+    """
+    key = (os.path.abspath(db_path), model_name)
+    db_manager = _vector_dbs.get(key)
+    if db_manager is not None:
+        return db_manager
+    with _load_lock(("db",) + key):
+        db_manager = _vector_dbs.get(key)
+        if db_manager is None:
+            start = time.time()
+            db_manager = VectorDBManager(db_path=db_path, model_name=model_name)
+            _vector_dbs[key] = db_manager
+            _load_seconds[f"db:{key[0]}"] = round(time.time() - start, 2)
+            print(f"[VectorDB] 已加载向量数据库: {db_path} ({time.time() - start:.1f}s)")
+    return db_manager
+
+
+def warm_up_vector_db(db_path="data/chat_vector_db", model_name=DEFAULT_MODEL_NAME):
+    """服务启动时预先加载向量库并跑一次检索，避免第一条自动回复承担加载耗时"""
+    try:
+        get_vector_db(db_path, model_name).search_by_contact(None, "预热", k=1)
+        return True
+    except Exception as e:
+        print(f"[VectorDB] 预热失败 {db_path}: {e}")
+        return False
+
+
+def get_vector_db_stats():
+    """已加载的嵌入模型、向量库及其加载耗时"""
+    return {
+        "embedding_models": list(_embedding_models),
+        "databases": [path for path, _ in _vector_dbs],
+        "load_seconds": dict(_load_seconds),
+    }
+
 
 class VectorDBManager:
-    def __init__(self, db_path="data/chat_vector_db", model_name="models/embedding/m3e-small"):
+    def __init__(self, db_path="data/chat_vector_db", model_name=DEFAULT_MODEL_NAME):
         """
         初始化向量数据库管理器
 
@@ -18,12 +90,15 @@ class VectorDBManager:
         self.model_name = model_name
         self.embedding_model = None
         self.vector_db = None
+        # 聊天记录 JSON 缓存: json_path -> (mtime, messages, {id: index})，文件变化后重新读取
+        self._messages_cache = {}
+        self._messages_lock = threading.Lock()
         self._load_vector_database()
 
     def _load_vector_database(self):
         """加载向量数据库"""
         try:
-            self.embedding_model = HuggingFaceEmbeddings(model_name=self.model_name)
+            self.embedding_model = get_embedding_model(self.model_name)
             self.vector_db = FAISS.load_local(
                 self.db_path,
                 self.embedding_model,
@@ -92,16 +167,10 @@ class VectorDBManager:
             if not os.path.exists(json_path):
                 raise FileNotFoundError(f"找不到联系人 {contact_name} 的聊天记录文件")
 
-            with open(json_path, 'r', encoding='utf-8') as f:
-                messages = json.load(f)
+            messages, index_by_id = self._load_messages(json_path)
 
             # 找到指定ID的消息索引
-            target_index = -1
-            for idx, msg in enumerate(messages):
-                if msg.get('id') == message_id:
-                    target_index = idx
-                    break
-
+            target_index = index_by_id.get(message_id, -1)
             if target_index == -1:
                 return []
 
@@ -111,12 +180,31 @@ class VectorDBManager:
         except Exception as e:
             raise RuntimeError(f"获取后续消息失败: {e}")
 
+    def _load_messages(self, json_path):
+        """读取聊天记录 JSON 并建立 id 索引，文件未修改时直接使用缓存"""
+        mtime = os.path.getmtime(json_path)
+        cached = self._messages_cache.get(json_path)
+        if cached and cached[0] == mtime:
+            return cached[1], cached[2]
+        with self._messages_lock:
+            cached = self._messages_cache.get(json_path)
+            if cached and cached[0] == mtime:
+                return cached[1], cached[2]
+            with open(json_path, 'r', encoding='utf-8') as f:
+                messages = json.load(f)
+            index_by_id = {}
+            for idx, msg in enumerate(messages):
+                # 与原来的线性查找一致：同一 ID 取第一条
+                index_by_id.setdefault(msg.get('id'), idx)
+            self._messages_cache[json_path] = (mtime, messages, index_by_id)
+            return messages, index_by_id
+
 
 class MultiVectorDBManager:
     """
     多向量数据库管理器，支持动态切换数据库
     """
-    def __init__(self, model_name="models/embedding/m3e-small"):
+    def __init__(self, model_name=DEFAULT_MODEL_NAME):
         self.model_name = model_name
         self.databases = {}  # 存储已加载的数据库实例
         self.current_db = None  # 当前使用的数据库
@@ -134,7 +222,8 @@ class MultiVectorDBManager:
         """
         if db_path not in self.databases:
             try:
-                db_manager = VectorDBManager(db_path=db_path, model_name=self.model_name)
+                # 与自动回复等其他调用方共用同一份已加载的向量库
+                db_manager = get_vector_db(db_path, self.model_name)
                 self.databases[db_path] = db_manager
                 print(f"[VectorDB] 成功加载数据库: {db_path}")
             except Exception as e:
@@ -1,29 +1,41 @@
 # server.py
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request, Query
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import shutil
 import os
-import subprocess
 import time
+import asyncio
+import subprocess
 from typing import List
 import shutil
 import json
 
 import config
 
+from modules.executors import run_blocking, executor_stats, shutdown_executors
 from modules.msg.notifier import extract_important_messages
-from scripts.vector_db_manager import MultiVectorDBManager
-from modules.msg.doc_processor import extract_text_from_file, save_text_to_docx
-from modules.msg.msg_handler import save_incoming_message, get_recent_messages, get_contact_list, get_recent_files, get_all_files, get_all_images
-from modules.msg.auto_reply import auto_reply  # 导入自动回复模块
+from scripts.vector_db_manager import MultiVectorDBManager, warm_up_vector_db, get_vector_db_stats
+from modules.msg.doc_processor import extract_text_from_file, save_text_to_docx, get_extraction_cache
+from modules.msg.msg_handler import save_incoming_message, get_recent_messages, get_contact_list, get_recent_files, get_all_files, get_all_images, get_full_history, flush_contact_manifest, count_media
+from modules.msg.msg_handler import start_ingest_workers, get_ingest_stats, get_recent_cache_stats
+from modules.msg.auto_reply import auto_reply, get_speculation_stats  # 导入自动回复模块
 from modules.msg.translator import BailianTranslator as msg_trans
+from modules.msg.reply_coalescer import get_reply_coalescer
+from modules.msg.reply_gate import get_reply_gate
+from modules.msg.reply_batcher import get_reply_batcher
 from modules.msg.reply_settings import get_reply_setting, set_reply_setting, get_all_reply_settings
+from modules.msg.summarizer import summarize_history, build_summary_prompt
+from modules.msg.rolling_summary import rolling_summarize, plan_summary
 
-from modules.comic_translator.utils.paddle_ocr import image_to_base64, ocr_image
+from modules.comic_translator.utils.paddle_ocr import ocr_image
+from modules.comic_translator.utils.ocr_cache import get_ocr_cache
 from modules.comic_translator.utils.translator3 import BailianTranslator as img_trans
 from modules.comic_translator.utils.cv_inpaint import process_image_with_ocr_data
+from modules.llm_client import get_llm_client
+from modules.llm_cache import get_llm_cache
+from modules.llm_limiter import get_rate_limiter, LLMOverloadedError
 
 # 全局状态
 db_manager = None
@@ -55,8 +67,8 @@ async def lifespan(app: FastAPI):
             text=True
         )
 
-        # 增加等待时间，确保服务完全启动
-        time.sleep(10)
+        # 增加等待时间，确保服务完全启动 (不阻塞事件循环)
+        await asyncio.sleep(10)
 
         # 检查服务是否正常启动
         if ocr_process.poll() is None:
@@ -74,9 +86,9 @@ async def lifespan(app: FastAPI):
     # 2. 加载多向量数据库管理器
     print(f"[System] 正在初始化多向量数据库管理器")
     try:
-        multi_db_manager = MultiVectorDBManager(model_name="models/embedding/m3e-small")
+        multi_db_manager = MultiVectorDBManager(model_name=config.VECTOR_DB_EMBEDDING_MODEL)
         # 加载默认向量数据库
-        success = multi_db_manager.switch_database(config.VECTOR_DB_PATH)
+        success = await run_blocking("cpu", multi_db_manager.switch_database, config.VECTOR_DB_PATH)
         if success:
             print("[System] 默认向量数据库加载完毕")
         else:
@@ -84,9 +96,22 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         print(f"[System] ⚠️ 多向量数据库管理器初始化失败: {e}")
 
+    # 预热自动回复检索用的向量库 (与上面的默认库相同时直接复用)，避免第一条自动回复加载模型
+    if getattr(config, "VECTOR_DB_WARMUP", True):
+        if await run_blocking("cpu", warm_up_vector_db, config.AUTO_REPLY_VECTOR_DB_PATH,
+                              config.VECTOR_DB_EMBEDDING_MODEL):
+            print("[System] 自动回复向量库预热完毕")
+
+    # 3. 启动后台入库任务 (OCR / 文件提取)，并恢复上次未完成的任务
+    start_ingest_workers()
+
     yield
 
-    # 3. 关闭OCR服务
+    # 把尚未落盘的联系人清单写回磁盘，并关闭各子系统线程池
+    flush_contact_manifest()
+    shutdown_executors()
+
+    # 4. 关闭OCR服务
     if ocr_process and ocr_process.poll() is None:
         print("[System] 正在关闭OCR服务...")
         try:
@@ -114,6 +139,42 @@ app.add_middleware(
 os.makedirs(config.TEMP_DIR, exist_ok=True)
 
 
+# 翻译器在进程内复用，底层共用同一个大模型客户端 (连接池)
+doc_translator = msg_trans(config.DASHSCOPE_API_KEY)
+image_translator = img_trans(config.DASHSCOPE_API_KEY)
+
+
+def _sse_response(chunks, meta=None):
+    """
+    把异步文本片段包装成 SSE 响应：
+      data: {"delta": "..."}          每个片段一条
+      event: done / data: {...}       结束，附带 meta
+      event: error / data: {"error"}  出错
+    """
+    async def events():
+        try:
+            async for chunk in chunks:
+                yield f"data: {json.dumps({'delta': chunk}, ensure_ascii=False)}\n\n"
+            yield f"event: done\ndata: {json.dumps(meta or {}, ensure_ascii=False)}\n\n"
+        except Exception as e:
+            print(f"[Stream] 流式输出出错: {e}")
+            # overloaded: 被全局限流拒绝 (排队已满或超时)，前端可提示稍后重试
+            error = {"error": str(e), "overloaded": isinstance(e, LLMOverloadedError)}
+            yield f"event: error\ndata: {json.dumps(error, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _dump_json(data, path):
+    """把数据写成 JSON 文件 (在 disk 线程池中执行)"""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
 # ===============================
 # 功能：获取聊天对象列表
 # ===============================
@@ -124,7 +185,7 @@ async def list_chats(type_filter: str = None):
     type_filter: 可选 "group" 或 "private"，不传则返回所有
     """
     try:
-        all_contacts = get_contact_list()
+        all_contacts = await run_blocking("disk", get_contact_list)
         
         # 筛选逻辑
         if type_filter:
@@ -139,19 +200,24 @@ async def list_chats(type_filter: str = None):
 # 功能：获取特定聊天的所有文件
 # ===============================
 @app.get("/api/doc/list")
-async def list_chat_files(contact_id: str):
+async def list_chat_files(contact_id: str, since: str = None, offset: int = 0, limit: int = 0):
     """
     获取指定会话中的所有文件列表
     前端调用此接口展示文件 -> 用户选择 -> 调用 /api/doc/translate
+    since: 可选，只返回该时间之后的文件，如 "2025-12-01"
+    offset / limit: 可选分页参数，limit 为 0 时返回全部
     """
     try:
         # 调用 handler 获取文件列表
-        files = get_all_files(contact_id)
+        files = await run_blocking("disk", get_all_files, contact_id, since=since, offset=offset, limit=limit)
         
         return {
             "success": True, 
             "contact_id": contact_id,
             "count": len(files),
+            "total": await run_blocking("disk", count_media, contact_id, "file", since=since),
+            "offset": offset,
+            "limit": limit,
             "data": files
         }
     except Exception as e:
@@ -162,18 +228,23 @@ async def list_chat_files(contact_id: str):
 # 功能：获取特定聊天的所有图片
 # ===============================
 @app.get("/api/image/list")
-async def list_chat_images(contact_id: str):
+async def list_chat_images(contact_id: str, since: str = None, offset: int = 0, limit: int = 0):
     """
     获取指定会话中的所有图片列表
     前端调用此接口展示图片缩略图 -> 用户选择 -> 调用 /api/image/translate
+    since: 可选，只返回该时间之后的图片，如 "2025-12-01"
+    offset / limit: 可选分页参数，limit 为 0 时返回全部
     """
     try:
-        images = get_all_images(contact_id)
+        images = await run_blocking("disk", get_all_images, contact_id, since=since, offset=offset, limit=limit)
         
         return {
             "success": True, 
             "contact_id": contact_id,
             "count": len(images),
+            "total": await run_blocking("disk", count_media, contact_id, "image", since=since),
+            "offset": offset,
+            "limit": limit,
             "data": images
         }
     except Exception as e:
@@ -190,58 +261,67 @@ async def save_msg(request: Request):
     """
     try:
         data = await request.json()
-        # 调用 msg_handler 中的保存逻辑
-        save_result = save_incoming_message(data)
 
         # 提取自动回复所需的参数
         msg_type = data.get("message_type")  # group / private
         contact_id = str(data.get("group_id")) if msg_type == "group" else str(data.get("user_id"))
+        current_message = data.get("raw_message", "")
+
+        # 检查是否被 @ 了，如果是则直接回复，跳过 whether_reply 判断
+        is_at_me = data.get("is_at", False)
+
+        # 如果 is_at 字段不存在或为 False，检查消息内容中是否包含机器人名称
+        if not is_at_me:
+            bot_name = getattr(config, 'BOT_NAME', '耄仙人')  # 获取配置中的机器人名称
+            # 检查原始消息中是否包含机器人名称
+            if bot_name in current_message:
+                is_at_me = True
+            # 也检查是否是直接称呼机器人名字的消息
+            elif current_message.strip().replace(" ", "").startswith(bot_name.replace(" ", "")):
+                is_at_me = True
+
+        coalescer = get_reply_coalescer()
+        if is_at_me:
+            # @ 回复会取代该聊天中尚未完成的普通回复决策
+            coalescer.supersede(contact_id)
+            # @ 消息整条链路 (保存 -> 读历史 -> 生成回复) 都走高优先级通道；
+            # 保存不受时间预算约束 (超时取消不能让消息丢失)，读历史和生成回复使用剩余的预算
+            started_at = time.time()
+            save_result = await run_blocking("reply_high", save_incoming_message, data)
+            budget = getattr(config, "MENTION_REPLY_BUDGET", 8.0) - (time.time() - started_at)
+            try:
+                return await asyncio.wait_for(
+                    _mention_reply(save_result, contact_id, current_message, msg_type),
+                    timeout=max(budget, 0.1),
+                )
+            except asyncio.TimeoutError:
+                print(f"[System] 聊天 {contact_id} 的 @ 回复超出时间预算，本次不回复")
+                return {"status": "success", "detail": save_result, "reply": ""}
+
+        # 调用 msg_handler 中的保存逻辑
+        save_result = await run_blocking("disk", save_incoming_message, data)
 
         # 检查是否启用自动回复（检查特定聊天的设置，如果没有则使用全局设置）
-        if get_reply_setting(contact_id):
-            print(f"[System] 聊天 {contact_id} 自动回复已启用，正在生成回复...")
-
-            current_message = data.get("raw_message", "")
-
-            # 检查是否被 @ 了，如果是则直接回复，跳过 whether_reply 判断
-            is_at_me = data.get("is_at", False)
-
-            # 如果 is_at 字段不存在或为 False，检查消息内容中是否包含机器人名称
-            if not is_at_me:
-                bot_name = getattr(config, 'BOT_NAME', '耄仙人')  # 获取配置中的机器人名称
-                # 检查原始消息中是否包含机器人名称
-                if bot_name in current_message:
-                    is_at_me = True
-                # 也检查是否是直接称呼机器人名字的消息
-                elif current_message.strip().replace(" ", "").startswith(bot_name.replace(" ", "")):
-                    is_at_me = True
-
-            # 获取当前消息及其前50条消息
-            recent_messages = get_recent_messages(contact_id, limit=50, include_media=True)
-
-            # 如果是被 @ 的消息，则直接回复，跳过 whether_reply 判断
-            if is_at_me:
-                print("[System] 消息包含@，直接生成回复...")
-                print(f"[Debug] 查询到的聊天数据: {recent_messages[:500]}...")  # 打印前500个字符用于调试
-                # 调用自动回复模块，传入聊天历史，并设置 force_reply=True 跳过 whether_reply 判断
-                reply_result = auto_reply(contact_id, current_message, msg_type, recent_messages, force_reply=True)
-
-                # 如果有回复内容，则返回
-                if reply_result.get("reply_content"):
-                    reply_content = reply_result.get("reply_content", "")
-                    print(f"[AutoReply] @触发回复: {reply_content}")
-                    return {"status": "success", "detail": save_result, "reply": reply_content}
-            else:
+        if await run_blocking("disk", get_reply_setting, contact_id):
+            async def evaluate():
+                print(f"[System] 聊天 {contact_id} 自动回复已启用，正在生成回复...")
+
+                # 获取当前消息及其前50条消息 (合并窗口结束后读取，包含窗口内的全部消息)
+                recent_messages = await run_blocking("disk", get_recent_messages, contact_id, limit=50, include_media=True, purpose="auto_reply")
+
                 # 没有被 @，按正常流程走 whether_reply 判断
                 print(f"[Debug] 查询到的聊天数据: {recent_messages[:500]}...")  # 打印前500个字符用于调试
                 # 调用自动回复模块，传入聊天历史
-                reply_result = auto_reply(contact_id, current_message, msg_type, recent_messages)
+                return await run_blocking("llm", auto_reply, contact_id, current_message, msg_type, recent_messages)
 
-                # 如果需要回复，则返回回复内容
-                if reply_result.get("should_reply", False):
-                    reply_content = reply_result.get("reply_content", "")
-                    print(f"[AutoReply] 生成回复: {reply_content}")
-                    return {"status": "success", "detail": save_result, "reply": reply_content}
+            # 短时间内连续到达的消息只对最新一条做一次判断
+            reply_result = await coalescer.decide(contact_id, evaluate)
+
+            # 如果需要回复，则返回回复内容
+            if reply_result and reply_result.get("should_reply", False):
+                reply_content = reply_result.get("reply_content", "")
+                print(f"[AutoReply] 生成回复: {reply_content}")
+                return {"status": "success", "detail": save_result, "reply": reply_content}
 
         # 默认不回复或自动回复未启用
         return {"status": "success", "detail": save_result, "reply": ""}
@@ -251,6 +331,29 @@ async def save_msg(request: Request):
         return {"status": "error", "msg": str(e)}
 
 
+async def _mention_reply(save_result, contact_id, current_message, msg_type):
+    """
+    被 @ 时的处理流程 (消息已保存)，全部在 reply_high 通道中执行，不和普通消息、后台任务排队
+    """
+    if not await run_blocking("reply_high", get_reply_setting, contact_id):
+        return {"status": "success", "detail": save_result, "reply": ""}
+
+    print(f"[System] 聊天 {contact_id} 自动回复已启用，正在生成回复...")
+    recent_messages = await run_blocking("reply_high", get_recent_messages, contact_id, limit=50, include_media=True, purpose="auto_reply")
+
+    # 如果是被 @ 的消息，则直接回复，跳过 whether_reply 判断
+    print("[System] 消息包含@，直接生成回复...")
+    print(f"[Debug] 查询到的聊天数据: {recent_messages[:500]}...")  # 打印前500个字符用于调试
+    # 调用自动回复模块，传入聊天历史，并设置 force_reply=True 跳过 whether_reply 判断
+    reply_result = await run_blocking("reply_high", auto_reply, contact_id, current_message, msg_type, recent_messages, force_reply=True)
+
+    # 如果有回复内容，则返回
+    reply_content = reply_result.get("reply_content") or ""
+    if reply_content:
+        print(f"[AutoReply] @触发回复: {reply_content}")
+    return {"status": "success", "detail": save_result, "reply": reply_content}
+
+
 # ===============================
 # 功能2：查找聊天记录
 # ===============================
@@ -263,7 +366,7 @@ async def search_chat(contact: str, query: str, k: int = 10):
         return {"results": [{"content": "错误：数据库未加载"}]}
     try:
         # 调用 multi vector_db_manager 的搜索
-        results = multi_db_manager.search_by_contact(contact, query, k)
+        results = await run_blocking("cpu", multi_db_manager.search_by_contact, contact, query, k)
 
         # 最普通的返回
         data = [{"content": r.page_content, "metadata": r.metadata} for r in results]
@@ -276,45 +379,53 @@ async def search_chat(contact: str, query: str, k: int = 10):
 # ===============================
 # API 3.1: 多文档总结 (Summarize Recent Files)
 # ===============================
+async def _build_doc_summary_prompt(contact_id: str, limit: int, target_lang: str):
+    """读取最近的文件并拼接总结 Prompt，没有文件时返回 (None, [])"""
+    # 1. 获取最近的文件列表
+    files = await run_blocking("disk", get_recent_files, contact_id, limit)
+    
+    if not files:
+        return None, []
+
+    # 2. 拼接所有文件的内容
+    combined_text = ""
+    file_names = []
+
+    for f in files:
+        file_names.append(f['name'])
+        # 每次都重新读取文件，忽略历史记录中的 extracted_content
+        print(f"[Doc] 正在实时读取文件: {f['path']}")
+        content = await run_blocking("cpu", extract_text_from_file, f['path'], max_chars=2000)
+
+        combined_text += f"\n\n=== 文件名: {f['name']} (发送时间: {f['time']}) ===\n{content}"
+
+    # 3. 构建 Prompt
+    prompt = (
+        f"以下是用户最近发送的 {len(files)} 个文件的内容片段。\n"
+        f"请用{target_lang}对这些文件进行综合总结，指出它们之间的关联（如果有），"
+        f"并提取每个文件的核心要点。\n\n"
+        f"{combined_text}"
+    )
+    return prompt, file_names
+
+
 @app.post("/api/doc/summarize")
 async def summarize_docs(
     contact_id: str = Form(...), # 群号/用户ID
     limit: int = Form(5),        # 总结最近几个文件
-    target_lang: str = Form("Chinese")
+    target_lang: str = Form("Chinese"),
+    fresh: bool = Form(False)    # 为 True 时跳过响应缓存，重新生成
 ):
     try:
-        # 1. 获取最近的文件列表
-        files = get_recent_files(contact_id, limit)
-        
-        if not files:
+        prompt, file_names = await _build_doc_summary_prompt(contact_id, limit, target_lang)
+        if prompt is None:
             return {"success": False, "summary": "该对话最近没有发送过文件。"}
 
-        # 2. 拼接所有文件的内容
-        combined_text = ""
-        file_names = []
-
-        for f in files:
-            file_names.append(f['name'])
-            # 每次都重新读取文件，忽略历史记录中的 extracted_content
-            print(f"[Doc] 正在实时读取文件: {f['path']}")
-            content = extract_text_from_file(f['path'], max_chars=2000)
-
-            combined_text += f"\n\n=== 文件名: {f['name']} (发送时间: {f['time']}) ===\n{content}"
-
-        # 3. 构建 Prompt
-        prompt = (
-            f"以下是用户最近发送的 {len(files)} 个文件的内容片段。\n"
-            f"请用{target_lang}对这些文件进行综合总结，指出它们之间的关联（如果有），"
-            f"并提取每个文件的核心要点。\n\n"
-            f"{combined_text}"
-        )
-
         # 4. 调用 AI
-        import time
-        translator = msg_trans(config.DASHSCOPE_API_KEY)
+        translator = doc_translator
         print(f"[Doc] 正在发送给AI的提示词:\n{prompt[:500]}...")  # 只示前500个字符
         start_time = time.time()
-        summary = translator._call_api(prompt, mode="custom") # 使用 custom 模式透传 prompt
+        summary = await run_blocking("llm", translator._call_api, prompt, mode="custom", fresh=fresh) # 使用 custom 模式透传 prompt
         end_time = time.time()
         print(f"[Doc] AI返回的摘要内容:\n{summary[:200]}...")  # 只示前200个字符
         print(f"[Doc] AI调用耗时: {end_time - start_time:.2f} 秒")
@@ -330,13 +441,36 @@ async def summarize_docs(
         return {"success": False, "error": str(e)}
 
 
+@app.post("/api/doc/summarize/stream")
+async def summarize_docs_stream(
+    contact_id: str = Form(...),
+    limit: int = Form(5),
+    target_lang: str = Form("Chinese"),
+    fresh: bool = Form(False)
+):
+    """
+    /api/doc/summarize 的流式版本 (SSE)：模型每生成一段就推送一段，结束事件附带 scanned_files
+    """
+    try:
+        prompt, file_names = await _build_doc_summary_prompt(contact_id, limit, target_lang)
+    except Exception as e:
+        print(f"文档总结出错: {e}")
+        return {"success": False, "error": str(e)}
+    if prompt is None:
+        return {"success": False, "summary": "该对话最近没有发送过文件。"}
+
+    chunks = doc_translator.stream_api(prompt, mode="custom", fresh=fresh)
+    return _sse_response(chunks, {"success": True, "scanned_files": file_names})
+
+
 # ===============================
 # API 3.2: 单文档翻译 (Translate & Download)
 # ===============================
 @app.post("/api/doc/translate")
 async def translate_doc(
     file_path: str = Form(...),
-    target_lang: str = Form("Chinese")
+    target_lang: str = Form("Chinese"),
+    fresh: bool = Form(False)          # 为 True 时跳过响应缓存，重新翻译
 ):
     try:
         print(f"[DocTranslate] 开始翻译文档，原始文件路径: {file_path}, 目标语言: {target_lang}")
@@ -356,7 +490,7 @@ async def translate_doc(
 
         print(f"[DocTranslate] 文件存在，开始读取内容...")
         # 1. 读取文件原文
-        original_text = extract_text_from_file(file_path, max_chars=5000)
+        original_text = await run_blocking("cpu", extract_text_from_file, file_path, max_chars=5000)
         print(f"[DocTranslate] 读取到的原文长度: {len(original_text) if original_text and not original_text.startswith('[') else 0}")
 
         if not original_text or original_text.startswith('['):
@@ -365,8 +499,8 @@ async def translate_doc(
 
         # 2. 调用 AI 进行翻译
         print(f"[DocTranslate] 开始调用AI进行翻译...")
-        translator = msg_trans(config.DASHSCOPE_API_KEY)
-        translated_text = translator._call_api(original_text, mode="translate", target_lang=target_lang)
+        translator = doc_translator
+        translated_text = await run_blocking("llm", translator._call_api, original_text, mode="translate", target_lang=target_lang, fresh=fresh)
         print(f"[DocTranslate] AI翻译完成，翻译后文本长度: {len(translated_text) if translated_text else 0}")
 
         # 3. 生成翻译后的 Word 文档
@@ -382,7 +516,7 @@ async def translate_doc(
         output_path = os.path.join(output_dir, output_filename)
         print(f"[DocTranslate] 输出路径: {output_path}")
 
-        save_text_to_docx(translated_text, output_path)
+        await run_blocking("disk", save_text_to_docx, translated_text, output_path)
         print(f"[DocTranslate] Word文档已保存: {output_path}")
 
         # 4. 返回文件流供前端下载
@@ -406,7 +540,8 @@ async def translate_doc(
 @app.post("/api/image/translate")
 async def translate_image(
     file_path: str = Form(...),      # 前端传来的原始图片绝对路径
-    target_lang: str = Form("Chinese") # 目标语言
+    target_lang: str = Form("Chinese"), # 目标语言
+    fresh: bool = Form(False)        # 为 True 时跳过响应缓存，重新翻译
 ):
     """
     接收本地图片路径，执行 OCR -> 翻译 -> 回填，返回处理后的图片文件
@@ -435,30 +570,29 @@ async def translate_image(
 
         # 2. OCR 识别
         print("[ImgTrans] 正在进行 OCR...")
-        base64_image = image_to_base64(file_path)
-        # 调用你提供的 ocr_image 函数 (注意：确保 PaddleOCR 服务已启动)
-        ocr_result = ocr_image(base64_image)
+        # 先查 OCR 缓存，未命中时调用 ocr_image (注意：确保 PaddleOCR 服务已启动)
+        ocr_result = await run_blocking("ocr", get_ocr_cache().ocr_file, file_path, ocr_image)
         
         # 保存 OCR 结果到临时 JSON (用于后续翻译和回填)
-        with open(ocr_json_path, "w", encoding="utf-8") as f:
-            json.dump(ocr_result, f, ensure_ascii=False, indent=2)
+        await run_blocking("disk", _dump_json, ocr_result, ocr_json_path)
 
         # 3. 文本翻译
         print("[ImgTrans] 正在翻译文本...")
         # 初始化你提供的翻译器
-        translator = img_trans(config.DASHSCOPE_API_KEY)
+        translator = image_translator
         # 调用翻译整个 JSON 文件的方法
-        translated_data = translator.translate_json_file(ocr_json_path, target_lang=target_lang)
+        translated_data = await run_blocking("llm", translator.translate_json_file, ocr_json_path, target_lang=target_lang, fresh=fresh)
         
         # 保存翻译后的 JSON
-        with open(translated_json_path, "w", encoding="utf-8") as f:
-            json.dump(translated_data, f, ensure_ascii=False, indent=2)
+        await run_blocking("disk", _dump_json, translated_data, translated_json_path)
 
         # 4. 图片回填 (擦除原文本并写入新文本)
         print("[ImgTrans] 正在进行图片回填...")
         # 调用你提供的回填函数
         # 注意：需要提供一个支持中文的字体路径，在 config.py 中配置 FONT_PATH
-        process_image_with_ocr_data(
+        await run_blocking(
+            "cpu",
+            process_image_with_ocr_data,
             file_path,             # 原图路径
             translated_json_path,  # 翻译后的 JSON 路径
             final_image_path,      # 输出图片路径
@@ -496,33 +630,72 @@ async def translate_image(
 async def summarize_chat_history(
     contact_id: str = Form(...),      # 前端用户点击列表项后，传回这里的 ID (即群号)
     limit: int = Form(100),           # 总结条数，建议默认加大一点
-    target_lang: str = Form("Chinese")
+    target_lang: str = Form("Chinese"),
+    fresh: bool = Form(False),        # 为 True 时跳过响应缓存，重新总结
+    mode: str = Form("auto")          # auto: 滚动总结 (只合并新消息)；map_reduce: 分段并发总结；single: 只总结预算内最近的消息
 ):
     """
     读取指定群/人的最近消息并调用 AI 总结
     """
     try:
         print(f"[Summarize] 收到总结请求 -> ID: {contact_id}, 条数: {limit}")
-        
-        # 1. 获取最近聊天文本
-        # include_media=True 确保图片里的 OCR 文字也能被 AI 读到
-        chat_text = get_recent_messages(contact_id, int(limit), include_media=True)
-        
-        if not chat_text:
+
+        if mode == "auto" and getattr(config, "ROLLING_SUMMARY_ENABLED", True):
+            summary, report = await rolling_summarize(contact_id, int(limit), target_lang, fresh)
+        else:
+            summary, report = await summarize_history(contact_id, int(limit), target_lang, fresh, mode)
+        if summary is None:
             return {"success": False, "summary": f"未找到 ID 为 {contact_id} 的聊天记录，或记录为空。"}
 
-        # 2. 构建 Prompt 或直接调用翻译器
-        translator = msg_trans(config.DASHSCOPE_API_KEY)
-        
-        summary = translator._call_api(chat_text, mode="summarize", target_lang=target_lang)
-        
-        return {"success": True, "summary": summary}
+        return {"success": True, "summary": summary, "report": report}
 
     except Exception as e:
         print(f"总结失败: {e}")
         return {"success": False, "summary": f"总结发生错误: {str(e)}"}
 
 
+@app.post("/api/msg/summarize/stream")
+async def summarize_chat_history_stream(
+    contact_id: str = Form(...),
+    limit: int = Form(100),
+    target_lang: str = Form("Chinese"),
+    fresh: bool = Form(False),
+    mode: str = Form("auto")
+):
+    """
+    /api/msg/summarize 的流式版本 (SSE)，首个片段在一次网络往返后即可到达前端
+    分段总结时先并发完成各分段摘要，再流式输出合并结果
+    """
+    plan = None
+    try:
+        if mode == "auto" and getattr(config, "ROLLING_SUMMARY_ENABLED", True):
+            plan = await plan_summary(contact_id, int(limit), target_lang, fresh)
+            prompt, report = (plan.prompt, plan.report) if plan else (None, None)
+        else:
+            prompt, report = await build_summary_prompt(contact_id, int(limit), target_lang, fresh, mode)
+    except Exception as e:
+        print(f"总结失败: {e}")
+        return {"success": False, "summary": f"总结发生错误: {str(e)}"}
+
+    if plan is not None and plan.summary is not None:
+        # 没有新消息，直接把保存的滚动总结作为一个片段发出
+        async def stored():
+            yield plan.summary
+        return _sse_response(stored(), {"success": True, "report": report})
+    if prompt is None:
+        return {"success": False, "summary": f"未找到 ID 为 {contact_id} 的聊天记录，或记录为空。"}
+
+    async def chunks():
+        parts = []
+        async for chunk in get_llm_client().astream(prompt, profile="summarize", fresh=fresh):
+            parts.append(chunk)
+            yield chunk
+        if plan is not None:
+            await run_blocking("disk", plan.commit, "".join(parts))
+
+    return _sse_response(chunks(), {"success": True, "report": report})
+
+
 
 # ===============================
 #  API 5: 重要消息提示
@@ -530,14 +703,17 @@ async def summarize_chat_history(
 @app.post("/api/msg/notification")
 async def msg_notification(
     contact_id: str = Form(...),  # 指定要检查的群号或QQ号
-    limit: int = Form(100)        # 检查最近多少条
+    limit: int = Form(100),       # 检查最近多少条
+    fresh: bool = Form(False),    # 为 True 时跳过响应缓存，重新分析
+    rescan: bool = Form(False)    # 为 True 时忽略已分析的位置，重新分析最近 limit 条
 ):
     """
     AI 智能提取指定会话中的重要消息（任务、DDL、文件等）
+    默认只分析上次之后的新消息，并与之前找到的重要消息合并返回
     """
     try:
         print(f"[Notification] 正在分析 {contact_id} 的重要消息...")
-        result = extract_important_messages(contact_id, limit)
+        result = await run_blocking("llm", extract_important_messages, contact_id, limit, fresh=fresh, rescan=rescan)
         return result
     except Exception as e:
         return {"success": False, "msg": str(e)}
@@ -557,7 +733,7 @@ async def get_reply_settings(contact_id: str = None):
     try:
         if contact_id:
             # 获取特定聊天的设置
-            enabled = get_reply_setting(contact_id)
+            enabled = await run_blocking("disk", get_reply_setting, contact_id)
             return {
                 "success": True,
                 "contact_id": contact_id,
@@ -565,7 +741,7 @@ async def get_reply_settings(contact_id: str = None):
             }
         else:
             # 获取所有聊天的设置
-            all_settings = get_all_reply_settings()
+            all_settings = await run_blocking("disk", get_all_reply_settings)
             return {
                 "success": True,
                 "settings": all_settings
@@ -583,7 +759,7 @@ async def update_reply_settings(
     更新指定聊天的自动回复设置
     """
     try:
-        success = set_reply_setting(contact_id, enabled)
+        success = await run_blocking("disk", set_reply_setting, contact_id, enabled)
         if success:
             return {
                 "success": True,
@@ -613,7 +789,7 @@ async def list_vector_dbs():
         if not multi_db_manager:
             return {"success": False, "msg": "多向量数据库管理器未初始化"}
 
-        available_dbs = multi_db_manager.get_available_databases(base_dir=config.DATA_DIR)
+        available_dbs = await run_blocking("disk", multi_db_manager.get_available_databases, base_dir=config.DATA_DIR)
         current_db_path = multi_db_manager.get_current_db_path()
 
         return {
@@ -636,7 +812,7 @@ async def switch_vector_db(
         if not multi_db_manager:
             return {"success": False, "msg": "多向量数据库管理器未初始化"}
 
-        success = multi_db_manager.switch_database(db_path)
+        success = await run_blocking("cpu", multi_db_manager.switch_database, db_path)
         if success:
             return {
                 "success": True,
@@ -819,18 +995,8 @@ async def get_chat_history(contact_id: str):
     获取指定联系人的完整聊天历史，用于前端本地搜索
     """
     try:
-        import os
-        import json
-
-        # 构建文件路径
-        file_path = os.path.join(config.HISTORY_JSON_DIR, f"{contact_id}.json")
-
-        if not os.path.exists(file_path):
-            return {"success": True, "history": []}
-
-        # 读取聊天历史
-        with open(file_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        # 读取聊天历史 (分段记录按时间正序拼接)
+        data = await run_blocking("disk", get_full_history, contact_id)
 
         # 返回完整的聊天历史，但只包含必要的字段用于搜索
         simplified_history = []
@@ -859,6 +1025,35 @@ async def get_chat_history(contact_id: str):
         return {"success": False, "error": str(e)}
 
 
+# ===============================
+# API 10: 系统运行状态
+# ===============================
+@app.get("/api/system/stats")
+async def get_system_stats():
+    """
+    返回后台入库任务队列、最近消息缓存、各子系统线程池、OCR / 文档缓存、回复决策合并、预筛、批量判断、推测执行以及大模型调用、限流与响应缓存的运行统计
+    """
+    try:
+        return {
+            "success": True,
+            "ingest": get_ingest_stats(),
+            "recent_cache": get_recent_cache_stats(),
+            "executors": executor_stats(),
+            "ocr_cache": get_ocr_cache().stats(),
+            "doc_cache": get_extraction_cache().stats(),
+            "reply_coalescer": get_reply_coalescer().stats(),
+            "reply_gate": get_reply_gate().stats(),
+            "reply_batcher": get_reply_batcher().stats(),
+            "reply_speculation": get_speculation_stats(),
+            "vector_db": get_vector_db_stats(),
+            "llm": get_llm_client().stats(),
+            "llm_limiter": get_rate_limiter().stats(),
+            "llm_cache": get_llm_cache().stats()
+        }
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file